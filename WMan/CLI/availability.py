@@ -1,32 +1,65 @@
+import datetime
 from typing import Optional
 
-from typer import Argument, Typer
+import rich
+from typer import Argument, Exit, Option, Typer, echo
 from typing_extensions import Annotated
 
-from WMan.database import ProductInfo
-from WMan.ProductManager import ColumnIndexes, ProductManager
+from WMan.client import get_server
+from WMan.database import BatchException, Paging, ProductInfo
+from WMan.ProductManager import ColumnIndexes, ProductManager, ProductSortKey
+from WMan.sheetutils.stream import OutputFormat
+from WMan.sheetutils import DEFAULT_WIDTH_SAMPLE
 
 app = Typer()
 
 
+def adjust_batch(
+    adjust_count_batch,
+    filepath: str,
+    indexes: ColumnIndexes,
+    encoding: str | None,
+    delimiter: str | None,
+) -> int:
+    try:
+        return adjust_count_batch(filepath, indexes, encoding, delimiter)
+    except BatchException as exception:
+        for error in exception.errors:
+            rich.print(f"[red]{error}[/red]")
+        raise Exit(1)
+
+
 @app.command()
 def add(code: str, count: Annotated[int, Argument(min=1)]):
     """
     Add AMOUNT to the specified product's availability
     """
+    if server := get_server():
+        return server.call("availability.add", code=code, count=count)
     product_to_add = ProductInfo(code=code, count=count)
     ProductManager.add_count(product_to_add)
 
 
 @app.command()
-def add_batch(filepath: str, code_column_index: int = 1, count_column_index: int = 2):
+def add_batch(
+    filepath: str,
+    code_column_index: int = 1,
+    count_column_index: int = 2,
+    encoding: Optional[str] = None,
+    delimiter: Optional[str] = None,
+):
     """
-    Add to the availability of the product from the specified file
+    Add to the availability of the product from the specified .xlsx or
+    CSV/TSV file. Nothing is applied if any row is invalid; every offending
+    row is reported.
     """
     indexes = ColumnIndexes(
         code_column=code_column_index, count_column=count_column_index
     )
-    ProductManager.add_count_batch(filepath, indexes)
+    adjusted_count = adjust_batch(
+        ProductManager.add_count_batch, filepath, indexes, encoding, delimiter
+    )
+    rich.print(f"Added to the availability of {adjusted_count} products")
 
 
 @app.command()
@@ -34,21 +67,32 @@ def reduce(code: str, amount: int):
     """
     Reduce AMOUNT from the specified product's availability
     """
+    if server := get_server():
+        return server.call("availability.reduce", code=code, count=amount)
     product_to_reduce = ProductInfo(code=code, count=amount)
     ProductManager.reduce_count(product_to_reduce)
 
 
 @app.command()
 def reduce_batch(
-    filepath: str, code_column_index: int = 1, count_column_index: int = 2
+    filepath: str,
+    code_column_index: int = 1,
+    count_column_index: int = 2,
+    encoding: Optional[str] = None,
+    delimiter: Optional[str] = None,
 ):
     """
-    Reduce the availability of the products from the specified file
+    Reduce the availability of the products from the specified .xlsx or
+    CSV/TSV file. Nothing is applied if any row is invalid or would go
+    negative; every offending row is reported.
     """
     indexes = ColumnIndexes(
         code_column=code_column_index, count_column=count_column_index
     )
-    ProductManager.reduce_count_batch(filepath, indexes)
+    adjusted_count = adjust_batch(
+        ProductManager.reduce_count_batch, filepath, indexes, encoding, delimiter
+    )
+    rich.print(f"Reduced the availability of {adjusted_count} products")
 
 
 @app.command()
@@ -59,10 +103,26 @@ def list(
     min_count: Optional[int] = None,
     max_count: Optional[int] = None,
     brand: Optional[str] = None,
+    width_sample: int = Option(
+        DEFAULT_WIDTH_SAMPLE,
+        help="Rows measured to size the .xlsx columns, 0 measures every row",
+    ),
+    max_width: Optional[int] = Option(None, help="Widest an .xlsx column may be"),
+    output_format: Optional[OutputFormat] = Option(
+        None,
+        "--format",
+        help="Stream the rows as JSON, JSON Lines or CSV to --output, or stdout",
+    ),
+    sort_by: Optional[ProductSortKey] = Option(None, help="Column to sort the rows by"),
+    descending: bool = Option(False, "--desc", help="Sort in descending order"),
+    limit: Optional[int] = Option(None, min=1, help="Rows to show at most"),
+    after: Optional[str] = Option(
+        None, help="Cursor printed by the previous page to continue from"
+    ),
 ):
     """
     Print the availability of the products by default or output them to an
-    .xlsx file
+    .xlsx file, or as JSON, JSON Lines or CSV
     """
     filters = {
         "min_price": min_price,
@@ -71,7 +131,14 @@ def list(
         "max_count": max_count,
         "brand": brand,
     }
-    ProductManager.list_availability(output, filters)
+    paging = None
+    if sort_by or descending or limit or after:
+        paging = Paging(sort_by.value if sort_by else None, descending, limit, after)
+    cursor = ProductManager.list_availability(
+        output, filters, width_sample or None, max_width, output_format, paging
+    )
+    if cursor:
+        echo(f"Next page: --after {cursor}", err=True)
 
 
 @app.command()
@@ -81,3 +148,25 @@ def info(codes: str):
     along with other information
     """
     ProductManager.get_availability(codes.split(","))
+
+
+@app.command()
+def at(
+    date: datetime.datetime = Option(..., help="The date in the format 'YYYY-MM-DD'"),
+    output: Optional[str] = None,
+    width_sample: int = Option(
+        DEFAULT_WIDTH_SAMPLE,
+        help="Rows measured to size the .xlsx columns, 0 measures every row",
+    ),
+    max_width: Optional[int] = Option(None, help="Widest an .xlsx column may be"),
+):
+    """
+    Print the availability of the products as it was at the end of the
+    specified date, or output it to an .xlsx file
+    """
+    end_of_day = datetime.datetime.combine(
+        date.date() + datetime.timedelta(days=1), datetime.time()
+    )
+    ProductManager.list_availability_before(
+        end_of_day, output, width_sample or None, max_width
+    )
@@ -1,6 +1,10 @@
-from typer import Typer
+from typing import Optional
 
+from typer import Option, Typer
+
+from WMan.client import get_server
 from WMan.CustomerManager import CustomerManager
+from WMan.sheetutils.stream import OutputFormat
 
 app = Typer()
 
@@ -10,13 +14,22 @@ def create(name: str):
     """
     Create a customer with the specified name.
     """
+    if server := get_server():
+        return server.call("customer.create", name=name)
     CustomerManager.create(name)
 
 
 # TODO: add cool filters to this command
 @app.command()
-def list():
+def list(
+    output_format: Optional[OutputFormat] = Option(
+        None,
+        "--format",
+        help="Stream the rows as JSON, JSON Lines or CSV to --output, or stdout",
+    ),
+    output: Optional[str] = Option(None, help="Path to write the --format output to"),
+):
     """
     List all the customers with their corresponding names and IDs
     """
-    CustomerManager.list({})
+    CustomerManager.list({}, output_format, output)
@@ -0,0 +1,39 @@
+import os
+
+import rich
+from typer import Typer
+
+from WMan.database import config, rebuild_search_index
+from WMan.OrderManager import OrderManager
+
+app = Typer()
+
+
+@app.command()
+def rebuild_totals():
+    """
+    Recompute the total count and price stored on every order, and the daily
+    sales they roll up into
+    """
+    order_count = OrderManager.rebuild_totals()
+    rich.print(f"Rebuilt the totals of {order_count} orders")
+
+
+@app.command()
+def rebuild_search():
+    """
+    Index every product for search again, from scratch
+    """
+    product_count = rebuild_search_index()
+    rich.print(f"Indexed {product_count} products for search")
+
+
+@app.command()
+def show_config():
+    """
+    Print the database path and the SQLite pragmas in effect
+    """
+    rich.print(f"Database: {os.path.abspath(config.database_path)}")
+    rich.print(f"Profile: {config.profile}")
+    for pragma, value in config.pragmas.items():
+        rich.print(f"  {pragma} = {value}")
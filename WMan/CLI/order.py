@@ -1,21 +1,49 @@
 from datetime import datetime
 from typing_extensions import Annotated
 
-import jdatetime
 import rich
 import typer
 
+from WMan.client import get_server
+from WMan.database import BatchException, Paging
 from WMan.OrderManager import (
     OrderManager,
     OrderProductIndexes,
     OrderProductInfo,
+    OrderSortKey,
     OrdersIO,
     OrderIO,
 )
+from WMan.sheetutils.stream import OutputFormat
+from WMan.sheetutils import DEFAULT_WIDTH_SAMPLE
 
 app = typer.Typer()
 
 
+def apply_batch(
+    order: OrderManager,
+    filename: str,
+    indexes: OrderProductIndexes,
+    operation: str,
+    dry_run: bool,
+    encoding: str | None,
+    delimiter: str | None,
+):
+    try:
+        line_count = order.apply_batch(
+            filename, indexes, operation, dry_run, encoding, delimiter
+        )
+    except BatchException as exception:
+        for error in exception.errors:
+            rich.print(f"[red]{error}[/red]")
+        raise typer.Exit(1)
+
+    if dry_run:
+        rich.print(f"No problems found, {line_count} order lines would change")
+    else:
+        rich.print(f"{line_count} order lines were changed")
+
+
 @app.command()
 def create(
     customer_name: str = typer.Argument(
@@ -30,11 +58,18 @@ def create(
     """
     input_date = datetime.today()
     if date:
+        import jdatetime
+
         input_date = jdatetime.datetime.strptime(
             f"{date.date()}", "%Y-%m-%d"
         ).togregorian()
-    new_order_manager = OrderManager.new(customer_name, input_date)
-    rich.print(f"New order with ID {new_order_manager.get_id()} was created")
+    if server := get_server():
+        order_id = server.call(
+            "order.create", customer_name=customer_name, date=input_date.date()
+        )
+    else:
+        order_id = OrderManager.new(customer_name, input_date).get_id()
+    rich.print(f"New order with ID {order_id} was created")
 
 
 @app.command()
@@ -50,6 +85,10 @@ def add(
     """
     Add a product to an existing order.
     """
+    if server := get_server():
+        return server.call(
+            "order.add", order_id=order_id, code=product_code, count=count
+        )
     order = OrderManager.from_id(order_id)
     new_order_product = OrderProductInfo(product_code, count)
     order.add_product(new_order_product)
@@ -62,23 +101,31 @@ def add_batch(
     ),
     filename: str = typer.Argument(
         ...,
-        help="The path to the Excel (.xlsx) file containing the products and their quantities.",
+        help="The path to the Excel (.xlsx) or CSV/TSV file containing the products and their quantities.",
     ),
     product_code_index: int = typer.Argument(
         1,
-        help="The column index of the product codes in the Excel file (default is 1).",
+        help="The column index of the product codes in the file (default is 1).",
     ),
     count_index: int = typer.Argument(
         2,
-        help="The column index of the product quantities in the Excel file (default is 2).",
+        help="The column index of the product quantities in the file (default is 2).",
+    ),
+    encoding: str = typer.Option(None, help="The encoding of CSV files."),
+    delimiter: str = typer.Option(
+        None, help="The delimiter of CSV files, detected when omitted."
+    ),
+    dry_run: bool = typer.Option(
+        False, help="Only report the problems of the file, without applying it."
     ),
 ):
     """
-    Add multiple products to an order from an Excel (.xlsx) file.
+    Add multiple products to an order from an Excel (.xlsx) or CSV/TSV file.
+    The whole file is applied in one transaction, or not at all.
     """
     order = OrderManager.from_id(order_id)
     indexes = OrderProductIndexes(product_code_index, count_index)
-    order.batch_apply(filename, indexes, order.add_product)
+    apply_batch(order, filename, indexes, "add", dry_run, encoding, delimiter)
 
 
 @app.command()
@@ -93,6 +140,8 @@ def remove(
     """
     Remove a product from an existing order.
     """
+    if server := get_server():
+        return server.call("order.remove", order_id=order_id, code=product_code)
     order = OrderManager.from_id(order_id)
     order.remove_product(OrderProductInfo(product_code))
 
@@ -103,19 +152,29 @@ def remove_batch(
         ..., help="The ID of the order from which the products will be removed."
     ),
     filename: str = typer.Argument(
-        ..., help="The path to the Excel (.xlsx) file containing the product codes."
+        ...,
+        help="The path to the Excel (.xlsx) or CSV/TSV file containing the product codes.",
     ),
     product_code_index: int = typer.Argument(
         1,
-        help="The column index of the product codes in the Excel file (default is 1).",
+        help="The column index of the product codes in the file (default is 1).",
+    ),
+    encoding: str = typer.Option(None, help="The encoding of CSV files."),
+    delimiter: str = typer.Option(
+        None, help="The delimiter of CSV files, detected when omitted."
+    ),
+    dry_run: bool = typer.Option(
+        False, help="Only report the problems of the file, without applying it."
     ),
 ):
     """
-    Remove multiple products from an order using an Excel (.xlsx) file.
+    Remove multiple products from an order using an Excel (.xlsx) or CSV/TSV
+    file.
+    The whole file is applied in one transaction, or not at all.
     """
     order = OrderManager.from_id(order_id)
     indexes = OrderProductIndexes(product_code_index=product_code_index)
-    order.batch_apply(filename, indexes, order.remove_product)
+    apply_batch(order, filename, indexes, "remove", dry_run, encoding, delimiter)
 
 
 @app.command()
@@ -133,6 +192,10 @@ def add_count(
     """
     Increase the quantity of a product in an existing order.
     """
+    if server := get_server():
+        return server.call(
+            "order.add_count", order_id=order_id, code=product_code, count=count
+        )
     order = OrderManager.from_id(order_id)
     order.add_count(OrderProductInfo(product_code, count))
 
@@ -141,25 +204,33 @@ def add_count(
 def add_count_batch(
     filename: str = typer.Argument(
         ...,
-        help="The path to the Excel (.xlsx) file containing the product codes and quantities to increase.",
+        help="The path to the Excel (.xlsx) or CSV/TSV file containing the product codes and quantities to increase.",
     ),
     order_id: int = typer.Argument(
         ..., help="The ID of the order where the product counts will be increased."
     ),
     product_code_index: int = typer.Argument(
         1,
-        help="The column index of the product codes in the Excel file (default is 1).",
+        help="The column index of the product codes in the file (default is 1).",
     ),
     count_index: int = typer.Argument(
-        2, help="The column index of the quantities in the Excel file (default is 2)."
+        2, help="The column index of the quantities in the file (default is 2)."
+    ),
+    encoding: str = typer.Option(None, help="The encoding of CSV files."),
+    delimiter: str = typer.Option(
+        None, help="The delimiter of CSV files, detected when omitted."
+    ),
+    dry_run: bool = typer.Option(
+        False, help="Only report the problems of the file, without applying it."
     ),
 ):
     """
-    Increase the quantities of multiple products in an order using an Excel (.xlsx) file.
+    Increase the quantities of multiple products in an order using an Excel (.xlsx) or CSV/TSV file.
+    The whole file is applied in one transaction, or not at all.
     """
     order = OrderManager.from_id(order_id)
     indexes = OrderProductIndexes(product_code_index, count_index)
-    order.batch_apply(filename, indexes, order.add_count)
+    apply_batch(order, filename, indexes, "add_count", dry_run, encoding, delimiter)
 
 
 @app.command()
@@ -177,6 +248,10 @@ def reduce_count(
     """
     Decrease the quantity of a product in an existing order.
     """
+    if server := get_server():
+        return server.call(
+            "order.reduce_count", order_id=order_id, code=product_code, count=count
+        )
     order = OrderManager.from_id(order_id)
     order.reduce_count(OrderProductInfo(product_code, count))
 
@@ -185,25 +260,33 @@ def reduce_count(
 def reduce_count_batch(
     filename: str = typer.Argument(
         ...,
-        help="The path to the Excel (.xlsx) file containing the product codes and quantities to decrease.",
+        help="The path to the Excel (.xlsx) or CSV/TSV file containing the product codes and quantities to decrease.",
     ),
     order_id: int = typer.Argument(
         ..., help="The ID of the order where the products of it will be reduced"
     ),
     product_code_index: int = typer.Argument(
         1,
-        help="The column index of the product codes in the Excel file (default is 1).",
+        help="The column index of the product codes in the file (default is 1).",
     ),
     count_index: int = typer.Argument(
-        2, help="The column index of the quantities in the Excel file (default is 2)."
+        2, help="The column index of the quantities in the file (default is 2)."
+    ),
+    encoding: str = typer.Option(None, help="The encoding of CSV files."),
+    delimiter: str = typer.Option(
+        None, help="The delimiter of CSV files, detected when omitted."
+    ),
+    dry_run: bool = typer.Option(
+        False, help="Only report the problems of the file, without applying it."
     ),
 ):
     """
-    Decrease the quantities of multiple products in an order using an Excel (.xlsx) file.
+    Decrease the quantities of multiple products in an order using an Excel (.xlsx) or CSV/TSV file.
+    The whole file is applied in one transaction, or not at all.
     """
     order = OrderManager.from_id(order_id)
     indexes = OrderProductIndexes(product_code_index, count_index)
-    order.batch_apply(filename, indexes, order.reduce_count)
+    apply_batch(order, filename, indexes, "reduce_count", dry_run, encoding, delimiter)
 
 
 @app.command()
@@ -223,6 +306,20 @@ def list(
     max_price: Annotated[
         int, typer.Option(help="Filter orders by their maximum price")
     ] = None,
+    output_format: OutputFormat = typer.Option(
+        None,
+        "--format",
+        help="Stream the rows as JSON, JSON Lines or CSV to --output, or stdout",
+    ),
+    output: str = typer.Option(None, help="Path to write the --format output to"),
+    sort_by: OrderSortKey = typer.Option(None, help="Column to sort the orders by"),
+    descending: bool = typer.Option(
+        False, "--desc", help="Sort in descending order"
+    ),
+    limit: int = typer.Option(None, min=1, help="Orders to show at most"),
+    after: str = typer.Option(
+        None, help="Cursor printed by the previous page to continue from"
+    ),
 ):
     """
     List orders alongside their customer, product count and total price
@@ -234,8 +331,17 @@ def list(
         "min_price": min_price,
         "max_price": max_price,
     }
-    orders_io = OrdersIO(OrderManager.get_orders(filters))
-    orders_io.print_orders()
+    paging = None
+    if sort_by or descending or limit or after:
+        paging = Paging(sort_by.value if sort_by else None, descending, limit, after)
+    if output_format:
+        cursor = OrderManager.write_orders(output_format, filters, output, paging)
+    else:
+        page = OrderManager.get_page(filters, paging)
+        OrdersIO(page.items).print_orders()
+        cursor = page.cursor
+    if cursor:
+        typer.echo(f"Next page: --after {cursor}", err=True)
 
 
 @app.command()
@@ -246,14 +352,27 @@ def info(
     output: str = typer.Option(
         None, help="Path to where the order's .xlsx file will be saved'"
     ),
+    width_sample: int = typer.Option(
+        DEFAULT_WIDTH_SAMPLE,
+        help="Rows measured to size the .xlsx columns, 0 measures every row",
+    ),
+    max_width: int = typer.Option(None, help="Widest an .xlsx column may be"),
+    output_format: OutputFormat = typer.Option(
+        None,
+        "--format",
+        help="Stream the rows as JSON, JSON Lines or CSV to --output, or stdout",
+    ),
 ):
     """
     Get detailed information about a specific order.
     """
     order = OrderManager.from_id(order_id)
+    if output_format:
+        order.write_products(output_format, output)
+        return
     product_infos = order.get_products()
     order_io = OrderIO(product_infos)
     if output:
-        order_io.save_products(output)
+        order_io.save_products(output, width_sample or None, max_width)
     else:
         order_io.print_products()
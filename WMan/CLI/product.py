@@ -1,9 +1,12 @@
 from typing import Optional
 
-from typer import Typer, prompt, Option
+from typer import Typer, echo, prompt, Option
 
-from WMan.ProductManager import ProductManager, ColumnIndexes
-from WMan.database import ProductInfo
+from WMan.client import get_server
+from WMan.ProductManager import ProductManager, ColumnIndexes, ProductSortKey
+from WMan.database import Paging, ProductInfo
+from WMan.sheetutils.stream import OutputFormat
+from WMan.sheetutils import DEFAULT_WIDTH_SAMPLE
 
 
 app = Typer()
@@ -29,6 +32,16 @@ def add(
         count_in_carton = prompt("Enter the count in carton", type=int)
     pass
 
+    if server := get_server():
+        return server.call(
+            "product.add",
+            code=code,
+            description=description,
+            brand=brand,
+            price=price,
+            count_in_carton=count_in_carton,
+        )
+
     new_product = ProductInfo(
         code=code,
         description=description,
@@ -48,9 +61,14 @@ def add_batch(
     brand_column: int = 7,
     price_column: int = 4,
     count_in_carton: int = 2,
+    encoding: Optional[str] = Option(None, help="The encoding of CSV files"),
+    delimiter: Optional[str] = Option(
+        None, help="The delimiter of CSV files, detected when omitted"
+    ),
 ):
     """
-    Add multiple products from a .xlsx file
+    Add multiple products from a .xlsx or CSV/TSV file. Existing products
+    are updated with the non-empty cells of their row.
     """
     indexes = ColumnIndexes(
         code_column=id_column,
@@ -59,10 +77,8 @@ def add_batch(
         price_column=price_column,
         count_in_carton_column=count_in_carton
     )
-    ProductManager.add_batch(
-            filepath,
-            indexes
-    )
+    result = ProductManager.add_batch(filepath, indexes, encoding, delimiter)
+    ProductManager.print_load_result(result)
 
 
 @app.command()
@@ -71,24 +87,93 @@ def list(
     brand: Optional[str] = None,
     min_price: Optional[int] = None,
     max_price: Optional[int] = None,
+    width_sample: int = Option(
+        DEFAULT_WIDTH_SAMPLE,
+        help="Rows measured to size the .xlsx columns, 0 measures every row",
+    ),
+    max_width: Optional[int] = Option(None, help="Widest an .xlsx column may be"),
+    output_format: Optional[OutputFormat] = Option(
+        None,
+        "--format",
+        help="Stream the rows as JSON, JSON Lines or CSV to --output, or stdout",
+    ),
+    sort_by: Optional[ProductSortKey] = Option(None, help="Column to sort the rows by"),
+    descending: bool = Option(False, "--desc", help="Sort in descending order"),
+    limit: Optional[int] = Option(None, min=1, help="Rows to show at most"),
+    after: Optional[str] = Option(
+        None, help="Cursor printed by the previous page to continue from"
+    ),
 ):
     """
     List all products or specific products
     """
-    ProductManager.list_products(
+    paging = None
+    if sort_by or descending or limit or after:
+        paging = Paging(sort_by.value if sort_by else None, descending, limit, after)
+    cursor = ProductManager.list_products(
         output=output, filters= {
             "brand": brand,
             "min_price": min_price,
             "max_price": max_price
-        }
+        },
+        width_sample=width_sample or None,
+        max_width=max_width,
+        output_format=output_format,
+        paging=paging,
+    )
+    if cursor:
+        echo(f"Next page: --after {cursor}", err=True)
+
+
+@app.command()
+def search(
+    query: str,
+    output: Optional[str] = None,
+    brand: Optional[str] = None,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    min_count: Optional[int] = None,
+    max_count: Optional[int] = None,
+    limit: Optional[int] = Option(20, min=1, help="Rows to show at most"),
+    width_sample: int = Option(
+        DEFAULT_WIDTH_SAMPLE,
+        help="Rows measured to size the .xlsx columns, 0 measures every row",
+    ),
+    max_width: Optional[int] = Option(None, help="Widest an .xlsx column may be"),
+    output_format: Optional[OutputFormat] = Option(
+        None,
+        "--format",
+        help="Stream the rows as JSON, JSON Lines or CSV to --output, or stdout",
+    ),
+):
+    """
+    Find products by the beginnings of the words in their code, description
+    or brand, best matches first
+    """
+    ProductManager.search(
+        query,
+        filters={
+            "brand": brand,
+            "min_price": min_price,
+            "max_price": max_price,
+            "min_count": min_count,
+            "max_count": max_count,
+        },
+        limit=limit,
+        output=output,
+        width_sample=width_sample or None,
+        max_width=max_width,
+        output_format=output_format,
     )
-    pass
+
 
 @app.command()
 def remove(code: str):
     """
     Delete the product with the given code
     """
+    if server := get_server():
+        return server.call("product.remove", code=code)
     ProductManager.remove(code)
     pass
 
@@ -122,9 +207,13 @@ def update_batch(
     brand_column: int = 7,
     price_column: int = 4,
     count_in_carton: int = 2,
+    encoding: Optional[str] = Option(None, help="The encoding of CSV files"),
+    delimiter: Optional[str] = Option(
+        None, help="The delimiter of CSV files, detected when omitted"
+    ),
 ):
     """
-    Update multiple products from a .xlsx file
+    Update multiple products from a .xlsx or CSV/TSV file
     """
     indexes = ColumnIndexes(
         code_column=id_column,
@@ -134,7 +223,5 @@ def update_batch(
         count_in_carton_column=count_in_carton
     )
 
-    ProductManager.update_batch(
-        filepath,
-        indexes,
-    )
+    result = ProductManager.update_batch(filepath, indexes, encoding, delimiter)
+    ProductManager.print_load_result(result)
@@ -0,0 +1,111 @@
+from datetime import datetime
+
+import rich
+import typer
+from typing_extensions import Annotated
+
+from WMan.ReportManager import ReportManager, SalesGroup
+from WMan.sheetutils import DEFAULT_WIDTH_SAMPLE
+from WMan.sheetutils.stream import OutputFormat
+
+app = typer.Typer()
+
+
+@app.command()
+def statements(
+    output_dir: Annotated[
+        str, typer.Option(help="Directory the statements are written to")
+    ],
+    start_date: Annotated[
+        datetime, typer.Option(help="Only include orders from this date on")
+    ] = None,
+    end_date: Annotated[
+        datetime, typer.Option(help="Only include orders up to this date")
+    ] = None,
+    customer: Annotated[
+        str, typer.Option(help="Only write the statement of this customer")
+    ] = None,
+    workers: Annotated[
+        int,
+        typer.Option(
+            min=1, help="Processes rendering the workbooks, defaults to the CPU count"
+        ),
+    ] = None,
+    title: Annotated[str, typer.Option(help="Title of every statement")] = "Statement",
+    width_sample: int = typer.Option(
+        DEFAULT_WIDTH_SAMPLE,
+        help="Rows measured to size the .xlsx columns, 0 measures every row",
+    ),
+    max_width: int = typer.Option(None, help="Widest an .xlsx column may be"),
+):
+    """
+    Write one .xlsx statement per customer with the lines of all their orders
+    in the period.
+    """
+    filters = {
+        "customer": customer,
+        "start_date": start_date.date() if start_date else None,
+        "end_date": end_date.date() if end_date else None,
+    }
+    dates = [date.strftime("%Y-%m-%d") for date in (start_date, end_date) if date]
+    period = " to ".join(dates) if dates else "All orders"
+    summary = ReportManager.write_statements(
+        output_dir,
+        filters,
+        workers,
+        title,
+        period,
+        width_sample or None,
+        max_width,
+    )
+    rich.print(
+        f"Wrote {summary.statements} statements covering {summary.orders} orders "
+        f"and {summary.lines} lines to {output_dir} in {summary.seconds:.1f} s "
+        f"using {summary.workers} workers"
+    )
+
+
+@app.command()
+def sales(
+    group_by: Annotated[
+        SalesGroup, typer.Option(help="What to total the sales by")
+    ] = SalesGroup.product,
+    start_date: Annotated[
+        datetime, typer.Option(help="Only include orders from this date on")
+    ] = None,
+    end_date: Annotated[
+        datetime, typer.Option(help="Only include orders up to this date")
+    ] = None,
+    output: Annotated[
+        str, typer.Option(help="Path of the .xlsx file, or of the --format output")
+    ] = None,
+    output_format: OutputFormat = typer.Option(
+        None,
+        "--format",
+        help="Write the rows as JSON, JSON Lines or CSV to --output, or stdout",
+    ),
+    width_sample: int = typer.Option(
+        DEFAULT_WIDTH_SAMPLE,
+        help="Rows measured to size the .xlsx columns, 0 measures every row",
+    ),
+    max_width: int = typer.Option(None, help="Widest an .xlsx column may be"),
+):
+    """
+    Print the units sold and the revenue per product, brand, customer, day or
+    month, or output them to an .xlsx file, or as JSON or CSV
+    """
+    filters = {
+        "start_date": start_date.date() if start_date else None,
+        "end_date": end_date.date() if end_date else None,
+    }
+    dates = [date.strftime("%Y-%m-%d") for date in (start_date, end_date) if date]
+    period = " to ".join(dates) if dates else "All orders"
+    ReportManager.report_sales(
+        group_by,
+        filters,
+        period,
+        output,
+        output_format,
+        width_sample or None,
+        max_width,
+    )
@@ -1,7 +1,8 @@
 import rich
-from rich.table import Table
 
-from WMan.database import Customer
+from WMan.database import Customer, read_snapshot
+from WMan.profiling import phase
+from WMan.sheetutils.stream import OutputFormat, write_rows
 
 
 class CustomerManager:
@@ -10,12 +11,25 @@ class CustomerManager:
         Customer.add(name)
 
     @staticmethod
-    def list(filters: dict[str, str | int | None]):
-        table = Table(title="Customers")
-        table.add_column("ID", justify="center", style="cyan")
-        table.add_column("Name", justify="center", style="green")
+    def list(
+        filters: dict[str, str | int | None],
+        output_format: OutputFormat | None = None,
+        output: str | None = None,
+    ):
+        if output_format:
+            with read_snapshot():
+                rows = Customer.get_filtered_rows(filters)
+                write_rows(rows, ["id", "name"], output_format, output)
+            return
 
-        for customer in Customer.get_filtered(filters):
-            table.add_row(str(customer.id), customer.name)
+        from rich.table import Table
 
-        rich.print(table)
+        with phase("render"):
+            table = Table(title="Customers")
+            table.add_column("ID", justify="center", style="cyan")
+            table.add_column("Name", justify="center", style="green")
+
+            for customer in Customer.get_filtered(filters):
+                table.add_row(str(customer.id), customer.name)
+
+            rich.print(table)
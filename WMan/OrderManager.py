@@ -1,14 +1,47 @@
 import datetime
-from typing import Callable
+from enum import Enum
+from typing import Iterator
 import rich
-from rich.table import Table
 
 import WMan.database as database
-from WMan.ProductManager import ColumnIndexes
-from WMan.sheetutils.reader import SheetReader
-from WMan.sheetutils.writer import SheetWriter
+from WMan.profiling import in_phase
+from WMan.sheetutils import DEFAULT_WIDTH_SAMPLE
+from WMan.sheetutils.reader import (
+    Converters,
+    get_cell,
+    open_reader,
+    to_int,
+    to_str,
+)
+from WMan.sheetutils.stream import OutputFormat, write_rows
 from WMan.database import OrderProductInfo
 
+# Columns of the machine-readable order listings
+ORDER_COLUMNS = ["id", "total_count", "total_price", "customer_name", "date"]
+ORDER_PRODUCT_COLUMNS = [
+    "code",
+    "description",
+    "brand",
+    "count",
+    "price",
+    "total_price",
+]
+ORDER_PRODUCT_FIELDS = [
+    database.Product.id,
+    database.Product.description,
+    database.Product.brand,
+    database.OrderProduct.count,
+    database.Product.price,
+    database.Product.price * database.OrderProduct.count,
+]
+
+
+class OrderSortKey(str, Enum):
+    id = "id"
+    date = "date"
+    total_count = "total_count"
+    total_price = "total_price"
+
 
 class OrderProductIndexes:
     def __init__(
@@ -17,11 +50,22 @@ class OrderProductIndexes:
         self.product_code = product_code_index
         self.count = count_index
 
+    def get_converters(self) -> Converters:
+        converters = {self.product_code: to_str, self.count: to_int}
+        return {
+            index: converter
+            for index, converter in converters.items()
+            if index is not None
+        }
+
 
 class OrdersIO:
     def __init__(self, orders: list[database.OrderInfo]) -> None:
         self.orders = orders
 
+        # rich.table is only loaded by the commands that print one
+        from rich.table import Table
+
         self.table = Table(title="Orders")
         self.table.add_column("ID", style="cyan")
         self.table.add_column("Customer Name", style="magenta")
@@ -29,6 +73,7 @@ class OrdersIO:
         self.table.add_column("Total Price", style="yellow")
         self.table.add_column("Total Count", style="blue")
 
+    @in_phase("render")
     def print_orders(self):
         for order in self.orders:
             self.table.add_row(
@@ -60,8 +105,17 @@ class OrdersIO:
 
 
 class OrderIO:
-    def __init__(self, products: list[database.ProductInfo]) -> None:
+    def __init__(
+        self,
+        products: list[database.ProductInfo],
+        header: str = "Order",
+        subheader: tuple[str, str] = ("Buyer:", "Order"),
+    ) -> None:
         self.products = products
+        self.header = header
+        self.subheader = subheader
+
+        from rich.table import Table
 
         self.table = Table(title="Products")
         self.table.add_column("Code", style="cyan")
@@ -71,6 +125,7 @@ class OrderIO:
         self.table.add_column("Price", style="yellow")
         self.table.add_column("Total Price", style="red")
 
+    @in_phase("render")
     def print_products(self):
         for product in self.products:
             self.table.add_row(
@@ -102,8 +157,24 @@ class OrderIO:
 
         rich.print(self.table)
 
-    def save_products(self, path: str) -> None:
-        data = [
+    def save_products(
+        self,
+        path: str,
+        width_sample: int | None = DEFAULT_WIDTH_SAMPLE,
+        max_width: int | None = None,
+    ) -> None:
+        from WMan.sheetutils.writer import StreamingSheetWriter
+
+        writer = StreamingSheetWriter(
+            headers=["Code", "Description", "Brand", "Count", "Price", "Full Price"],
+            header=self.header,
+            subheader=self.subheader,
+            table_name="Order",
+            currency_columns=[6, 7],
+            width_sample=width_sample,
+            max_width=max_width,
+        )
+        writer.add_data(
             [
                 product.code,
                 product.description,
@@ -113,21 +184,7 @@ class OrderIO:
                 product.price * product.count,
             ]
             for product in self.products
-        ]
-
-        headers = ["Code", "Description", "Brand", "Count", "Price", "Full Price"]
-
-        writer = SheetWriter()
-        writer.add_data(data)
-        writer.add_headers(headers)
-        writer.add_row_index_column()
-        writer.add_subheader("Buyer:", "Order")
-        writer.add_header("Order")
-        writer.make_table("Order", start_row=3)
-        writer.set_column_currency_format(7)
-        writer.set_column_currency_format(6)
-        writer.set_optimal_column_widths()
-
+        )
         writer.save(path)
 
 
@@ -152,30 +209,34 @@ class OrderManager:
         order_product_list: list[str | int], indexes: OrderProductIndexes
     ):
         return OrderProductInfo(
-            product_code=(
-                order_product_list[indexes.product_code]
-                if indexes.product_code is not None
-                else None
-            ),
-            count=(
-                order_product_list[indexes.count] if indexes.count is not None else None
-            ),
+            product_code=get_cell(order_product_list, indexes.product_code),
+            count=get_cell(order_product_list, indexes.count),
         )
 
-    def batch_apply(
+    def apply_batch(
         self,
         filepath: str,
-        indexes: ColumnIndexes,
-        method_to_apply: Callable[[OrderProductInfo], None],
-        *args,
-    ):
-        reader = SheetReader(filepath)
-        data = reader.get_data()
-        for order_product in data:
-            new_order_product_info = self.get_order_product_from_indexes(
-                order_product, indexes
+        indexes: OrderProductIndexes,
+        operation: str,
+        dry_run: bool = False,
+        encoding: str | None = None,
+        delimiter: str | None = None,
+    ) -> int:
+        start_row = 2
+        with open_reader(
+            filepath, encoding, delimiter, indexes.get_converters()
+        ) as reader:
+            order_products = (
+                self.get_order_product_from_indexes(row, indexes)
+                for row in reader.iter_rows(start_row)
+            )
+            rows = (
+                (row_number, order_product.product_code, order_product.count)
+                for row_number, order_product in enumerate(order_products, start_row)
+            )
+            return database.Order.apply_batch(
+                self.get_id(), rows, operation, dry_run=dry_run
             )
-            method_to_apply(new_order_product_info, *args)
 
     def add_product(self, order_product: OrderProductInfo):
         database.Order.add_product(
@@ -202,9 +263,76 @@ class OrderManager:
 
     @staticmethod
     def get_orders(
-        filters: dict[str, str | int | None] = {},
+        filters: dict[str, str | int | None] | None = None,
     ) -> list[database.OrderInfo]:
         return database.Order.get_filtered(filters)
 
+    @staticmethod
+    def get_page(
+        filters: dict[str, str | int | None] | None = None,
+        paging: database.Paging | None = None,
+    ) -> database.Page:
+        """
+        The matching orders, or one keyset page of them when paging is given.
+        """
+        if paging is None:
+            return database.Page(database.Order.get_filtered(filters), None)
+        page = database.Order.get_page(filters, paging)
+        return database.Page([database.OrderInfo(*row) for row in page], page.cursor)
+
+    @staticmethod
+    def iter_pages(
+        filters: dict[str, str | int | None] | None = None,
+        sort_by: str | None = None,
+        descending: bool = False,
+        page_size: int = 500,
+        after: str | None = None,
+    ) -> Iterator[database.Page]:
+        """
+        Go through the matching orders page by page, each page starting where
+        the previous one ended.
+        """
+        while True:
+            page = OrderManager.get_page(
+                filters, database.Paging(sort_by, descending, page_size, after)
+            )
+            yield page
+            if page.cursor is None:
+                return
+            after = page.cursor
+
+    @staticmethod
+    def write_orders(
+        output_format: OutputFormat,
+        filters: dict[str, str | int | None] | None = None,
+        output: str | None = None,
+        paging: database.Paging | None = None,
+    ) -> str | None:
+        with database.read_snapshot():
+            if paging is None:
+                rows = database.Order.get_filtered_rows(filters)
+                write_rows(rows, ORDER_COLUMNS, output_format, output)
+                return None
+            page = database.Order.get_page(filters, paging)
+            write_rows(page, ORDER_COLUMNS, output_format, output)
+            return page.cursor
+
+    def write_products(
+        self, output_format: OutputFormat, output: str | None = None
+    ) -> None:
+        with database.read_snapshot():
+            rows = database.Order.get_order_product_rows(
+                self.get_id(), *ORDER_PRODUCT_FIELDS
+            )
+            write_rows(rows, ORDER_PRODUCT_COLUMNS, output_format, output)
+
     def get_id(self):
         return self.order.id
+
+    @staticmethod
+    def rebuild_totals() -> int:
+        with database.db.atomic():
+            database.add_order_total_columns()
+            order_count = database.Order.refresh_totals()
+            database.rebuild_sales_rollups()
+        return order_count
@@ -1,12 +1,50 @@
-from typing import Callable
+import datetime
+from enum import Enum
+from typing import Iterator
 
-import babel.numbers
 import rich
-from rich.table import Table
 
-from WMan.database import Product, ProductInfo, db, get_or_raise
-from WMan.sheetutils.reader import SheetReader
-from WMan.sheetutils.writer import SheetWriter
+from WMan.database import (
+    CatalogueLoadResult,
+    Order,
+    Page,
+    Paging,
+    Product,
+    ProductInfo,
+    db,
+    get_or_raise,
+    read_snapshot,
+)
+from WMan.profiling import in_phase
+from WMan.sheetutils import DEFAULT_WIDTH_SAMPLE
+from WMan.sheetutils.reader import (
+    Converters,
+    get_cell,
+    open_reader,
+    to_int,
+    to_str,
+)
+from WMan.sheetutils.stream import OutputFormat, write_rows
+
+# Columns of the machine-readable product and availability listings, in the
+# order of their .xlsx exports
+PRODUCT_COLUMNS = ["code", "description", "brand", "count_in_carton", "price"]
+PRODUCT_FIELDS = [
+    Product.id,
+    Product.description,
+    Product.brand,
+    Product.count_in_carton,
+    Product.price,
+]
+AVAILABILITY_COLUMNS = PRODUCT_COLUMNS + ["total_price", "count"]
+AVAILABILITY_FIELDS = PRODUCT_FIELDS + [Product.price * Product.count, Product.count]
+
+
+class ProductSortKey(str, Enum):
+    code = "code"
+    brand = "brand"
+    price = "price"
+    count = "count"
 
 
 class ColumnIndexes:
@@ -26,6 +64,19 @@ class ColumnIndexes:
         self.count_in_carton = count_in_carton_column
         self.count = count_column
 
+    def get_converters(self) -> Converters:
+        converters = {
+            self.code: to_str,
+            self.price: to_int,
+            self.count_in_carton: to_int,
+            self.count: to_int,
+        }
+        return {
+            index: converter
+            for index, converter in converters.items()
+            if index is not None
+        }
+
 
 class ProductManager:
     def __init__(self):
@@ -35,45 +86,77 @@ class ProductManager:
     @staticmethod
     def get_product_from_indexes(product: list, indexes: ColumnIndexes):
         return ProductInfo(
-            code=product[indexes.code] if indexes.code is not None else None,
-            description=(
-                product[indexes.description]
-                if indexes.description is not None
-                else None
-            ),
-            brand=product[indexes.brand] if indexes.brand is not None else None,
-            price=product[indexes.price] if indexes.price is not None else None,
-            count_in_carton=(
-                product[indexes.count_in_carton]
-                if indexes.count_in_carton is not None
-                else None
-            ),
-            count=product[indexes.count] if indexes.count is not None else None,
+            code=get_cell(product, indexes.code),
+            description=get_cell(product, indexes.description),
+            brand=get_cell(product, indexes.brand),
+            price=get_cell(product, indexes.price),
+            count_in_carton=get_cell(product, indexes.count_in_carton),
+            count=get_cell(product, indexes.count),
         )
 
     @staticmethod
-    def batch_apply(
+    def adjust_count_batch(
         filepath: str,
         indexes: ColumnIndexes,
-        method_to_apply: Callable[[ProductInfo], None],
-        *args,
+        reduce: bool,
+        encoding: str | None = None,
+        delimiter: str | None = None,
     ):
-        reader = SheetReader(filepath)
-        data = reader.get_data()
-        for product in data:
-            new_product = ProductManager.get_product_from_indexes(product, indexes)
-            method_to_apply(new_product, *args)
+        start_row = 2
+        with open_reader(
+            filepath, encoding, delimiter, indexes.get_converters()
+        ) as reader:
+            rows = (
+                (
+                    row_number,
+                    get_cell(product, indexes.code),
+                    get_cell(product, indexes.count),
+                )
+                for row_number, product in enumerate(
+                    reader.iter_rows(start_row), start_row
+                )
+            )
+            return Product.adjust_count_batch(rows, reduce=reduce)
 
     @staticmethod
     def add(product_info: ProductInfo):
         Product.add(product_info)
 
     @staticmethod
-    def add_batch(filepath: str, indexes: ColumnIndexes):
-        ProductManager.batch_apply(filepath, indexes, ProductManager.add)
+    def load_catalogue(
+        filepath: str,
+        indexes: ColumnIndexes,
+        insert_missing: bool,
+        encoding: str | None = None,
+        delimiter: str | None = None,
+    ) -> CatalogueLoadResult:
+        with open_reader(
+            filepath, encoding, delimiter, indexes.get_converters()
+        ) as reader:
+            products = (
+                ProductManager.get_product_from_indexes(product, indexes)
+                for product in reader.iter_rows()
+            )
+            return Product.upsert_batch(products, insert_missing=insert_missing)
 
     @staticmethod
+    def add_batch(
+        filepath: str,
+        indexes: ColumnIndexes,
+        encoding: str | None = None,
+        delimiter: str | None = None,
+    ) -> CatalogueLoadResult:
+        return ProductManager.load_catalogue(
+            filepath, indexes, True, encoding, delimiter
+        )
+
+    @staticmethod
+    @in_phase("render")
     def print_products(products):
+        # Only the output paths pay for the table and currency formatting
+        import babel.numbers
+        from rich.table import Table
+
         table = Table(title="Products")
         table.add_column("Code", justify="center", style="cyan")
         table.add_column("Description", justify="right", style="magenta")
@@ -95,10 +178,24 @@ class ProductManager:
         rich.print(table)
 
     @staticmethod
-    def save_products(filepath: str, products):
-        writer = SheetWriter()
-
-        data = [
+    def save_products(
+        filepath: str,
+        products,
+        width_sample: int | None = DEFAULT_WIDTH_SAMPLE,
+        max_width: int | None = None,
+    ):
+        from WMan.sheetutils.writer import StreamingSheetWriter
+
+        writer = StreamingSheetWriter(
+            headers=["Code", "Description", "Brand", "CIC", "Price"],
+            header="Product list",
+            subheader=("Cool", "Subheader"),
+            table_name="Pricelist",
+            currency_columns=[6],
+            width_sample=width_sample,
+            max_width=max_width,
+        )
+        writer.add_data(
             [
                 product.code,
                 product.description,
@@ -107,31 +204,83 @@ class ProductManager:
                 product.price,
             ]
             for product in products
-        ]
+        )
+        writer.save(filepath)
 
-        headers = ["Code", "Description", "Brand", "CIC", "Price"]
+    @staticmethod
+    def get_page(
+        filters: dict[str, str | int | None] | None = None, paging: Paging | None = None
+    ) -> Page:
+        """
+        The matching products, or one keyset page of them when paging is given.
+        """
+        if paging is None:
+            return Page(Product.get_filtered(filters), None)
+        page = Product.get_page(filters, paging)
+        return Page([ProductInfo(*row) for row in page], page.cursor)
 
-        writer.add_data(data)
-        writer.add_headers(headers)
-        writer.add_row_index_column()
-        writer.add_subheader("Cool", "Subheader")
-        writer.add_header("Product list")
-        writer.make_table("Pricelist", start_row=3)
-        writer.set_column_currency_format(6)
-        writer.set_optimal_column_widths()
+    @staticmethod
+    def iter_pages(
+        filters: dict[str, str | int | None] | None = None,
+        sort_by: str | None = None,
+        descending: bool = False,
+        page_size: int = 500,
+        after: str | None = None,
+    ) -> Iterator[Page]:
+        """
+        Go through the matching products page by page, each page starting
+        where the previous one ended.
+        """
+        while True:
+            page = ProductManager.get_page(
+                filters, Paging(sort_by, descending, page_size, after)
+            )
+            yield page
+            if page.cursor is None:
+                return
+            after = page.cursor
 
-        writer.save(filepath)
+    @staticmethod
+    def stream_products(
+        filters: dict[str, str | int | None] | None,
+        paging: Paging | None,
+        fields: list,
+        columns: list[str],
+        output_format: OutputFormat,
+        output: str | None = None,
+    ) -> str | None:
+        with read_snapshot():
+            if paging is None:
+                rows = Product.get_filtered_rows(filters, *fields)
+                write_rows(rows, columns, output_format, output)
+                return None
+            page = Product.get_page(filters, paging, fields)
+            write_rows(page, columns, output_format, output)
+            return page.cursor
 
     @staticmethod
     def list_products(
-        output: str | None = None, filters: dict[str, str | int | None] = {}
-    ):
-        products = Product.get_filtered(filters=filters)
-
+        output: str | None = None,
+        filters: dict[str, str | int | None] | None = None,
+        width_sample: int | None = DEFAULT_WIDTH_SAMPLE,
+        max_width: int | None = None,
+        output_format: OutputFormat | None = None,
+        paging: Paging | None = None,
+    ) -> str | None:
+        if output_format:
+            return ProductManager.stream_products(
+                filters, paging, PRODUCT_FIELDS, PRODUCT_COLUMNS, output_format, output
+            )
         if output:
-            ProductManager.save_products(filepath=output, products=products)
+            with read_snapshot():
+                page = ProductManager.get_page(filters, paging)
+                ProductManager.save_products(
+                    output, page.items, width_sample, max_width
+                )
         else:
-            ProductManager.print_products(products)
+            page = ProductManager.get_page(filters, paging)
+            ProductManager.print_products(page.items)
+        return page.cursor
 
     @staticmethod
     def remove(code: str):
@@ -139,39 +288,90 @@ class ProductManager:
 
     @staticmethod
     def update(edited_product: ProductInfo):
-        selected_product: Product = get_or_raise(Product, edited_product.code)
-        if edited_product.description:
-            selected_product.description = edited_product.description
-        if edited_product.brand:
-            selected_product.brand = edited_product.brand
-        if edited_product.price:
-            selected_product.price = edited_product.price
-        if edited_product.count_in_carton:
-            selected_product.count_in_carton = edited_product.count_in_carton
-        selected_product.save()
+        # Read and written in one write transaction, and only the edited
+        # fields are written, so the count of concurrent order and
+        # availability changes is never written back stale
+        with db.atomic("IMMEDIATE"):
+            selected_product: Product = get_or_raise(Product, edited_product.code)
+            repriced = False
+            edited_fields = []
+            if edited_product.description:
+                selected_product.description = edited_product.description
+                edited_fields.append(Product.description)
+            if edited_product.brand:
+                selected_product.brand = edited_product.brand
+                edited_fields.append(Product.brand)
+            if edited_product.price:
+                repriced = selected_product.price != edited_product.price
+                selected_product.price = edited_product.price
+                edited_fields.append(Product.price)
+            if edited_product.count_in_carton:
+                selected_product.count_in_carton = edited_product.count_in_carton
+                edited_fields.append(Product.count_in_carton)
+            if edited_fields:
+                selected_product.save(only=edited_fields)
+            if repriced:
+                Order.refresh_totals(product_codes=[selected_product.id])
+
+    @staticmethod
+    def update_batch(
+        filepath: str,
+        indexes: ColumnIndexes,
+        encoding: str | None = None,
+        delimiter: str | None = None,
+    ) -> CatalogueLoadResult:
+        return ProductManager.load_catalogue(
+            filepath, indexes, False, encoding, delimiter
+        )
 
     @staticmethod
-    def update_batch(filepath: str, indexes: ColumnIndexes):
-        ProductManager.batch_apply(filepath, indexes, ProductManager.update)
+    def print_load_result(result: CatalogueLoadResult):
+        rich.print(
+            f"{result.inserted} inserted, {result.updated} updated, "
+            f"{result.unchanged} unchanged"
+        )
+        if result.missing:
+            rich.print(
+                f"[red]{len(result.missing)} products were not found:[/red] "
+                + ", ".join(result.missing)
+            )
 
     @staticmethod
     def add_count(product: ProductInfo):
         Product.add_count(product.code, product.count)
 
     @staticmethod
-    def add_count_batch(filepath: str, column_index: ColumnIndexes):
-        ProductManager.batch_apply(filepath, column_index, ProductManager.add_count)
+    def add_count_batch(
+        filepath: str,
+        column_index: ColumnIndexes,
+        encoding: str | None = None,
+        delimiter: str | None = None,
+    ) -> int:
+        return ProductManager.adjust_count_batch(
+            filepath, column_index, False, encoding, delimiter
+        )
 
     @staticmethod
     def reduce_count(product: ProductInfo):
         Product.reduce_count(product.code, product.count)
 
     @staticmethod
-    def reduce_count_batch(filepath: str, column_index: ColumnIndexes):
-        ProductManager.batch_apply(filepath, column_index, ProductManager.reduce_count)
+    def reduce_count_batch(
+        filepath: str,
+        column_index: ColumnIndexes,
+        encoding: str | None = None,
+        delimiter: str | None = None,
+    ) -> int:
+        return ProductManager.adjust_count_batch(
+            filepath, column_index, True, encoding, delimiter
+        )
 
     @staticmethod
+    @in_phase("render")
     def print_availability(products):
+        import babel.numbers
+        from rich.table import Table
+
         table = Table(title="Availability")
         table.add_column("Code", justify="center", style="cyan")
         table.add_column("Description", justify="right", style="magenta")
@@ -181,26 +381,30 @@ class ProductManager:
         table.add_column("Total Price", justify="center", style="cyan")
         table.add_column("Count", justify="right", style="yellow")
 
+        def format_price(price: int | None) -> str:
+            if price is None:
+                return ""
+            return babel.numbers.format_currency(
+                price, "IRR", format="¤¤ #,##0", locale="en_US"
+            )
+
         total_count = 0
         total_price = 0
 
         for product in products:
+            # Products removed since a past date have no price any more
+            product_total = None
+            if product.price is not None:
+                product_total = product.price * product.count
+                total_price += product_total
             total_count += product.count
-            total_price += product.price * product.count
             table.add_row(
                 product.code,
                 product.description,
                 product.brand,
                 str(product.count_in_carton),
-                babel.numbers.format_currency(
-                    product.price, "IRR", format="¤¤ #,##0", locale="en_US"
-                ),
-                babel.numbers.format_currency(
-                    product.price * product.count,
-                    "IRR",
-                    format="¤¤ #,##0",
-                    locale="en_US",
-                ),
+                format_price(product.price),
+                format_price(product_total),
                 str(product.count),
             )
 
@@ -211,82 +415,118 @@ class ProductManager:
             "",
             "",
             "",
-            babel.numbers.format_currency(
-                total_price, "IRR", format="¤¤ #,##0", locale="en_US"
-            ),
+            format_price(total_price),
             str(total_count),
         )
 
         rich.print(table)
 
     @staticmethod
-    def save_availability(filepath: str, products):
-        writer = SheetWriter()
-
-        data = [
+    def save_availability(
+        filepath: str,
+        products,
+        width_sample: int | None = DEFAULT_WIDTH_SAMPLE,
+        max_width: int | None = None,
+    ):
+        from WMan.sheetutils.writer import StreamingSheetWriter
+
+        writer = StreamingSheetWriter(
+            headers=[
+                "Code",
+                "Description",
+                "Brand",
+                "CIC",
+                "Price",
+                "Total Price",
+                "Count",
+            ],
+            header="Availability list",
+            subheader=("Cool", "Subheader"),
+            table_name="Availability",
+            currency_columns=[6, 7],
+            fit_titles=False,
+            width_sample=width_sample,
+            max_width=max_width,
+        )
+        writer.add_data(
             [
                 product.code,
                 product.description,
                 product.brand,
                 product.count_in_carton,
                 product.price,
-                product.price * product.count,
+                None if product.price is None else product.price * product.count,
                 product.count,
             ]
             for product in products
-        ]
-
-        headers = [
-            "Code",
-            "Description",
-            "Brand",
-            "CIC",
-            "Price",
-            "Total Price",
-            "Count",
-        ]
-
-        writer.add_data(data)
-        writer.add_headers(headers)
-        writer.add_row_index_column()
-        writer.set_optimal_column_widths()
-        writer.add_subheader("Cool", "Subheader")
-        writer.add_header("Availability list")
-        writer.make_table("Availability", start_row=3)
-        writer.set_column_currency_format(7)
-        writer.set_column_currency_format(6)
-
+        )
         writer.save(filepath)
 
     @staticmethod
     def list_availability(
-        output: str | None = None, filters: dict[str, str | int | None] = {}
-    ):
-        selected_products = Product.get_filtered(filters)
+        output: str | None = None,
+        filters: dict[str, str | int | None] | None = None,
+        width_sample: int | None = DEFAULT_WIDTH_SAMPLE,
+        max_width: int | None = None,
+        output_format: OutputFormat | None = None,
+        paging: Paging | None = None,
+    ) -> str | None:
+        if output_format:
+            return ProductManager.stream_products(
+                filters,
+                paging,
+                AVAILABILITY_FIELDS,
+                AVAILABILITY_COLUMNS,
+                output_format,
+                output,
+            )
+        if output:
+            with read_snapshot():
+                page = ProductManager.get_page(filters, paging)
+                ProductManager.save_availability(
+                    output, page.items, width_sample, max_width
+                )
+        else:
+            page = ProductManager.get_page(filters, paging)
+            ProductManager.print_availability(page.items)
+        return page.cursor
 
+    @staticmethod
+    def search(
+        text: str,
+        filters: dict[str, str | int | None] | None = None,
+        limit: int | None = None,
+        output: str | None = None,
+        width_sample: int | None = DEFAULT_WIDTH_SAMPLE,
+        max_width: int | None = None,
+        output_format: OutputFormat | None = None,
+    ) -> None:
+        if output_format:
+            rows = Product.search_rows(text, filters, limit, *AVAILABILITY_FIELDS)
+            write_rows(rows, AVAILABILITY_COLUMNS, output_format, output)
+            return
+        products = Product.search(text, filters, limit)
         if output:
-            ProductManager.save_availability(
-                filepath=output, products=selected_products
-            )
+            ProductManager.save_availability(output, products, width_sample, max_width)
+        else:
+            ProductManager.print_availability(products)
+
+    @staticmethod
+    def list_availability_before(
+        moment: datetime.datetime,
+        output: str | None = None,
+        width_sample: int | None = DEFAULT_WIDTH_SAMPLE,
+        max_width: int | None = None,
+    ) -> None:
+        products = Product.get_infos_before(moment)
+        if output:
+            ProductManager.save_availability(output, products, width_sample, max_width)
         else:
-            ProductManager.print_availability(selected_products)
+            ProductManager.print_availability(products)
 
     @staticmethod
     def get_availability(codes: list[str]):
-        products = []
-        for code in codes:
-            selected_product = get_or_raise(Product, code)
-            products.append(
-                ProductInfo(
-                    selected_product.id,
-                    selected_product.description,
-                    selected_product.brand,
-                    selected_product.count_in_carton,
-                    selected_product.price,
-                    selected_product.count,
-                )
-            )
-        ProductManager.print_availability(products)
+        ProductManager.print_availability(Product.get_product_infos(codes))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,255 @@
+import os
+import re
+import time
+from enum import Enum
+from itertools import groupby
+from typing import Iterator
+
+import rich
+
+from WMan.database import (
+    DailyCustomerSales,
+    DailyProductSales,
+    Order,
+    ProductInfo,
+    read_snapshot,
+)
+from WMan.OrderManager import OrderIO
+from WMan.profiling import in_phase
+from WMan.sheetutils import DEFAULT_WIDTH_SAMPLE
+from WMan.sheetutils.stream import OutputFormat, write_rows
+
+
+class SalesGroup(str, Enum):
+    product = "product"
+    brand = "brand"
+    customer = "customer"
+    day = "day"
+    month = "month"
+
+
+# Columns of the sales report rows for every grouping, revenue always last
+SALES_COLUMNS = {
+    SalesGroup.product: ["code", "description", "brand", "count", "revenue"],
+    SalesGroup.brand: ["brand", "count", "revenue"],
+    SalesGroup.customer: ["customer", "count", "revenue"],
+    SalesGroup.day: ["day", "count", "revenue"],
+    SalesGroup.month: ["month", "count", "revenue"],
+}
+
+
+class Statement:
+    def __init__(
+        self,
+        path: str,
+        customer_name: str,
+        order_ids: list[int],
+        products: list[ProductInfo],
+    ) -> None:
+        self.path = path
+        self.customer_name = customer_name
+        self.order_ids = order_ids
+        self.products = products
+
+
+class StatementSummary:
+    def __init__(
+        self, statements: int, orders: int, lines: int, workers: int, seconds: float
+    ) -> None:
+        self.statements = statements
+        self.orders = orders
+        self.lines = lines
+        self.workers = workers
+        self.seconds = seconds
+
+
+def render_statement(
+    statement: Statement,
+    header: str,
+    period: str,
+    width_sample: int | None,
+    max_width: int | None,
+) -> str:
+    # Runs in the worker processes, so it only touches what it was handed
+    order_io = OrderIO(
+        statement.products, header, (f"Buyer: {statement.customer_name}", period)
+    )
+    order_io.save_products(statement.path, width_sample, max_width)
+    return statement.path
+
+
+def statement_filename(customer_id: int, customer_name: str) -> str:
+    safe_name = re.sub(r'[\\/:*?"<>|\s]+', "_", customer_name).strip("_")
+    return f"{customer_id}-{safe_name}.xlsx"
+
+
+class ReportManager:
+    @staticmethod
+    def get_statements(
+        output_dir: str, filters: dict[str, str | int | None] | None = None
+    ) -> list[Statement]:
+        """
+        Read the lines of every matching order in one query and partition them
+        into one statement per customer.
+        """
+        statements = []
+        with read_snapshot():
+            rows = Order.get_line_rows(filters)
+            for (customer_id, customer_name), lines in groupby(
+                rows, key=lambda row: (row[0], row[1])
+            ):
+                order_ids = []
+                products = []
+                for line in lines:
+                    if not order_ids or order_ids[-1] != line[2]:
+                        order_ids.append(line[2])
+                    products.append(ProductInfo(*line[3:]))
+                path = os.path.join(
+                    output_dir, statement_filename(customer_id, customer_name)
+                )
+                statements.append(
+                    Statement(path, customer_name, order_ids, products)
+                )
+        return statements
+
+    @staticmethod
+    def write_statements(
+        output_dir: str,
+        filters: dict[str, str | int | None] | None = None,
+        workers: int | None = None,
+        header: str = "Statement",
+        period: str = "",
+        width_sample: int | None = DEFAULT_WIDTH_SAMPLE,
+        max_width: int | None = None,
+    ) -> StatementSummary:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        from rich.progress import track
+
+        start = time.perf_counter()
+        os.makedirs(output_dir, exist_ok=True)
+        statements = ReportManager.get_statements(output_dir, filters)
+        workers = workers or os.cpu_count() or 1
+        arguments = (header, period, width_sample, max_width)
+
+        if workers == 1 or len(statements) <= 1:
+            workers = 1
+            for statement in track(statements, description="Writing statements"):
+                render_statement(statement, *arguments)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(render_statement, statement, *arguments)
+                    for statement in statements
+                ]
+                for future in track(
+                    as_completed(futures),
+                    total=len(futures),
+                    description="Writing statements",
+                ):
+                    future.result()
+
+        return StatementSummary(
+            statements=len(statements),
+            orders=sum(len(statement.order_ids) for statement in statements),
+            lines=sum(len(statement.products) for statement in statements),
+            workers=workers,
+            seconds=time.perf_counter() - start,
+        )
+
+    @staticmethod
+    def get_sales_rows(
+        group_by: SalesGroup, filters: dict[str, str | int | None] | None = None
+    ) -> Iterator[tuple]:
+        """
+        Stream the sales in the date range of the filters grouped by
+        group_by, as tuples of its SALES_COLUMNS ordered by the group. They
+        are read from the daily sales rollups instead of the order lines.
+        """
+        if group_by in (SalesGroup.product, SalesGroup.brand):
+            return DailyProductSales.get_rows(group_by.value, filters)
+        return DailyCustomerSales.get_rows(group_by.value, filters)
+
+    @staticmethod
+    @in_phase("render")
+    def print_sales(group_by: SalesGroup, rows: Iterator[tuple], period: str):
+        import babel.numbers
+        from rich.table import Table
+
+        def currency(value: int) -> str:
+            return babel.numbers.format_currency(
+                value, "IRR", format="¤¤ #,##0", locale="en_US"
+            )
+
+        columns = SALES_COLUMNS[group_by]
+        table = Table(title=f"Sales by {group_by.value}", caption=period)
+        for column in columns[:-2]:
+            table.add_column(column.capitalize(), justify="center", style="cyan")
+        table.add_column("Count", justify="right", style="yellow")
+        table.add_column("Revenue", justify="right", style="red")
+
+        total_count = 0
+        total_revenue = 0
+        for *keys, count, revenue in rows:
+            total_count += count
+            total_revenue += revenue
+            table.add_row(
+                *(str(key) if key is not None else "" for key in keys),
+                str(count),
+                currency(revenue),
+            )
+
+        table.add_section()
+        table.add_row(
+            "Total",
+            *[""] * (len(columns) - 3),
+            str(total_count),
+            currency(total_revenue),
+        )
+        rich.print(table)
+
+    @staticmethod
+    def save_sales(
+        filepath: str,
+        group_by: SalesGroup,
+        rows: Iterator[tuple],
+        period: str,
+        width_sample: int | None = DEFAULT_WIDTH_SAMPLE,
+        max_width: int | None = None,
+    ):
+        from WMan.sheetutils.writer import StreamingSheetWriter
+
+        columns = SALES_COLUMNS[group_by]
+        writer = StreamingSheetWriter(
+            headers=[column.capitalize() for column in columns],
+            header=f"Sales by {group_by.value}",
+            subheader=(period, ""),
+            table_name="Sales",
+            # Shifted by one for the row index column
+            currency_columns=[len(columns) + 1],
+            fit_titles=False,
+            width_sample=width_sample,
+            max_width=max_width,
+        )
+        writer.add_data(list(row) for row in rows)
+        writer.save(filepath)
+
+    @staticmethod
+    def report_sales(
+        group_by: SalesGroup,
+        filters: dict[str, str | int | None] | None = None,
+        period: str = "",
+        output: str | None = None,
+        output_format: OutputFormat | None = None,
+        width_sample: int | None = DEFAULT_WIDTH_SAMPLE,
+        max_width: int | None = None,
+    ) -> None:
+        rows = ReportManager.get_sales_rows(group_by, filters)
+        if output_format:
+            write_rows(rows, SALES_COLUMNS[group_by], output_format, output)
+        elif output:
+            ReportManager.save_sales(
+                output, group_by, rows, period, width_sample, max_width
+            )
+        else:
+            ReportManager.print_sales(group_by, rows, period)
@@ -1,27 +1,127 @@
-from typer import Typer
+import sys
+from importlib import import_module
 
-from WMan.CLI import availability as availability
-from WMan.CLI import customer as customer
-from WMan.CLI import order as order
-from WMan.CLI import product as product
-from WMan.database import create_tables
+from typer import Context, Option, Typer, echo
 
-app = Typer(no_args_is_help=True)
-app.add_typer(
-    product.app, name="product", help="Manage products and get product information"
-)
-app.add_typer(
-    availability.app,
-    name="availability",
-    help="Manage and get availability of products",
-)
-app.add_typer(
-    customer.app,
-    name="customer",
-    help="Manage and get information about customers",
+from WMan.client import get_server
+from WMan.migrations import migrate_database
+from WMan.profiling import (
+    CPROFILE_OUTPUT_ENV,
+    PROFILE_ENV,
+    PROFILE_MEMORY_ENV,
+    PROFILE_OUTPUT_ENV,
 )
-app.add_typer(order.app, name="order", help="Manage and get order information")
+
+app = Typer(no_args_is_help=True)
+
+# Each sub-app is only imported when it is the one being run, so quick
+# commands don't pay for the imports of the others
+SUB_APPS = {
+    "product": ("WMan.CLI.product", "Manage products and get product information"),
+    "availability": (
+        "WMan.CLI.availability",
+        "Manage and get availability of products",
+    ),
+    "customer": (
+        "WMan.CLI.customer",
+        "Manage and get information about customers",
+    ),
+    "order": ("WMan.CLI.order", "Manage and get order information"),
+    "report": ("WMan.CLI.report", "Generate reports from the order history"),
+    "maintenance": (
+        "WMan.CLI.maintenance",
+        "Maintain and repair the warehouse database",
+    ),
+}
+
+
+@app.callback()
+def main(
+    ctx: Context,
+    profile: bool = Option(
+        False,
+        "--profile",
+        envvar=PROFILE_ENV,
+        help="Report the time per phase, SQL statements and peak memory of the "
+        "command on stderr",
+    ),
+    profile_memory: bool = Option(
+        False,
+        "--profile-memory",
+        envvar=PROFILE_MEMORY_ENV,
+        help="Also trace the peak Python heap with tracemalloc, which is slow",
+    ),
+    profile_output: str = Option(
+        None, envvar=PROFILE_OUTPUT_ENV, help="Also write the profile as JSON here"
+    ),
+    cprofile_output: str = Option(
+        None,
+        "--cprofile-output",
+        envvar=CPROFILE_OUTPUT_ENV,
+        help="Dump cProfile statistics of the command here, for pstats or snakeviz",
+    ),
+):
+    if profile or profile_memory or profile_output or cprofile_output:
+        from WMan import profiling
+
+        profiling.start(
+            " ".join(sys.argv[1:]), profile_memory, cprofile_output is not None
+        )
+        ctx.call_on_close(
+            lambda: profiling.finish(profile_output, cprofile_output)
+        )
+
+    # Bring warehouse.db up to the current schema before any command runs,
+    # unless the command goes to the server, which migrated it on start
+    if get_server() is None:
+        migrate_database()
+
+
+@app.command()
+def serve(
+    socket: str = Option(None, help="Path of the Unix socket to listen on"),
+):
+    """
+    Keep WMan running and answer JSON requests on a Unix socket. Commands
+    run with WMAN_CLIENT=yes are forwarded to it.
+    """
+    import signal
+
+    from WMan.database import config, db
+    from WMan import server
+
+    socket_path = socket or config.socket_path
+    # Stop on SIGTERM as on Ctrl-C, so the socket file is removed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    db.close()
+    echo(f"Listening on {socket_path}")
+    server.serve(socket_path)
+
+
+# The options of main that take a value, which must be skipped with it
+# when looking for the sub-app on the command line
+VALUE_OPTIONS = {"--profile-output", "--cprofile-output"}
+
+
+def requested_sub_app(argv: list[str]) -> str | None:
+    arguments = iter(argv[1:])
+    for argument in arguments:
+        if argument in VALUE_OPTIONS:
+            next(arguments, None)
+        elif not argument.startswith("-"):
+            return argument if argument in SUB_APPS else None
+    return None
+
+
+def add_sub_apps(argv: list[str]) -> None:
+    # The top-level help, shell completion and unknown commands need them all
+    requested = requested_sub_app(argv)
+    for name, (module, help) in SUB_APPS.items():
+        if requested in (None, name):
+            app.add_typer(import_module(module).app, name=name, help=help)
+
+
+add_sub_apps(sys.argv)
 
 if __name__ == "__main__":
-    create_tables()
     app()
@@ -0,0 +1,73 @@
+"""
+Client of the `wman serve` server. Kept to the standard library, so the
+thin-client path of the CLI doesn't import anything it would forward.
+"""
+import json
+import socket
+from functools import cache
+
+
+class RemoteException(Exception):
+    """
+    An operation failed on the server. error_type is the name of the
+    exception it raised there, like NotFoundException.
+    """
+
+    def __init__(self, error_type: str, message: str):
+        self.error_type = error_type
+        super().__init__(message)
+
+
+class Client:
+    def __init__(self, socket_path: str, timeout: float | None = None):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        try:
+            self.socket.connect(socket_path)
+        except OSError:
+            self.socket.close()
+            raise
+        self.file = self.socket.makefile("rwb")
+
+    def call(self, operation: str, **args):
+        """
+        Run the operation on the server and return its result, raising
+        RemoteException when it failed there.
+        """
+        request = {"op": operation, "args": args}
+        self.file.write(json.dumps(request, default=str).encode() + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("The server closed the connection")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise RemoteException(response["type"], response["error"])
+        return response["result"]
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@cache
+def get_server() -> Client | None:
+    """
+    The connection to the running server when the thin-client mode is on,
+    or None when the command should run locally.
+    """
+    from WMan.config import load_config
+
+    config = load_config()
+    if not config.client:
+        return None
+    try:
+        return Client(config.socket_path)
+    except OSError:
+        return None
@@ -0,0 +1,118 @@
+"""
+Runtime configuration of WMan.
+
+Settings are read from an INI file and can be overridden with environment
+variables:
+
+    [database]
+    path = /var/lib/wman/warehouse.db   ; WMAN_DATABASE
+    profile = fast                      ; WMAN_DB_PROFILE
+    timeout = 5                         ; WMAN_DB_TIMEOUT
+
+    [pragmas]
+    cache_size = -262144
+
+    [server]
+    socket = /run/wman/wman.sock        ; WMAN_SOCKET
+    client = yes                        ; WMAN_CLIENT
+
+The file is looked up at $WMAN_CONFIG, then at
+$XDG_CONFIG_HOME/wman/config.ini (~/.config/wman/config.ini). Relative
+database and socket paths in the file are resolved against the file's
+directory. The socket defaults to the database path with ".sock" appended;
+with client enabled, the commands the server supports are forwarded to it
+while it is running.
+"""
+import configparser
+import os
+
+CONFIG_ENV = "WMAN_CONFIG"
+DATABASE_ENV = "WMAN_DATABASE"
+PROFILE_ENV = "WMAN_DB_PROFILE"
+TIMEOUT_ENV = "WMAN_DB_TIMEOUT"
+SOCKET_ENV = "WMAN_SOCKET"
+CLIENT_ENV = "WMAN_CLIENT"
+
+DEFAULT_DATABASE_PATH = "warehouse.db"
+
+PRAGMA_PROFILES: dict[str, dict[str, str | int]] = {
+    # SQLite's own defaults: rollback journal and synchronous=FULL
+    "default": {},
+    # Write-ahead logging lets readers keep a snapshot while a writer commits,
+    # and synchronous=NORMAL only syncs the WAL on checkpoints
+    "fast": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -64 * 1024,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "memory",
+    },
+}
+
+
+class Config:
+    def __init__(
+        self,
+        database_path: str = DEFAULT_DATABASE_PATH,
+        profile: str = "default",
+        timeout: float = 5,
+        pragmas: dict[str, str | int] | None = None,
+        socket_path: str | None = None,
+        client: bool = False,
+    ):
+        if profile not in PRAGMA_PROFILES:
+            raise Exception(
+                f"Unknown database profile '{profile}', "
+                f"expected one of: {', '.join(PRAGMA_PROFILES)}"
+            )
+        self.database_path = database_path
+        self.profile = profile
+        self.timeout = timeout
+        self.pragmas = {**PRAGMA_PROFILES[profile], **(pragmas or {})}
+        self.socket_path = socket_path or f"{database_path}.sock"
+        self.client = client
+
+
+def get_config_path() -> str:
+    if CONFIG_ENV in os.environ:
+        return os.environ[CONFIG_ENV]
+    config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser(
+        "~/.config"
+    )
+    return os.path.join(config_home, "wman", "config.ini")
+
+
+def load_config(config_path: str | None = None) -> Config:
+    config_path = config_path or get_config_path()
+    parser = configparser.ConfigParser()
+    parser.read(config_path, encoding="utf-8")
+
+    def get_path(section: str, option: str) -> str | None:
+        path = parser.get(section, option, fallback=None)
+        if not path:
+            return None
+        return os.path.join(
+            os.path.dirname(os.path.abspath(config_path)), os.path.expanduser(path)
+        )
+
+    database_path = os.environ.get(DATABASE_ENV) or get_path("database", "path")
+    socket_path = os.environ.get(SOCKET_ENV) or get_path("server", "socket")
+    profile = os.environ.get(PROFILE_ENV) or parser.get(
+        "database", "profile", fallback="default"
+    )
+    timeout = os.environ.get(TIMEOUT_ENV) or parser.get(
+        "database", "timeout", fallback="5"
+    )
+    pragmas = dict(parser.items("pragmas")) if parser.has_section("pragmas") else {}
+    client = os.environ.get(CLIENT_ENV) or parser.get(
+        "server", "client", fallback="no"
+    )
+
+    return Config(
+        database_path=database_path or DEFAULT_DATABASE_PATH,
+        profile=profile,
+        timeout=float(timeout),
+        pragmas=pragmas,
+        socket_path=socket_path,
+        client=client.lower() in ("1", "yes", "true", "on"),
+    )
@@ -1,22 +1,67 @@
+import base64
 import datetime
-from typing import Dict, Optional, Type
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from enum import Enum
+from typing import Callable, Dict, Iterable, Iterator, Optional, Type
 
 from peewee import (
     CharField,
     CompositeKey,
     DateField,
+    DateTimeField,
+    EXCLUDED,
     DoesNotExist,
+    Expression,
+    FloatField,
     ForeignKeyField,
     IntegerField,
+    JOIN,
     Model,
+    Case,
+    Select,
     SqliteDatabase,
+    Tuple,
+    Value,
+    VirtualField,
+    chunked,
     fn,
 )
 
-db = SqliteDatabase("warehouse.db")
+from WMan.config import load_config
+
+config = load_config()
+db = SqliteDatabase(
+    config.database_path, pragmas=config.pragmas, timeout=config.timeout
+)
+
+# Lowest SQLITE_MAX_VARIABLE_NUMBER we may run against (SQLite < 3.32)
+SQLITE_MAX_VARIABLES = 999
+
+# Stock movements recorded between two snapshots of every product's count
+SNAPSHOT_INTERVAL = 10_000
+
+# Most lookups each LookupCache keeps
+LOOKUP_CACHE_SIZE = 4096
+
+# Arabic letters that Persian text is often typed with, and the Persian
+# letters they are indexed and searched as
+SEARCH_CHARACTERS = {"\u064a": "\u06cc", "\u0649": "\u06cc", "\u0643": "\u06a9"}
+SEARCH_TRANSLATION = str.maketrans(SEARCH_CHARACTERS)
+
+
+class MovementReason(str, Enum):
+    receipt = "receipt"
+    order = "order"
+    adjustment = "adjustment"
 
 
 class ProductInfo:
+    # Read paths build one of these per row, so they are kept slotted
+    __slots__ = ("code", "description", "brand", "count_in_carton", "price", "count")
+
     def __init__(
         self,
         code: str | None,
@@ -47,12 +92,16 @@ class ProductInfo:
 
 
 class OrderProductInfo:
+    __slots__ = ("product_code", "count")
+
     def __init__(self, product_code: str | None = None, count: int | None = None):
         self.product_code = product_code
         self.count = count
 
 
 class OrderInfo:
+    __slots__ = ("id", "total_count", "total_price", "customer_name", "date")
+
     def __init__(
         self,
         order_id: int = None,
@@ -68,6 +117,184 @@ class OrderInfo:
         self.date = date
 
 
+class CatalogueLoadResult:
+    def __init__(
+        self,
+        inserted: int = 0,
+        updated: int = 0,
+        unchanged: int = 0,
+        missing: list[str] | None = None,
+    ):
+        self.inserted = inserted
+        self.updated = updated
+        self.unchanged = unchanged
+        self.missing = missing if missing is not None else []
+
+
+class BatchRows:
+    """
+    The (row number, product code, count) rows of a batch file, grouped by
+    product code with the counts of duplicated codes summed. Problems are
+    collected per row so that they can all be reported at once.
+    """
+
+    def __init__(
+        self, rows: Iterable[tuple[int, str, int]], with_counts: bool = True
+    ):
+        self.errors: list[tuple[int, str]] = []
+        self.counts: dict[str, int] = {}
+        self.rows_by_code: dict[str, list[int]] = {}
+        for row, code, count in rows:
+            if code is None:
+                self.errors.append((row, "Product code is missing"))
+                continue
+            if with_counts and (not isinstance(count, int) or count <= 0):
+                self.errors.append((row, f"Invalid count {count!r} for product {code}"))
+                continue
+            code = str(code)
+            self.counts[code] = self.counts.get(code, 0) + (count if with_counts else 0)
+            self.rows_by_code.setdefault(code, []).append(row)
+
+    def add_error(self, code: str, message: str) -> None:
+        self.errors.extend((row, message) for row in self.rows_by_code[code])
+
+    def raise_errors(self) -> None:
+        if self.errors:
+            raise BatchException(
+                [f"Row {row}: {message}" for row, message in sorted(self.errors)]
+            )
+
+
+class Paging:
+    """
+    Which page of a listing to fetch: sorted by sort_by, or by the model's
+    key when it is None, at most limit rows after the cursor in after.
+    """
+
+    def __init__(
+        self,
+        sort_by: str | None = None,
+        descending: bool = False,
+        limit: int | None = None,
+        after: str | None = None,
+    ):
+        self.sort_by = sort_by
+        self.descending = descending
+        self.limit = limit
+        self.after = after
+
+
+class Page:
+    def __init__(self, items: list, cursor: str | None):
+        self.items = items
+        self.cursor = cursor
+
+
+def encode_cursor(sort_by: str, descending: bool, value, key) -> str:
+    token = json.dumps([sort_by, descending, value, key], default=str)
+    return base64.urlsafe_b64encode(token.encode()).decode()
+
+
+def decode_cursor(cursor: str, sort_by: str, descending: bool) -> tuple:
+    try:
+        cursor_sort_by, cursor_descending, value, key = json.loads(
+            base64.urlsafe_b64decode(cursor.encode())
+        )
+    except (ValueError, TypeError):
+        raise Exception(f"Invalid cursor {cursor!r}")
+    if (cursor_sort_by, cursor_descending) != (sort_by, descending):
+        raise Exception("The cursor belongs to a listing with a different sort order")
+    return value, key
+
+
+class KeysetPage:
+    """
+    A page of a query sorted by sort_field and then by the unique key_field.
+    Each page starts right after the (sort value, key) position the cursor
+    of the previous page points at, so with a (sort_field, key_field) index
+    it is a range scan that costs the same however deep the page is. NULL
+    sort values come first in ascending order and last in descending order,
+    as SQLite sorts them.
+
+    The query must select tuples ending with sort_field and key_field, and
+    iterating the page yields the rows without them. Once the page has been
+    iterated, cursor is the token of the next page, or None after the last.
+    """
+
+    def __init__(
+        self,
+        query,
+        sort_by: str,
+        sort_field,
+        key_field,
+        descending: bool = False,
+        limit: int | None = None,
+        after: str | None = None,
+    ):
+        self.query = query
+        self.sort_by = sort_by
+        self.sort_field = sort_field
+        self.key_field = key_field
+        self.descending = descending
+        self.limit = limit
+        self.position = decode_cursor(after, sort_by, descending) if after else None
+        self.cursor: str | None = None
+
+    def after(self, left, right):
+        return left < right if self.descending else left > right
+
+    def order(self, field):
+        return field.desc() if self.descending else field.asc()
+
+    def segments(self) -> list:
+        sort_field, key_field = self.sort_field, self.key_field
+        if sort_field is key_field:
+            query = self.query.order_by(self.order(key_field))
+            if self.position is not None:
+                query = query.where(self.after(key_field, self.position[1]))
+            return [query]
+
+        values = self.query.where(sort_field.is_null(False)).order_by(
+            self.order(sort_field), self.order(key_field)
+        )
+        if not sort_field.null:
+            if self.position is not None:
+                values = values.where(
+                    self.after(Tuple(sort_field, key_field), Tuple(*self.position))
+                )
+            return [values]
+
+        nulls = self.query.where(sort_field.is_null()).order_by(self.order(key_field))
+        if self.position is None:
+            return [values, nulls] if self.descending else [nulls, values]
+
+        value, key = self.position
+        if value is None:
+            nulls = nulls.where(self.after(key_field, key))
+            return [nulls] if self.descending else [nulls, values]
+        values = values.where(
+            self.after(Tuple(sort_field, key_field), Tuple(value, key))
+        )
+        return [values, nulls] if self.descending else [values]
+
+    def __iter__(self) -> Iterator[tuple]:
+        returned = 0
+        last_row = None
+        for segment in self.segments():
+            if self.limit is not None:
+                # One row more than the page holds tells whether another follows
+                segment = segment.limit(self.limit + 1 - returned)
+            for row in segment.tuples().iterator():
+                if self.limit is not None and returned == self.limit:
+                    self.cursor = encode_cursor(
+                        self.sort_by, self.descending, *last_row[-2:]
+                    )
+                    return
+                returned += 1
+                last_row = row
+                yield row[:-2]
+
+
 class BaseModel(Model):
     class Meta:
         database = db
@@ -81,19 +308,187 @@ class Product(BaseModel):
     count_in_carton = IntegerField(null=True)
     count = IntegerField(default=0)
 
+    class Meta:
+        # The code makes every sort order unique for keyset pagination, and
+        # the indexes serve plain filters on their first column as well
+        indexes = (
+            (("brand", "id"), False),
+            (("price", "id"), False),
+            (("count", "id"), False),
+        )
+
+    @classmethod
+    def add_count(
+        cls,
+        product_code: str,
+        count: int,
+        reason: MovementReason = MovementReason.receipt,
+        order_id: int | None = None,
+    ) -> None:
+        # Joins the transaction of an order operation without a savepoint
+        with db.transaction():
+            updated = (
+                cls.update(count=cls.count + count)
+                .where(cls.id == product_code)
+                .execute()
+            )
+            if not updated:
+                raise NotFoundException(cls, product_code)
+            StockMovement.record({product_code: count}, reason, order_id)
+
+    @classmethod
+    def reduce_count(
+        cls,
+        product_code: str,
+        count: int,
+        reason: MovementReason = MovementReason.adjustment,
+        order_id: int | None = None,
+    ) -> None:
+        with db.transaction():
+            # The check and the decrement are one statement, so concurrent
+            # writers can never take the same units twice
+            updated = (
+                cls.update(count=cls.count - count)
+                .where(cls.id == product_code, cls.count >= count)
+                .execute()
+            )
+            if not updated:
+                if not cls.select().where(cls.id == product_code).exists():
+                    raise NotFoundException(cls, product_code)
+                raise Exception("There is not enough available product")
+            StockMovement.record({product_code: -count}, reason, order_id)
+
     @classmethod
-    def add_count(cls, product_code: str, count: int) -> None:
-        selected_product = get_or_raise(cls, product_code)
-        selected_product.count += count
-        selected_product.save()
+    def adjust_count_batch(
+        cls, rows: Iterable[tuple[int, str, int]], reduce: bool = False
+    ) -> int:
+        """
+        Add (or reduce) the counts of (row number, product code, count) rows
+        in a single transaction. Counts of the same code are summed and
+        applied with one UPDATE per chunk of codes. Nothing is applied if a
+        row is invalid, a code is unknown or a product would go negative;
+        every offending row is reported through a BatchException instead.
+        Returns the number of products that were adjusted.
+        """
+        batch = BatchRows(rows)
+        with db.atomic():
+            current_counts: dict[str, int] = {}
+            for codes in chunked(batch.counts, SQLITE_MAX_VARIABLES):
+                current_counts.update(
+                    cls.select(cls.id, cls.count).where(cls.id.in_(codes)).tuples()
+                )
+
+            for code, count in batch.counts.items():
+                if code not in current_counts:
+                    batch.add_error(code, f"Product with id {code} was not found")
+                elif reduce and current_counts[code] < count:
+                    batch.add_error(
+                        code,
+                        f"There is not enough available product {code} "
+                        f"({current_counts[code]} available, {count} requested)",
+                    )
+            batch.raise_errors()
+
+            cls.apply_count_deltas(
+                {
+                    code: -count if reduce else count
+                    for code, count in batch.counts.items()
+                },
+                MovementReason.adjustment if reduce else MovementReason.receipt,
+            )
+
+        return len(batch.counts)
 
     @classmethod
-    def reduce_count(cls, product_code: str, count: int) -> None:
-        selected_product = get_or_raise(cls, product_code)
-        if selected_product.count < count:
-            raise Exception("There is not enough available product")
-        selected_product.count -= count
-        selected_product.save()
+    def apply_count_deltas(
+        cls,
+        deltas: dict[str, int],
+        reason: MovementReason,
+        order_id: int | None = None,
+    ) -> None:
+        # Each code binds three variables: two in the CASE and one in IN
+        for batch in chunked(deltas.items(), SQLITE_MAX_VARIABLES // 3):
+            batch_deltas = dict(batch)
+            cls.update(
+                count=cls.count + Case(cls.id, list(batch_deltas.items()), 0)
+            ).where(cls.id.in_(list(batch_deltas))).execute()
+        StockMovement.record(deltas, reason, order_id)
+
+    @classmethod
+    def upsert_batch(
+        cls, products: Iterable[ProductInfo], insert_missing: bool = True
+    ) -> CatalogueLoadResult:
+        """
+        Load products with chunked multi-row INSERT ... ON CONFLICT DO UPDATE
+        statements in a single transaction. Empty values never overwrite the
+        stored ones. Unknown codes are inserted, or reported as missing when
+        insert_missing is False. Rows without a code are skipped.
+        """
+        result = CatalogueLoadResult()
+        fields = [cls.description, cls.brand, cls.price, cls.count_in_carton]
+        price_index = [field.name for field in fields].index("price")
+        # Every inserted row binds id, count and the four catalogue fields
+        chunk_size = SQLITE_MAX_VARIABLES // (len(fields) + 2)
+
+        with db.atomic():
+            for chunk in chunked(
+                (product for product in products if product.code is not None),
+                chunk_size,
+            ):
+                new_values: dict[str, tuple] = {}
+                for product in chunk:
+                    values = tuple(
+                        getattr(product, field.name) or None for field in fields
+                    )
+                    code = str(product.code)
+                    previous = new_values.get(code, (None,) * len(fields))
+                    new_values[code] = tuple(
+                        new if new is not None else old
+                        for new, old in zip(values, previous)
+                    )
+
+                existing = {
+                    row[0]: row[1:]
+                    for row in cls.select(cls.id, *fields)
+                    .where(cls.id.in_(list(new_values)))
+                    .tuples()
+                }
+
+                rows = []
+                repriced_codes = []
+                for code, values in new_values.items():
+                    if code in existing:
+                        merged = tuple(
+                            new if new is not None else old
+                            for new, old in zip(values, existing[code])
+                        )
+                        if merged == existing[code]:
+                            result.unchanged += 1
+                            continue
+                        result.updated += 1
+                        if merged[price_index] != existing[code][price_index]:
+                            repriced_codes.append(code)
+                    elif insert_missing:
+                        result.inserted += 1
+                    else:
+                        result.missing.append(code)
+                        continue
+                    rows.append((code, 0, *values))
+
+                if rows:
+                    cls.insert_many(
+                        rows, fields=[cls.id, cls.count, *fields]
+                    ).on_conflict(
+                        conflict_target=[cls.id],
+                        update={
+                            field: fn.COALESCE(getattr(EXCLUDED, field.name), field)
+                            for field in fields
+                        },
+                    ).execute()
+                if repriced_codes:
+                    Order.refresh_totals(product_codes=repriced_codes)
+
+        return result
 
     @classmethod
     def add(cls, product_info: ProductInfo):
@@ -109,9 +504,18 @@ class Product(BaseModel):
 
     @classmethod
     def remove(cls, product_code: str):
-        product = get_or_raise(Product, product_code)
-        product.delete_instance()
-        OrderProduct.delete().where(OrderProduct.product == product).execute()
+        with db.atomic():
+            product = get_or_raise(Product, product_code)
+            product.delete_instance()
+            # The stock leaves with the product, its history stays
+            StockMovement.record(
+                {product.id: -product.count}, MovementReason.adjustment
+            )
+            Order.refresh_totals(product_codes=[product.id], exclude_product=True)
+            OrderProduct.delete().where(OrderProduct.product == product).execute()
+            DailyProductSales.delete().where(
+                DailyProductSales.product == product.id
+            ).execute()
 
     @classmethod
     def get_count(cls, product_code: str):
@@ -120,6 +524,105 @@ class Product(BaseModel):
 
     @classmethod
     def get_filtered(cls, filters: Optional[Dict[str, str | int | None]]):
+        query = cls.filter_query(filters).select(*cls.info_fields())
+        return [ProductInfo(*row) for row in query.tuples().iterator()]
+
+    @classmethod
+    def info_fields(cls) -> list:
+        """
+        The columns of a ProductInfo, in the order of its arguments, so rows
+        can be read as tuples instead of model instances.
+        """
+        return [
+            cls.id,
+            cls.description,
+            cls.brand,
+            cls.count_in_carton,
+            cls.price,
+            cls.count,
+        ]
+
+    @classmethod
+    def get_product_infos(cls, product_codes: list[str]) -> list[ProductInfo]:
+        """
+        ProductInfos of the given codes in the same order, read with chunked
+        IN lookups. Raises NotFoundException for the first unknown code.
+        """
+        found = {}
+        for codes in chunked(set(product_codes), SQLITE_MAX_VARIABLES):
+            query = cls.select(*cls.info_fields()).where(cls.id.in_(codes))
+            for row in query.tuples():
+                found[row[0]] = ProductInfo(*row)
+        for code in product_codes:
+            if code not in found:
+                raise NotFoundException(cls, code)
+        return [found[code] for code in product_codes]
+
+    @classmethod
+    def get_infos_before(cls, moment: datetime.datetime) -> list[ProductInfo]:
+        """
+        ProductInfos of the products that had stock just before moment, with
+        the counts they had then, ordered by code. Products removed since
+        then are listed with their code and count only.
+        """
+        counts = StockMovement.counts_before(moment).alias("stock")
+        query = (
+            Select(
+                [counts],
+                [counts.c.product, *cls.info_fields()[1:-1], counts.c.count],
+            )
+            .join(cls, JOIN.LEFT_OUTER, on=(cls.id == counts.c.product))
+            .order_by(counts.c.product)
+            .bind(db)
+        )
+        return [ProductInfo(*row) for row in query.tuples()]
+
+    @classmethod
+    def get_filtered_rows(
+        cls, filters: Optional[Dict[str, str | int | None]], *fields
+    ) -> Iterator[tuple]:
+        """
+        Stream the selected fields of the matching products as tuples, straight
+        from the cursor and without building model instances.
+        """
+        return cls.filter_query(filters).select(*fields).tuples().iterator()
+
+    @classmethod
+    def get_page(
+        cls,
+        filters: Optional[Dict[str, str | int | None]],
+        paging: Paging,
+        fields: list | None = None,
+    ) -> KeysetPage:
+        """
+        A keyset page of the matching products, as tuples of the given fields
+        or of the ProductInfo fields by default.
+        """
+        sort_fields = {
+            "code": cls.id,
+            "brand": cls.brand,
+            "price": cls.price,
+            "count": cls.count,
+        }
+        sort_by = paging.sort_by or "code"
+        if sort_by not in sort_fields:
+            raise Exception(f"Products can't be sorted by {sort_by}")
+        if fields is None:
+            fields = cls.info_fields()
+        sort_field = sort_fields[sort_by]
+        query = cls.filter_query(filters).select(*fields, sort_field, cls.id)
+        return KeysetPage(
+            query,
+            sort_by,
+            sort_field,
+            cls.id,
+            paging.descending,
+            paging.limit,
+            paging.after,
+        )
+
+    @classmethod
+    def filter_query(cls, filters: Optional[Dict[str, str | int | None]]):
         query = cls.select()
 
         if filters:
@@ -135,33 +638,55 @@ class Product(BaseModel):
                 if field == "max_count" and value:
                     query = query.where(cls.count <= value)
 
-        return [
-            ProductInfo(
-                code=product.id,
-                description=product.description,
-                brand=product.brand,
-                count_in_carton=product.count_in_carton,
-                price=product.price,
-                count=product.count,
-            )
-            for product in query
-        ]
+        return query
+
+    @classmethod
+    def search(
+        cls,
+        text: str,
+        filters: Optional[Dict[str, str | int | None]] = None,
+        limit: int | None = None,
+    ) -> list[ProductInfo]:
+        """
+        ProductInfos of the matching products with a word in their code,
+        description or brand starting with every word of text, best matches
+        first.
+        """
+        rows = cls.search_rows(text, filters, limit, *cls.info_fields())
+        return [ProductInfo(*row) for row in rows]
+
+    @classmethod
+    def search_rows(
+        cls,
+        text: str,
+        filters: Optional[Dict[str, str | int | None]],
+        limit: int | None,
+        *fields,
+    ) -> Iterator[tuple]:
+        """
+        Stream the selected fields of the products search finds, as tuples.
+        """
+        return (
+            cls.filter_query(filters)
+            .select(*fields)
+            .join(ProductSearch, on=(ProductSearch.code == cls.id))
+            .where(ProductSearch.match(search_expression(text)))
+            .order_by(ProductSearch.rank, cls.id)
+            .limit(limit)
+            .tuples()
+            .iterator()
+        )
 
     @classmethod
     def get_product_info(cls, product_code: str) -> ProductInfo:
-        selected_product = get_or_raise(cls, product_code)
+        product = get_or_raise(cls, product_code)
         return ProductInfo(
-            code=selected_product.id,
-            description=selected_product.description,
-            brand=selected_product.brand,
-            count_in_carton=selected_product.count_in_carton,
-            price=selected_product.price,
-            count=selected_product.count,
+            *(getattr(product, field.name) for field in cls.info_fields())
         )
 
 
 class Customer(BaseModel):
-    name = CharField()
+    name = CharField(unique=True)
 
     @classmethod
     def add(cls, name: str) -> "Customer":
@@ -179,154 +704,410 @@ class Customer(BaseModel):
 
     @classmethod
     def get_customer_id(cls, customer_name: str) -> int:
-        selected_customer = Customer.get(Customer.name == customer_name)
-        return selected_customer.id
+        return lookup_caches["customer"].get(customer_name, cls.load_customer_id)
+
+    @classmethod
+    def load_customer_id(cls, customer_name: str) -> int:
+        customer_id = cls.select(cls.id).where(cls.name == customer_name).scalar()
+        if customer_id is None:
+            raise Exception(f"Customer with name '{customer_name}' does not exist")
+        return customer_id
 
     @classmethod
     def get_filtered(cls, filters: dict[str, str | int | None]):
         return cls.select()
 
+    @classmethod
+    def get_filtered_rows(cls, filters: dict[str, str | int | None]) -> Iterator[tuple]:
+        return cls.get_filtered(filters).select(cls.id, cls.name).tuples().iterator()
+
 
 class Order(BaseModel):
-    date = DateField(default=datetime.datetime.now)
+    date = DateField(default=datetime.datetime.now, index=True)
     customer = ForeignKeyField(Customer, backref="orders")
+    # Denormalized totals, kept up to date by every order line mutation
+    total_count = IntegerField(default=0, index=True)
+    total_price = IntegerField(default=0, index=True)
 
     @classmethod
     def new(cls, customer_name: str, date: datetime) -> "Order":
-        if not Customer.does_customer_exist(customer_name):
-            raise Exception(f"Customer with name '{customer_name}' does not exist")
-        found_customer = Customer.get(Customer.name == customer_name)
-        new_order = Order.create(customer=found_customer, date=date)
+        customer_id = Customer.get_customer_id(customer_name)
+        new_order = Order.create(customer=customer_id, date=date)
         return new_order
 
     @classmethod
     def add_product(cls, order_id: int, product_code: str, count: int) -> None:
-        if Product.get_count(product_code) < count:
-            raise Exception("There is not enough available product for this order")
-
-        selected_order = get_or_raise(Order, order_id)
-        selected_product = get_or_raise(Product, product_code)
-        Product.reduce_count(product_code, count)
-        return OrderProduct.create(
-            count=count, order=selected_order, product=selected_product
-        )
+        with db.atomic("IMMEDIATE"):
+            Product.reduce_count(product_code, count, MovementReason.order, order_id)
+            cls.add_to_totals(order_id, product_code, count)
+            OrderProduct.insert(
+                count=count, order=order_id, product=product_code
+            ).execute()
 
     @classmethod
     def remove_product(cls, order_id: int, product_code: str) -> None:
-        order_product = OrderProduct.find_by_ids(order_id, product_code)
-        order_product.delete_instance()
-        Product.add_count(product_code, order_product.count)
+        with db.atomic("IMMEDIATE"):
+            count = OrderProduct.get_count(order_id, product_code)
+            OrderProduct.delete().where(
+                OrderProduct.order == order_id, OrderProduct.product == product_code
+            ).execute()
+            Product.add_count(product_code, count, MovementReason.order, order_id)
+            cls.add_to_totals(order_id, product_code, -count)
 
     @staticmethod
     def add_count_product(order_id: int, product_code: str, count: int):
-        order_product = OrderProduct.find_by_ids(order_id, product_code)
-        if Product.get_count(product_code) < count:
-            raise Exception("There is not enough product to add to order")
-        Product.reduce_count(product_code, count)
-        order_product.count += count
-        order_product.save()
+        with db.atomic("IMMEDIATE"):
+            Product.reduce_count(product_code, count, MovementReason.order, order_id)
+            updated = (
+                OrderProduct.update(count=OrderProduct.count + count)
+                .where(
+                    OrderProduct.order == order_id,
+                    OrderProduct.product == product_code,
+                )
+                .execute()
+            )
+            if not updated:
+                raise OrderProduct.not_found(order_id, product_code)
+            Order.add_to_totals(order_id, product_code, count)
 
     @staticmethod
     def reduce_count_product(order_id, product_code: str, count: int):
-        order_product = OrderProduct.find_by_ids(order_id, product_code)
-        if order_product.count < count:
-            raise Exception("The order does not have this amount of product to reduce")
+        with db.atomic("IMMEDIATE"):
+            line = (OrderProduct.order == order_id) & (
+                OrderProduct.product == product_code
+            )
+            updated = (
+                OrderProduct.update(count=OrderProduct.count - count)
+                .where(line, OrderProduct.count >= count)
+                .execute()
+            )
+            if not updated:
+                OrderProduct.get_count(order_id, product_code)
+                raise Exception(
+                    "The order does not have this amount of product to reduce"
+                )
+            OrderProduct.delete().where(line, OrderProduct.count == 0).execute()
+            Product.add_count(product_code, count, MovementReason.order, order_id)
+            Order.add_to_totals(order_id, product_code, -count)
 
-        if order_product.count == count:
-            order_product.delete_instance()
-        else:
-            order_product.count -= count
-        Product.add_count(product_code, count)
-        order_product.save()
+    @classmethod
+    def apply_batch(
+        cls,
+        order_id: int,
+        rows: Iterable[tuple[int, str, int]],
+        operation: str,
+        dry_run: bool = False,
+    ) -> int:
+        """
+        Apply an order batch of (row number, product code, count) rows in a
+        single transaction. operation is one of "add", "remove", "add_count"
+        or "reduce_count". Duplicate codes are merged, every code is resolved
+        with chunked IN lookups and stock is checked against the merged
+        counts. Nothing is applied if any row fails; every offending row is
+        reported through a BatchException. With dry_run nothing is written
+        either way. Returns the number of order lines affected.
+        """
+        if operation not in ("add", "remove", "add_count", "reduce_count"):
+            raise Exception(f"Unknown order batch operation '{operation}'")
+
+        batch = BatchRows(rows, with_counts=operation != "remove")
+        with db.atomic(None if dry_run else "IMMEDIATE"):
+            order = get_or_raise(cls, order_id)
+
+            products: dict[str, tuple[int, int]] = {}
+            line_counts: dict[str, int] = {}
+            for codes in chunked(batch.counts, SQLITE_MAX_VARIABLES - 1):
+                products.update(
+                    (code, (count, price or 0))
+                    for code, count, price in Product.select(
+                        Product.id, Product.count, Product.price
+                    )
+                    .where(Product.id.in_(codes))
+                    .tuples()
+                )
+                line_counts.update(
+                    OrderProduct.select(OrderProduct.product, OrderProduct.count)
+                    .where(
+                        OrderProduct.order == order_id,
+                        OrderProduct.product.in_(codes),
+                    )
+                    .tuples()
+                )
+
+            for code, count in batch.counts.items():
+                if code not in products:
+                    batch.add_error(code, f"Product with id {code} was not found")
+                elif operation == "add" and code in line_counts:
+                    batch.add_error(
+                        code, f"Product {code} is already in order {order_id}"
+                    )
+                elif operation != "add" and code not in line_counts:
+                    batch.add_error(code, f"Product {code} is not in order {order_id}")
+                elif operation in ("add", "add_count") and products[code][0] < count:
+                    batch.add_error(
+                        code,
+                        f"There is not enough available product {code} "
+                        f"({products[code][0]} available, {count} requested)",
+                    )
+                elif operation == "reduce_count" and line_counts[code] < count:
+                    batch.add_error(
+                        code,
+                        f"The order only has {line_counts[code]} of product {code}, "
+                        f"{count} requested",
+                    )
+            batch.raise_errors()
+
+            # How much each order line grows (or shrinks)
+            if operation == "remove":
+                line_deltas = {code: -line_counts[code] for code in batch.counts}
+            elif operation == "reduce_count":
+                line_deltas = {code: -count for code, count in batch.counts.items()}
+            else:
+                line_deltas = dict(batch.counts)
+
+            if dry_run:
+                return len(line_deltas)
+
+            Product.apply_count_deltas(
+                {code: -delta for code, delta in line_deltas.items()},
+                MovementReason.order,
+                order_id,
+            )
+            if operation == "add":
+                for lines in chunked(line_deltas.items(), SQLITE_MAX_VARIABLES // 3):
+                    OrderProduct.insert_many(
+                        [(count, code, order_id) for code, count in lines],
+                        fields=[
+                            OrderProduct.count,
+                            OrderProduct.product,
+                            OrderProduct.order,
+                        ],
+                    ).execute()
+            elif operation == "remove":
+                OrderProduct.delete_lines(order_id, list(line_deltas))
+            else:
+                for lines in chunked(line_deltas.items(), SQLITE_MAX_VARIABLES // 3):
+                    lines = dict(lines)
+                    OrderProduct.update(
+                        count=OrderProduct.count
+                        + Case(OrderProduct.product, list(lines.items()), 0)
+                    ).where(
+                        OrderProduct.order == order_id,
+                        OrderProduct.product.in_(list(lines)),
+                    ).execute()
+                if operation == "reduce_count":
+                    OrderProduct.delete().where(
+                        OrderProduct.order == order_id, OrderProduct.count == 0
+                    ).execute()
+
+            count = sum(line_deltas.values())
+            price = sum(
+                delta * products[code][1] for code, delta in line_deltas.items()
+            )
+            cls.update(
+                total_count=cls.total_count + count,
+                total_price=cls.total_price + price,
+            ).where(cls.id == order_id).execute()
+            DailyProductSales.add_lines(order.date, line_deltas)
+            DailyCustomerSales.upsert(
+                cls.select(cls.date, cls.customer, Value(count), Value(price)).where(
+                    cls.id == order_id
+                )
+            )
+
+        return len(line_deltas)
+
+    @classmethod
+    def add_to_totals(cls, order_id: int, product_code: str, count: int) -> None:
+        line_price = Product.select(fn.COALESCE(Product.price, 0) * count).where(
+            Product.id == product_code
+        )
+        updated = (
+            cls.update(
+                total_count=cls.total_count + count,
+                total_price=cls.total_price + fn.COALESCE(line_price, 0),
+            )
+            .where(cls.id == order_id)
+            .execute()
+        )
+        if not updated:
+            raise NotFoundException(cls, order_id)
+        DailyProductSales.add_line(order_id, product_code, count)
+        DailyCustomerSales.add_order_totals(order_id, count, line_price)
+
+    @classmethod
+    def refresh_totals(
+        cls, product_codes: list[str] | None = None, exclude_product: bool = False
+    ) -> int:
+        """
+        Recompute the totals of every order, or only of the orders that
+        contain one of product_codes, with a single set-based UPDATE. When
+        exclude_product is set, the lines of those products are left out of
+        the totals, as they are about to be deleted.
+        """
+        lines = OrderProduct.alias()
+        line_product = Product.alias()
+        count_query = lines.select(fn.COALESCE(fn.SUM(lines.count), 0)).where(
+            lines.order == cls.id
+        )
+        price_query = (
+            lines.select(fn.COALESCE(fn.SUM(lines.count * line_product.price), 0))
+            .join(line_product, on=(lines.product == line_product.id))
+            .where(lines.order == cls.id)
+        )
+        if exclude_product:
+            count_query = count_query.where(lines.product.not_in(product_codes))
+            price_query = price_query.where(lines.product.not_in(product_codes))
+
+        query = cls.update(total_count=count_query, total_price=price_query)
+        if product_codes is None:
+            return query.execute()
+
+        orders = OrderProduct.select(OrderProduct.order).where(
+            OrderProduct.product.in_(product_codes)
+        )
+        refreshed = query.where(cls.id.in_(orders)).execute()
+        # The customer sales are a rollup of these totals; a full refresh
+        # leaves them to rebuild_sales_rollups
+        DailyCustomerSales.refresh(orders)
+        return refreshed
 
     @classmethod
     def get_filtered(cls, filters: Dict[str, str | int | None] = None):
-        query = cls.select()
-        subquery = (
-            OrderProduct.select(fn.SUM(OrderProduct.product.price * Product.price))
-            .join(Product)
-            .where(OrderProduct.order == cls.id)
+        return [OrderInfo(*row) for row in cls.filter_query(filters).tuples()]
+
+    @classmethod
+    def get_filtered_rows(
+        cls, filters: Dict[str, str | int | None] = None
+    ) -> Iterator[tuple]:
+        """
+        Stream the matching orders as OrderInfo-ordered tuples, straight from
+        the cursor.
+        """
+        return cls.filter_query(filters).tuples().iterator()
+
+    @classmethod
+    def get_page(
+        cls,
+        filters: Dict[str, str | int | None],
+        paging: Paging,
+    ) -> KeysetPage:
+        """
+        A keyset page of the matching orders, as OrderInfo-ordered tuples.
+        Every sort column is indexed, and SQLite appends the id to them.
+        """
+        sort_fields = {
+            "id": cls.id,
+            "date": cls.date,
+            "total_count": cls.total_count,
+            "total_price": cls.total_price,
+        }
+        sort_by = paging.sort_by or "id"
+        if sort_by not in sort_fields:
+            raise Exception(f"Orders can't be sorted by {sort_by}")
+        sort_field = sort_fields[sort_by]
+        query = cls.filter_query(filters).select_extend(sort_field, cls.id)
+        return KeysetPage(
+            query,
+            sort_by,
+            sort_field,
+            cls.id,
+            paging.descending,
+            paging.limit,
+            paging.after,
         )
 
+    @classmethod
+    def filter_query(cls, filters: Dict[str, str | int | None] = None):
+        query = cls.select(
+            cls.id, cls.total_count, cls.total_price, Customer.name, cls.date
+        ).join(Customer)
+
         if filters:
             for field, value in filters.items():
                 if field == "customer" and value is not None:
-                    query = query.where(cls.customer.name == value)
+                    query = query.where(Customer.name == value)
                 if field == "min_price" and value is not None:
-                    subquery = (
-                        OrderProduct.select(
-                            fn.SUM(OrderProduct.product.price * Product.price)
-                        )
-                        .join(Product)
-                        .where(OrderProduct.order == cls.id)
-                    )
-                    query = query.where(subquery >= value)
+                    query = query.where(cls.total_price >= value)
                 if field == "max_price" and value is not None:
-                    subquery = (
-                        OrderProduct.select(
-                            fn.SUM(OrderProduct.product.price * Product.price)
-                        )
-                        .join(Product)
-                        .where(OrderProduct.order == cls.id)
-                    )
-                    query = query.where(subquery <= value)
+                    query = query.where(cls.total_price <= value)
                 if field == "start_date" and value is not None:
                     query = query.where(cls.date >= value)
                 if field == "end_date" and value is not None:
                     query = query.where(cls.date <= value)
 
-        return [
-            OrderInfo(
-                order.id,
-                cls.get_order_total_count(order.id),
-                cls.get_order_total_price(order.id),
-                order.customer.name,
-                order.date,
-            )
-            for order in query
-        ]
+        return query
 
     @classmethod
     def get_order_products(cls, order_id: int) -> list[OrderProductInfo]:
-        selected_order = get_or_raise(cls, order_id)
-        return [
-            OrderProductInfo(
-                product_code=order_product.product.id, count=order_product.count
-            )
-            for order_product in selected_order.products
-        ]
+        query = OrderProduct.select(OrderProduct.product, OrderProduct.count).where(
+            OrderProduct.order == order_id
+        )
+        order_products = [OrderProductInfo(*row) for row in query.tuples()]
+        if not order_products:
+            get_or_raise(cls, order_id)
+        return order_products
 
     @classmethod
     def get_order_product_infos(cls, order_id: int) -> list[ProductInfo]:
-        selected_order = get_or_raise(cls, order_id)
+        # The order's count replaces the product's stock count
+        fields = Product.info_fields()[:-1] + [OrderProduct.count]
         return [
-            ProductInfo(
-                code=order_product.product.id,
-                description=order_product.product.description,
-                brand=order_product.product.brand,
-                count_in_carton=order_product.product.count_in_carton,
-                price=order_product.product.price,
-                count=order_product.count,
-            )
-            for order_product in selected_order.products
+            ProductInfo(*row) for row in cls.get_order_product_rows(order_id, *fields)
         ]
 
     @classmethod
-    def get_order_total_count(cls, order_id: int) -> int:
-        selected_order = get_or_raise(cls, order_id)
-        return sum(order_product.count for order_product in selected_order.products)
+    def get_order_product_rows(cls, order_id: int, *fields) -> Iterator[tuple]:
+        """
+        Stream the selected Product and OrderProduct fields of every line of
+        the order as tuples, with a single joined query.
+        """
+        get_or_raise(cls, order_id)
+        return (
+            OrderProduct.select(*fields)
+            .join(Product)
+            .where(OrderProduct.order == order_id)
+            .tuples()
+            .iterator()
+        )
 
     @classmethod
-    def get_order_total_price(cls, order_id: int) -> int:
-        selected_order = get_or_raise(cls, order_id)
-        return sum(
-            (
-                order_product.count
-                * Product.get_product_info(order_product.product).price
+    def get_line_rows(
+        cls, filters: Dict[str, str | int | None] = None
+    ) -> Iterator[tuple]:
+        """
+        Stream the lines of every matching order with one joined query, as
+        (customer_id, customer_name, order_id, code, description, brand,
+        count_in_carton, price, count) tuples ordered by customer and order.
+        """
+        return (
+            cls.filter_query(filters)
+            .select(
+                Customer.id,
+                Customer.name,
+                cls.id,
+                Product.id,
+                Product.description,
+                Product.brand,
+                Product.count_in_carton,
+                fn.COALESCE(Product.price, 0),
+                OrderProduct.count,
             )
-            for order_product in selected_order.products
+            .join_from(cls, OrderProduct)
+            .join(Product)
+            .order_by(Customer.name, cls.id, Product.id)
+            .tuples()
+            .iterator()
         )
 
+    @classmethod
+    def get_order_total_count(cls, order_id: int) -> int:
+        return get_or_raise(cls, order_id).total_count
+
+    @classmethod
+    def get_order_total_price(cls, order_id: int) -> int:
+        return get_or_raise(cls, order_id).total_price
+
 
 class OrderProduct(BaseModel):
     count = IntegerField()
@@ -335,24 +1116,613 @@ class OrderProduct(BaseModel):
 
     @classmethod
     def find_by_ids(cls, order_id: int, product_code: str) -> "OrderProduct":
-        found_order = get_or_raise(Order, order_id)
-        found_product = get_or_raise(Product, product_code)
+        try:
+            return cls.get(cls.order == order_id, cls.product == product_code)
+        except DoesNotExist:
+            raise cls.not_found(order_id, product_code)
 
-        order_product = OrderProduct.get(
-            OrderProduct.order == found_order, OrderProduct.product == found_product
+    @classmethod
+    def get_count(cls, order_id: int, product_code: str) -> int:
+        count = (
+            cls.select(cls.count)
+            .where(cls.order == order_id, cls.product == product_code)
+            .scalar()
         )
-        return order_product
+        if count is None:
+            raise cls.not_found(order_id, product_code)
+        return count
+
+    @classmethod
+    def delete_lines(cls, order_id: int, product_codes: list[str]) -> None:
+        for codes in chunked(product_codes, SQLITE_MAX_VARIABLES - 1):
+            cls.delete().where(
+                cls.order == order_id, cls.product.in_(codes)
+            ).execute()
+
+    @staticmethod
+    def not_found(order_id: int, product_code: str) -> Exception:
+        return Exception(f"Product {product_code} is not in order {order_id}")
 
     class Meta:
         primary_key = CompositeKey("product", "order")
 
 
+class StockMovement(BaseModel):
+    """
+    Append-only ledger of every change to a product's count. Rows are never
+    updated or deleted, so the count of a product at any moment is its last
+    snapshot plus the deltas recorded after it.
+    """
+
+    # A plain code rather than a foreign key, as the history outlives
+    # removed products
+    product = CharField()
+    delta = IntegerField()
+    reason = CharField()
+    order = ForeignKeyField(Order, null=True, backref="movements")
+    timestamp = DateTimeField()
+
+    @classmethod
+    def record(
+        cls,
+        deltas: dict[str, int],
+        reason: MovementReason,
+        order_id: int | None = None,
+    ) -> None:
+        """
+        Record the deltas of the given codes with chunked multi-row INSERTs,
+        taking a snapshot whenever the ledger grows past another
+        SNAPSHOT_INTERVAL movements.
+        """
+        timestamp = datetime.datetime.now()
+        rows = [
+            (code, delta, reason.value, order_id, timestamp)
+            for code, delta in deltas.items()
+            if delta
+        ]
+        fields = [cls.product, cls.delta, cls.reason, cls.order, cls.timestamp]
+        last_id = None
+        for batch in chunked(rows, SQLITE_MAX_VARIABLES // len(fields)):
+            last_id = cls.insert_many(batch, fields=fields).execute()
+        if last_id is None:
+            return
+        first_id = last_id - len(rows) + 1
+        if last_id // SNAPSHOT_INTERVAL > (first_id - 1) // SNAPSHOT_INTERVAL:
+            StockSnapshot.take()
+
+    @classmethod
+    def record_opening_balances(cls) -> None:
+        """
+        Record the current count of every product as an adjustment, for
+        products whose stock was set without going through the ledger.
+        """
+        timestamp = datetime.datetime.now()
+        cls.insert_from(
+            Product.select(
+                Product.id,
+                Product.count,
+                MovementReason.adjustment.value,
+                timestamp,
+            ).where(Product.count != 0),
+            fields=[cls.product, cls.delta, cls.reason, cls.timestamp],
+        ).execute()
+        StockSnapshot.take()
+
+    @staticmethod
+    def counts_since(snapshot_id: int, *conditions) -> Select:
+        """
+        (product, count) rows of the counts in the given snapshot plus the
+        movements recorded after it that match the conditions, leaving out
+        products without stock. The movements are read with one range scan
+        of the ledger's primary key.
+        """
+        changes = (
+            StockSnapshotCount.select(
+                StockSnapshotCount.product, StockSnapshotCount.count
+            ).where(StockSnapshotCount.snapshot == snapshot_id)
+            + StockMovement.select(
+                StockMovement.product, StockMovement.delta
+            ).where(StockMovement.id > snapshot_id, *conditions)
+        ).alias("changes")
+        count = fn.SUM(changes.c.count)
+        return (
+            Select([changes], [changes.c.product, count.alias("count")])
+            .group_by(changes.c.product)
+            .having(count != 0)
+            .bind(db)
+        )
+
+    @classmethod
+    def counts_before(cls, moment: datetime.datetime) -> Select:
+        """
+        (product, count) rows of the stock on hand just before moment. The
+        ledger is only scanned between the snapshots either side of it.
+        """
+        snapshots = StockSnapshot.select(StockSnapshot.movement).limit(1)
+        previous_id, next_id = (
+            Select(
+                columns=[
+                    snapshots.where(StockSnapshot.timestamp < moment).order_by(
+                        StockSnapshot.timestamp.desc()
+                    ),
+                    snapshots.where(StockSnapshot.timestamp >= moment).order_by(
+                        StockSnapshot.timestamp
+                    ),
+                ]
+            )
+            .bind(db)
+            .tuples()
+            .get()
+        )
+        conditions = [cls.timestamp < moment]
+        if next_id is not None:
+            conditions.append(cls.id <= next_id)
+        return cls.counts_since(previous_id or 0, *conditions)
+
+
+class StockSnapshot(BaseModel):
+    # The last movement the snapshot includes, and when it was recorded
+    movement = IntegerField(primary_key=True)
+    timestamp = DateTimeField(index=True)
+
+    @classmethod
+    def take(cls) -> int | None:
+        """
+        Snapshot the count of every product from the previous snapshot and
+        the movements recorded since, in one INSERT ... SELECT. Returns the
+        id of the last movement the snapshot includes.
+        """
+        with db.atomic():
+            last_id, timestamp = (
+                StockMovement.select(StockMovement.id, StockMovement.timestamp)
+                .order_by(StockMovement.id.desc())
+                .limit(1)
+                .tuples()
+                .first()
+            ) or (None, None)
+            previous_id = cls.select(fn.MAX(cls.movement)).scalar() or 0
+            if last_id is None or last_id == previous_id:
+                return last_id
+
+            cls.insert(movement=last_id, timestamp=timestamp).execute()
+            counts = StockMovement.counts_since(
+                previous_id, StockMovement.id <= last_id
+            ).alias("counts")
+            StockSnapshotCount.insert_from(
+                Select([counts], [Value(last_id), counts.c.product, counts.c.count]),
+                fields=[
+                    StockSnapshotCount.snapshot,
+                    StockSnapshotCount.product,
+                    StockSnapshotCount.count,
+                ],
+            ).execute()
+        return last_id
+
+
+class StockSnapshotCount(BaseModel):
+    # The primary key already indexes the snapshot
+    snapshot = ForeignKeyField(StockSnapshot, backref="counts", index=False)
+    product = CharField()
+    count = IntegerField()
+
+    class Meta:
+        primary_key = CompositeKey("snapshot", "product")
+
+
+def filter_days(query, day_field, filters: Dict[str, str | int | None] = None):
+    if filters:
+        if filters.get("start_date") is not None:
+            query = query.where(day_field >= filters["start_date"])
+        if filters.get("end_date") is not None:
+            query = query.where(day_field <= filters["end_date"])
+    return query
+
+
+class DailyProductSales(BaseModel):
+    """
+    Units of every product sold per day, kept up to date as order lines
+    change. Revenue is taken from the current price when reporting, the
+    same way order totals follow price changes.
+    """
+
+    day = DateField()
+    product = CharField()
+    count = IntegerField()
+
+    class Meta:
+        primary_key = CompositeKey("day", "product")
+        without_rowid = True
+
+    @classmethod
+    def upsert(cls, query) -> None:
+        cls.insert_from(query, fields=[cls.day, cls.product, cls.count]).on_conflict(
+            conflict_target=[cls.day, cls.product],
+            update={cls.count: cls.count + EXCLUDED.count},
+        ).execute()
+
+    @classmethod
+    def add_line(cls, order_id: int, product_code: str, count: int) -> None:
+        cls.upsert(
+            Order.select(Order.date, Value(product_code), Value(count)).where(
+                Order.id == order_id
+            )
+        )
+
+    @classmethod
+    def add_lines(cls, day: datetime.date, counts: dict[str, int]) -> None:
+        for batch in chunked(counts.items(), SQLITE_MAX_VARIABLES // 3):
+            cls.insert_many(
+                [(day, code, count) for code, count in batch],
+                fields=[cls.day, cls.product, cls.count],
+            ).on_conflict(
+                conflict_target=[cls.day, cls.product],
+                update={cls.count: cls.count + EXCLUDED.count},
+            ).execute()
+
+    @classmethod
+    def rebuild(cls) -> None:
+        cls.delete().execute()
+        cls.insert_from(
+            OrderProduct.select(
+                Order.date, OrderProduct.product, fn.SUM(OrderProduct.count)
+            )
+            .join(Order)
+            .group_by(Order.date, OrderProduct.product),
+            fields=[cls.day, cls.product, cls.count],
+        ).execute()
+
+    @classmethod
+    def get_rows(
+        cls, group_by: str, filters: Dict[str, str | int | None] = None
+    ) -> Iterator[tuple]:
+        """
+        Stream (code, description, brand, count, revenue) tuples per product,
+        or (brand, count, revenue) tuples per brand, in the date range.
+        """
+        # Products are looked up once per product rather than once per day
+        totals = filter_days(
+            cls.select(cls.product, fn.SUM(cls.count).alias("count")),
+            cls.day,
+            filters,
+        ).group_by(cls.product)
+        totals = totals.alias("totals")
+        count = fn.SUM(totals.c.count)
+        revenue = fn.SUM(totals.c.count * fn.COALESCE(Product.price, 0))
+        if group_by == "product":
+            keys = [Product.id, Product.description, Product.brand]
+        else:
+            keys = [Product.brand]
+        return (
+            Product.select(*keys, count, revenue)
+            .join(totals, on=(totals.c.product == Product.id))
+            .group_by(keys[0])
+            .having(count != 0)
+            .order_by(keys[0])
+            .tuples()
+            .iterator()
+        )
+
+
+class DailyCustomerSales(BaseModel):
+    """
+    Units sold to every customer and their revenue per day, a rollup of the
+    order totals kept up to date with them.
+    """
+
+    day = DateField()
+    # The primary key already indexes the day first; customers are only
+    # ever looked up together with it
+    customer = ForeignKeyField(Customer, index=False)
+    count = IntegerField()
+    revenue = IntegerField()
+
+    class Meta:
+        primary_key = CompositeKey("day", "customer")
+        without_rowid = True
+
+    @classmethod
+    def upsert(cls, query) -> None:
+        cls.insert_from(
+            query, fields=[cls.day, cls.customer, cls.count, cls.revenue]
+        ).on_conflict(
+            conflict_target=[cls.day, cls.customer],
+            update={
+                cls.count: cls.count + EXCLUDED.count,
+                cls.revenue: cls.revenue + EXCLUDED.revenue,
+            },
+        ).execute()
+
+    @classmethod
+    def add_order_totals(cls, order_id: int, count: int, revenue) -> None:
+        cls.upsert(
+            Order.select(
+                Order.date, Order.customer, Value(count), fn.COALESCE(revenue, 0)
+            ).where(Order.id == order_id)
+        )
+
+    @classmethod
+    def refresh(cls, orders) -> None:
+        """
+        Recompute the rows of the days and customers of the given orders
+        (a query of order ids) from the order totals.
+        """
+        changed = Order.alias()
+        keys = changed.select(changed.date, changed.customer).where(
+            changed.id.in_(orders)
+        )
+        cls.insert_from(
+            cls.totals_query().where(Tuple(Order.date, Order.customer).in_(keys)),
+            fields=[cls.day, cls.customer, cls.count, cls.revenue],
+        ).on_conflict_replace().execute()
+
+    @classmethod
+    def rebuild(cls) -> None:
+        cls.delete().execute()
+        cls.insert_from(
+            cls.totals_query(),
+            fields=[cls.day, cls.customer, cls.count, cls.revenue],
+        ).execute()
+
+    @staticmethod
+    def totals_query():
+        return Order.select(
+            Order.date,
+            Order.customer,
+            fn.SUM(Order.total_count),
+            fn.SUM(Order.total_price),
+        ).group_by(Order.date, Order.customer)
+
+    @classmethod
+    def get_rows(
+        cls, group_by: str, filters: Dict[str, str | int | None] = None
+    ) -> Iterator[tuple]:
+        """
+        Stream (key, count, revenue) tuples per customer name, day or month
+        ("YYYY-MM") in the date range.
+        """
+        count = fn.SUM(cls.count)
+        if group_by == "customer":
+            key = Customer.name
+            query = cls.select(key, count, fn.SUM(cls.revenue)).join(Customer)
+        else:
+            key = cls.day if group_by == "day" else fn.strftime("%Y-%m", cls.day)
+            query = cls.select(key, count, fn.SUM(cls.revenue))
+        query = query.group_by(key).having(count != 0).order_by(key)
+        return filter_days(query, cls.day, filters).tuples().iterator()
+
+
+def rebuild_sales_rollups() -> None:
+    with db.atomic():
+        DailyProductSales.rebuild()
+        DailyCustomerSales.rebuild()
+
+
+def normalize_search_sql(column: str) -> str:
+    for old, new in SEARCH_CHARACTERS.items():
+        column = f"replace({column}, '{old}', '{new}')"
+    return column
+
+
+def _indexed_columns(prefix: str = "") -> str:
+    # The code is stored as it is, since products are joined on it
+    return ", ".join(
+        [prefix + "id"]
+        + [normalize_search_sql(prefix + column) for column in ("description", "brand")]
+    )
+
+
+# Finds the row of product old.id through the code's own words, as a plain
+# lookup by code would read the whole index. Codes without a letter or digit
+# have no words to find them by, and only those are looked up by a scan.
+_DELETE_SEARCH_ROW_SQL = (
+    "DELETE FROM productsearch WHERE productsearch MATCH "
+    "'code : \"' || replace(old.id, '\"', '\"\"') || '\"' AND code = old.id; "
+    "DELETE FROM productsearch "
+    "WHERE old.id NOT GLOB '*[0-9A-Za-z]*' AND code = old.id;"
+)
+
+# The code weighs the most in the ranking, then the brand, then the
+# description
+SEARCH_INDEX_SQL = [
+    "CREATE VIRTUAL TABLE productsearch USING fts5("
+    "code, description, brand, "
+    "prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+    "INSERT INTO productsearch(productsearch, rank) "
+    "VALUES ('rank', 'bm25(10.0, 1.0, 2.0)')",
+    "CREATE TRIGGER productsearch_insert AFTER INSERT ON product BEGIN "
+    "INSERT INTO productsearch(code, description, brand) "
+    f"VALUES ({_indexed_columns('new.')}); END",
+    "CREATE TRIGGER productsearch_delete AFTER DELETE ON product BEGIN "
+    f"{_DELETE_SEARCH_ROW_SQL} END",
+    # Count and price updates leave the index alone, as do catalogue upserts
+    # that set the description and brand to the values they already had
+    "CREATE TRIGGER productsearch_update "
+    "AFTER UPDATE OF id, description, brand ON product "
+    "WHEN old.id IS NOT new.id OR old.description IS NOT new.description "
+    "OR old.brand IS NOT new.brand BEGIN "
+    f"{_DELETE_SEARCH_ROW_SQL} "
+    "INSERT INTO productsearch(code, description, brand) "
+    f"VALUES ({_indexed_columns('new.')}); END",
+]
+SEARCH_INDEX_OBJECTS = [
+    ("TRIGGER", "productsearch_insert"),
+    ("TRIGGER", "productsearch_delete"),
+    ("TRIGGER", "productsearch_update"),
+    ("TABLE", "productsearch"),
+]
+
+
+class ProductSearch(BaseModel):
+    """
+    The FTS5 index over the code, description and brand of the products,
+    with the Persian forms of the letters in SEARCH_CHARACTERS in the
+    description and brand. It is kept in sync with the product table by
+    triggers, and created by create_search_index rather than create_tables.
+    """
+
+    rowid = IntegerField(primary_key=True)
+    code = CharField()
+    description = CharField()
+    brand = CharField()
+    # Hidden columns of FTS5: the one named after the table takes MATCH
+    # queries and rank is the relevance of a match, lowest first
+    productsearch = VirtualField(CharField)
+    rank = VirtualField(FloatField)
+
+    class Meta:
+        table_name = "productsearch"
+
+    @classmethod
+    def match(cls, expression: str) -> Expression:
+        return Expression(cls.productsearch, "MATCH", expression)
+
+
+def search_expression(text: str) -> str:
+    """
+    An FTS5 query matching the rows with a word starting with every word of
+    text. The words are quoted, so FTS5 syntax is searched for as text.
+    """
+    terms = [
+        '"' + term.replace('"', '""') + '"*'
+        for term in text.translate(SEARCH_TRANSLATION).split()
+        if any(character.isalnum() for character in term)
+    ]
+    if not terms:
+        raise Exception("There is nothing to search for")
+    return " AND ".join(terms)
+
+
+def create_search_index() -> None:
+    if db.table_exists(ProductSearch._meta.table_name):
+        return
+    with db.atomic():
+        for statement in SEARCH_INDEX_SQL:
+            db.execute_sql(statement)
+
+
+def drop_search_index() -> None:
+    with db.atomic():
+        for kind, name in SEARCH_INDEX_OBJECTS:
+            db.execute_sql(f"DROP {kind} IF EXISTS {name}")
+
+
+def rebuild_search_index() -> int:
+    """
+    Index every product from scratch. Returns the number of products
+    indexed.
+    """
+    with db.atomic():
+        db.execute_sql("DELETE FROM productsearch")
+        cursor = db.execute_sql(
+            "INSERT INTO productsearch(code, description, brand) "
+            f"SELECT {_indexed_columns()} FROM product"
+        )
+        db.execute_sql("INSERT INTO productsearch(productsearch) VALUES ('optimize')")
+    return cursor.rowcount
+
+
 class NotFoundException(Exception):
     def __init__(self, model_object: Type[Model], model_id: str):
         super().__init__(f"{model_object.__name__} with id {model_id} was not found")
 
 
-def get_or_raise(model_object: Type[Model], model_identifier: str):
+class BatchException(Exception):
+    def __init__(self, errors: list[str]):
+        self.errors = errors
+        super().__init__("\n".join(errors))
+
+
+@contextmanager
+def read_snapshot() -> Iterator[None]:
+    """
+    Run the enclosed queries in one read transaction, so they all see the
+    same snapshot. With the WAL journal of the "fast" profile, writers can
+    keep committing while the snapshot is open.
+    """
+    with db.atomic():
+        yield
+
+
+class LookupCache:
+    """
+    A least recently used cache of up to maxsize lookups, shared by the
+    threads of the process. It is emptied whenever the database may have
+    changed since the lookups were read: when another connection committed,
+    which PRAGMA data_version tells, or when this connection changed any
+    row, which sqlite3 counts in total_changes. Both only compare on the
+    connection they were read from, so a lookup on any other connection
+    empties it too; the server runs every request on one connection. Lookups
+    made inside a transaction bypass it, as they may read writes that get
+    rolled back.
+
+    Caching is off until enabled, as checking data_version costs a
+    statement that only pays off in a long-lived process like the server.
+    """
+
+    def __init__(self, maxsize: int = LOOKUP_CACHE_SIZE, own_writes: bool = True):
+        self.maxsize = maxsize
+        # Whether writes of this process may change the cached lookups
+        self.own_writes = own_writes
+        self.enabled = False
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Loads happen under the lock too, so a lookup read before a change
+        # can't be stored after the change emptied the cache
+        self.lock = threading.Lock()
+        # The connection of the last lookup and the version of the database
+        # it saw
+        self.version = None
+
+    def get(self, key, load: Callable):
+        if not self.enabled or db.in_transaction():
+            return load(key)
+        with self.lock:
+            self.validate()
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+            value = self.entries[key] = load(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            return value
+
+    def validate(self) -> None:
+        connection = db.connection()
+        changes = connection.total_changes if self.own_writes else None
+        version = (connection, changes, db.pragma("data_version"))
+        if self.version != version:
+            self.entries.clear()
+            self.version = version
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+# Product rows by code, as the field values of a model instance, and
+# customer ids by name. Customers are never renamed or removed, so adding
+# orders and customers can't change the id a name has.
+lookup_caches = {
+    "product": LookupCache(),
+    "customer": LookupCache(own_writes=False),
+}
+MODEL_CACHES = {Product: lookup_caches["product"]}
+
+
+def enable_lookup_caches(enabled: bool = True) -> None:
+    for cache in lookup_caches.values():
+        cache.enabled = enabled
+        cache.clear()
+
+
+def load_or_raise(model_object: Type[Model], model_identifier: str):
     try:
         selected_object = model_object.get(model_object.id == model_identifier)
     except DoesNotExist:
@@ -360,8 +1730,59 @@ def get_or_raise(model_object: Type[Model], model_identifier: str):
     return selected_object
 
 
+def get_or_raise(model_object: Type[Model], model_identifier: str):
+    cache = MODEL_CACHES.get(model_object)
+    if cache is None:
+        return load_or_raise(model_object, model_identifier)
+    data = cache.get(
+        model_identifier, lambda key: load_or_raise(model_object, key).__data__
+    )
+    # A new instance every time, so changes made to it never reach the cache
+    return model_object(**data)
+
+
+MODELS = [
+    Product,
+    Customer,
+    Order,
+    OrderProduct,
+    StockMovement,
+    StockSnapshot,
+    StockSnapshotCount,
+    DailyProductSales,
+    DailyCustomerSales,
+]
+
+
 def create_tables():
-    db.create_tables([Product, Customer, Order, OrderProduct])
+    db.create_tables(MODELS)
+    create_search_index()
+
+
+def add_order_total_columns() -> bool:
+    """
+    Add the total_count and total_price columns to an order table created
+    before they existed. Returns whether the columns had to be added.
+    """
+    # playhouse.migrate pulls in the other database backends, so only the
+    # upgrade path imports it
+    from playhouse.migrate import SqliteMigrator, migrate
+
+    columns = [column.name for column in db.get_columns(Order._meta.table_name)]
+    missing_fields = [
+        field
+        for field in (Order.total_count, Order.total_price)
+        if field.column_name not in columns
+    ]
+    migrator = SqliteMigrator(db)
+    with db.atomic():
+        migrate(
+            *[
+                migrator.add_column(Order._meta.table_name, field.column_name, field)
+                for field in missing_fields
+            ]
+        )
+    return bool(missing_fields)
 
 
 if __name__ == "__main__":
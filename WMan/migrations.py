@@ -0,0 +1,151 @@
+"""
+Versioned schema migrations for existing warehouse databases.
+
+The schema version is stored in SQLite's user_version header field. Fresh
+databases are created at the latest version; older ones run every pending
+migration, in order, inside a single transaction.
+"""
+from typing import Callable
+
+from peewee import ModelIndex, fn
+
+from WMan.database import (
+    Customer,
+    DailyCustomerSales,
+    DailyProductSales,
+    Order,
+    OrderProduct,
+    Product,
+    StockMovement,
+    StockSnapshot,
+    StockSnapshotCount,
+    add_order_total_columns,
+    create_search_index,
+    create_tables,
+    db,
+    drop_search_index,
+    rebuild_sales_rollups,
+    rebuild_search_index,
+)
+
+
+def add_order_totals():
+    if add_order_total_columns():
+        Order.refresh_totals()
+
+
+def add_lookup_indexes():
+    duplicate_names = [
+        name
+        for (name,) in Customer.select(Customer.name)
+        .group_by(Customer.name)
+        .having(fn.COUNT(Customer.id) > 1)
+        .tuples()
+    ]
+    if duplicate_names:
+        raise Exception(
+            "Customer names must be unique before upgrading, duplicated names: "
+            + ", ".join(duplicate_names)
+        )
+
+    for model, fields, unique in [
+        (Customer, [Customer.name], True),
+        (Product, [Product.brand], False),
+        (Product, [Product.price], False),
+        (Product, [Product.count], False),
+        (Order, [Order.date], False),
+        # Foreign keys of the tables that predate the migrations
+        (Order, [Order.customer], False),
+        (OrderProduct, [OrderProduct.product], False),
+        (OrderProduct, [OrderProduct.order], False),
+    ]:
+        db.execute(ModelIndex(model, fields, unique=unique, safe=True))
+
+
+def add_sort_indexes():
+    # Keyset pagination sorts products by a column and then by code, which
+    # these indexes cover; they replace the single-column ones
+    for name in ("product_brand", "product_price", "product_count"):
+        db.execute_sql(f'DROP INDEX IF EXISTS "{name}"')
+    for model, fields in [
+        (Product, [Product.brand, Product.id]),
+        (Product, [Product.price, Product.id]),
+        (Product, [Product.count, Product.id]),
+        (Order, [Order.total_count]),
+        (Order, [Order.total_price]),
+    ]:
+        db.execute(ModelIndex(model, fields, safe=True))
+
+
+def add_stock_ledger():
+    # Existing stock enters the ledger as opening balances
+    db.create_tables([StockMovement, StockSnapshot, StockSnapshotCount])
+    StockMovement.record_opening_balances()
+
+
+def add_sales_rollups():
+    db.create_tables([DailyProductSales, DailyCustomerSales])
+    rebuild_sales_rollups()
+
+
+def add_search_index():
+    create_search_index()
+    rebuild_search_index()
+
+
+def key_search_index_by_code():
+    # The first index was keyed by product rowids, which a VACUUM may
+    # renumber
+    drop_search_index()
+    add_search_index()
+
+
+# The position of a migration in this list is the version it upgrades to,
+# so new migrations must only ever be appended
+MIGRATIONS: list[Callable[[], None]] = [
+    add_order_totals,
+    add_lookup_indexes,
+    add_sort_indexes,
+    add_stock_ledger,
+    add_sales_rollups,
+    add_search_index,
+    key_search_index_by_code,
+]
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version() -> int:
+    return db.pragma("user_version")
+
+
+def set_schema_version(version: int) -> None:
+    db.pragma("user_version", version)
+
+
+def migrate_database() -> int:
+    """
+    Create or upgrade the database to the latest schema version. Returns
+    the number of migrations that were applied.
+    """
+    # Runs before every command, so an up-to-date database costs one PRAGMA
+    version = get_schema_version()
+    if version == LATEST_VERSION:
+        return 0
+
+    if not db.table_exists(Product._meta.table_name):
+        with db.atomic():
+            create_tables()
+            set_schema_version(LATEST_VERSION)
+        return 0
+
+    if version > LATEST_VERSION:
+        raise Exception(
+            f"The database schema version {version} is newer than this version "
+            f"of WMan supports ({LATEST_VERSION})"
+        )
+
+    with db.atomic():
+        for new_version, migration in enumerate(MIGRATIONS[version:], version + 1):
+            migration()
+            set_schema_version(new_version)
+    return LATEST_VERSION - version
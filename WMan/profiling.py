@@ -0,0 +1,219 @@
+"""
+Profiling of a single command, enabled with `--profile` or WMAN_PROFILE.
+
+The wall time of the command is split into exclusive phases: "read" for
+reading input files, "query" for executing SQL, "render" for building and
+printing tables, "write" for writing sheets and streams, and "transform"
+for the time spent outside all of them, which is mostly turning rows into
+infos and the rows of the output. SQL statements are counted and timed with
+peewee's query hooks; their time is taken out of whatever phase ran them.
+
+The peak resident memory of the process is always reported. The peak of
+the Python heap comes from tracemalloc, which is only started with
+`--profile-memory` or WMAN_PROFILE_MEMORY, as it slows sheet exports down
+several times and would skew the phase times.
+
+When profiling is off, the phase markers cost a single global lookup.
+"""
+import functools
+import json
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Iterable, Iterator
+
+PROFILE_ENV = "WMAN_PROFILE"
+PROFILE_MEMORY_ENV = "WMAN_PROFILE_MEMORY"
+PROFILE_OUTPUT_ENV = "WMAN_PROFILE_OUTPUT"
+CPROFILE_OUTPUT_ENV = "WMAN_CPROFILE_OUTPUT"
+
+DEFAULT_PHASE = "transform"
+
+
+class Profile:
+    def __init__(self, command: str):
+        self.command = command
+        self.phases: dict[str, float] = {}
+        self.stack = [DEFAULT_PHASE]
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.peak_memory = None
+        self.peak_rss = None
+        self.wall_seconds = None
+        self.start = self.mark = time.perf_counter()
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def switch(self) -> None:
+        # Charge the time since the last switch to the phase that was running
+        now = time.perf_counter()
+        self.add(self.stack[-1], now - self.mark)
+        self.mark = now
+
+    def enter(self, phase: str) -> None:
+        self.switch()
+        self.stack.append(phase)
+
+    def exit(self) -> None:
+        self.switch()
+        self.stack.pop()
+
+    def record_query(self, event) -> None:
+        self.statements += 1
+        self.sql_seconds += event.duration
+        self.add("query", event.duration)
+        self.add(self.stack[-1], -event.duration)
+
+    def stop(self) -> None:
+        self.switch()
+        self.wall_seconds = time.perf_counter() - self.start
+
+    def as_dict(self) -> dict:
+        return {
+            "command": self.command,
+            "wall_seconds": self.wall_seconds,
+            "phases": dict(sorted(self.phases.items(), key=lambda item: -item[1])),
+            "sql": {"statements": self.statements, "seconds": self.sql_seconds},
+            "peak_memory_bytes": self.peak_memory,
+            "peak_rss_bytes": self.peak_rss,
+        }
+
+    def format(self) -> str:
+        lines = [f"Profile of '{self.command}': {self.wall_seconds:.3f} s"]
+        for phase, seconds in self.as_dict()["phases"].items():
+            share = seconds / self.wall_seconds * 100 if self.wall_seconds else 0
+            lines.append(f"  {phase:<10} {seconds:8.3f} s {share:5.1f}%")
+        lines.append(
+            f"SQL: {self.statements} statements in {self.sql_seconds:.3f} s"
+        )
+        if self.peak_rss is not None:
+            lines.append(f"Peak RSS: {self.peak_rss / 2**20:.1f} MiB")
+        if self.peak_memory is not None:
+            lines.append(f"Peak traced memory: {self.peak_memory / 2**20:.1f} MiB")
+        return "\n".join(lines)
+
+
+current: Profile | None = None
+cprofiler = None
+
+
+def phase(name: str):
+    """
+    Context manager charging the enclosed time to the named phase.
+    """
+    if current is None:
+        return nullcontext()
+    return _phase(current, name)
+
+
+@contextmanager
+def _phase(profile: Profile, name: str) -> Iterator[None]:
+    profile.enter(name)
+    try:
+        yield
+    finally:
+        profile.exit()
+
+
+def in_phase(name: str) -> Callable[[Callable], Callable]:
+    """
+    Decorator charging the calls of the function to the named phase.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if current is None:
+                return function(*args, **kwargs)
+            with _phase(current, name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_iter(name: str, iterable: Iterable) -> Iterable:
+    """
+    Charge the time spent producing each item of the iterable to the named
+    phase, and the time spent consuming it to the caller's.
+    """
+    if current is None:
+        return iterable
+    return _timed_iter(current, name, iter(iterable))
+
+
+def _timed_iter(profile: Profile, name: str, iterator: Iterator) -> Iterator:
+    while True:
+        profile.enter(name)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            profile.exit()
+        yield item
+
+
+def peak_rss() -> int | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS and in KiB everywhere else
+    unit = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+
+
+def start(
+    command: str, trace_memory: bool = False, use_cprofile: bool = False
+) -> Profile:
+    global current, cprofiler
+    import tracemalloc
+
+    from WMan.database import db
+
+    current = Profile(command)
+    db.query_hooks.append(current.record_query)
+    if trace_memory:
+        tracemalloc.start()
+    if use_cprofile:
+        import cProfile
+
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
+    return current
+
+
+def finish(
+    output: str | None = None, cprofile_output: str | None = None, report=True
+) -> Profile:
+    """
+    Stop profiling, print the report to stderr and write it to output as
+    JSON, and the cProfile statistics to cprofile_output.
+    """
+    global current, cprofiler
+    import tracemalloc
+
+    from WMan.database import db
+
+    profile = current
+    if cprofiler is not None:
+        cprofiler.disable()
+        if cprofile_output:
+            cprofiler.dump_stats(cprofile_output)
+    profile.stop()
+    profile.peak_rss = peak_rss()
+    if tracemalloc.is_tracing():
+        profile.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    db.query_hooks.remove(profile.record_query)
+    current = cprofiler = None
+
+    if report:
+        print(profile.format(), file=sys.stderr)
+    if output:
+        with open(output, "w") as file:
+            json.dump(profile.as_dict(), file, indent=2)
+    return profile
@@ -0,0 +1,216 @@
+"""
+Long-running server answering WMan operations on a Unix socket, so scanner
+stations don't start a process, import the stack and open the database for
+every operation.
+
+Requests and responses are JSON objects, one per line:
+
+    {"op": "availability.add", "args": {"code": "P1", "count": 3}}
+    {"ok": true, "result": null}
+    {"ok": false, "type": "NotFoundException", "error": "..."}
+
+Each client connection is read by its own thread, but every request runs
+on one database thread, on one SQLite connection that stays open for the
+life of the server. Requests from every client find it, and SQLite's page
+cache, warm, and writes queue in the server instead of retrying on SQLite's
+busy timeout.
+"""
+import datetime
+import json
+import os
+import socket
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from WMan.CustomerManager import CustomerManager
+from WMan.database import (
+    Customer,
+    OrderProductInfo,
+    Paging,
+    Product,
+    ProductInfo,
+    db,
+    enable_lookup_caches,
+    lookup_caches,
+)
+from WMan.OrderManager import OrderManager
+from WMan.ProductManager import ProductManager
+
+
+def info_dict(info) -> dict:
+    return {field: getattr(info, field) for field in type(info).__slots__}
+
+
+def page_dict(page) -> dict:
+    return {"items": [info_dict(item) for item in page.items], "cursor": page.cursor}
+
+
+def product_info(code: str) -> dict:
+    return info_dict(Product.get_product_info(code))
+
+
+def product_list(
+    filters: dict | None = None,
+    sort_by: str | None = None,
+    descending: bool = False,
+    limit: int | None = None,
+    after: str | None = None,
+) -> dict:
+    paging = Paging(sort_by, descending, limit, after)
+    return page_dict(ProductManager.get_page(filters, paging))
+
+
+def product_add(code: str, **fields) -> None:
+    ProductManager.add(ProductInfo(code, **fields))
+
+
+def product_update(code: str, **fields) -> None:
+    ProductManager.update(ProductInfo(code, **fields))
+
+
+def availability_info(codes: list[str]) -> list[dict]:
+    return [info_dict(product) for product in Product.get_product_infos(codes)]
+
+
+def availability_add(code: str, count: int) -> None:
+    ProductManager.add_count(ProductInfo(code=code, count=count))
+
+
+def availability_reduce(code: str, count: int) -> None:
+    ProductManager.reduce_count(ProductInfo(code=code, count=count))
+
+
+def customer_list() -> list[dict]:
+    return [
+        {"id": customer_id, "name": name}
+        for customer_id, name in Customer.get_filtered_rows({})
+    ]
+
+
+def order_create(customer_name: str, date: str | None = None) -> int:
+    order_date = datetime.date.today()
+    if date:
+        order_date = datetime.date.fromisoformat(date)
+    return OrderManager.new(customer_name, order_date).get_id()
+
+
+def order_list(
+    filters: dict | None = None,
+    sort_by: str | None = None,
+    descending: bool = False,
+    limit: int | None = None,
+    after: str | None = None,
+) -> dict:
+    paging = Paging(sort_by, descending, limit, after)
+    return page_dict(OrderManager.get_page(filters, paging))
+
+
+def order_products(order_id: int) -> list[dict]:
+    return [
+        info_dict(product) for product in OrderManager.from_id(order_id).get_products()
+    ]
+
+
+def order_line_operation(method: Callable) -> Callable:
+    def operation(order_id: int, code: str, count: int | None = None) -> None:
+        method(OrderManager.from_id(order_id), OrderProductInfo(code, count))
+
+    return operation
+
+
+def cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in lookup_caches.items()}
+
+
+OPERATIONS = {
+    "product.info": product_info,
+    "product.list": product_list,
+    "product.add": product_add,
+    "product.update": product_update,
+    "product.remove": ProductManager.remove,
+    "availability.info": availability_info,
+    "availability.add": availability_add,
+    "availability.reduce": availability_reduce,
+    "customer.list": customer_list,
+    "customer.create": CustomerManager.create,
+    "order.create": order_create,
+    "order.list": order_list,
+    "order.products": order_products,
+    "order.add": order_line_operation(OrderManager.add_product),
+    "order.remove": order_line_operation(OrderManager.remove_product),
+    "order.add_count": order_line_operation(OrderManager.add_count),
+    "order.reduce_count": order_line_operation(OrderManager.reduce_count),
+    "cache.stats": cache_stats,
+}
+
+
+def dispatch(line: bytes) -> dict:
+    try:
+        request = json.loads(line)
+        if request.get("op") not in OPERATIONS:
+            raise Exception(f"Unknown operation '{request.get('op')}'")
+        result = OPERATIONS[request["op"]](**(request.get("args") or {}))
+    except Exception as exception:
+        return {"ok": False, "type": type(exception).__name__, "error": str(exception)}
+    return {"ok": True, "result": result}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            response = self.server.run(line)
+            self.wfile.write(json.dumps(response, default=str).encode() + b"\n")
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str):
+        remove_stale_socket(socket_path)
+        super().__init__(socket_path, RequestHandler)
+        # The only thread that touches the database, so its connection is
+        # opened once and requests run one at a time
+        self.database_thread = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="database", initializer=db.connect
+        )
+
+    def run(self, line: bytes) -> dict:
+        return self.database_thread.submit(dispatch, line).result()
+
+    def server_close(self):
+        super().server_close()
+        self.database_thread.submit(db.close).result()
+        self.database_thread.shutdown()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def remove_stale_socket(socket_path: str) -> None:
+    """
+    Remove the socket left behind by a server that didn't shut down cleanly,
+    refusing to start when another server is still listening on it.
+    """
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.remove(socket_path)
+    else:
+        raise Exception(f"A server is already listening on {socket_path}")
+    finally:
+        probe.close()
+
+
+def serve(socket_path: str, ready: Callable[[], None] | None = None) -> None:
+    # Clients repeat the same product and customer lookups between writes
+    enable_lookup_caches()
+    with Server(socket_path) as server:
+        if ready:
+            ready()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
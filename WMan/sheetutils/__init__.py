@@ -0,0 +1,5 @@
+# Kept free of openpyxl, so commands that don't write spreadsheets can read
+# these without loading it
+
+# Rows the spreadsheet writers measure to size their columns
+DEFAULT_WIDTH_SAMPLE = 1000
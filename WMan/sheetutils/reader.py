@@ -1,15 +1,185 @@
-from openpyxl import load_workbook
+import csv
+import os
+from abc import ABC, abstractmethod
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator
 
+from WMan.profiling import in_phase, timed_iter
 
-class SheetReader:
-    def __init__(self, filepath: str):
-        self.workbook = load_workbook(filepath)
+Converters = dict[int, Callable[[Any], Any]]
+
+CSV_EXTENSIONS = {".csv": ",", ".tsv": "\t", ".tab": "\t", ".txt": None}
+XLSX_SIGNATURE = b"PK\x03\x04"
+
+
+def to_int(value: Any) -> Any:
+    """
+    Convert a cell to an int. Thousands separators and Persian digits are
+    accepted; values that still can't be converted are returned unchanged
+    so that the batch engines can report the offending row.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    text = str(value).strip().replace(",", "").replace("٬", "")
+    if not text:
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return to_int(float(text))
+        except ValueError:
+            return value
+
+
+def to_str(value: Any) -> str | None:
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip() or None
+
+
+def get_cell(row: list, index: int | None) -> Any:
+    """
+    The value in the given column of a row, or None when no column is given
+    or the row is too short to have it, like an empty cell
+    """
+    if index is None or index >= len(row):
+        return None
+    return row[index]
+
+
+class BaseReader(ABC):
+    def __init__(self, converters: Converters | None = None):
+        self.converters = converters or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @abstractmethod
+    def read_rows(self, start_row: int) -> Iterable[Iterable]:
+        """
+        The raw rows of the file from start_row on, numbered from 1
+        """
+
+    def iter_rows(self, start_row: int = 2) -> Iterator[list]:
+        """
+        Yield the rows of the file one by one with the converters applied.
+        The reported dimensions of a sheet are often inflated, so trailing
+        blank rows are dropped and the iteration stops at the real last
+        data row.
+        """
+        blank_rows = 0
+        for raw_row in timed_iter("read", self.read_rows(start_row)):
+            row = [None if value == "" else value for value in raw_row]
+            if all(value is None for value in row):
+                blank_rows += 1
+                continue
+            for _ in range(blank_rows):
+                yield [None] * len(row)
+            blank_rows = 0
+            for index, converter in self.converters.items():
+                if index < len(row):
+                    row[index] = converter(row[index])
+            yield row
+
+    def iter_chunks(
+        self, chunk_size: int = 1000, start_row: int = 2
+    ) -> Iterator[list[list]]:
+        rows = self.iter_rows(start_row)
+        while chunk := list(islice(rows, chunk_size)):
+            yield chunk
+
+    def get_data(self, start_row: int = 2):
+        return list(self.iter_rows(start_row))
+
+    def close(self) -> None:
+        pass
+
+
+class SheetReader(BaseReader):
+    def __init__(
+        self,
+        filepath: str,
+        read_only: bool = True,
+        converters: Converters | None = None,
+    ):
+        super().__init__(converters)
+        # openpyxl takes a while to import, so CSV-only runs never load it
+        from openpyxl import load_workbook
+
+        # Read-only workbooks are parsed lazily while iterating, so memory
+        # stays constant no matter how many rows the sheet has
+        self.workbook = load_workbook(filepath, read_only=read_only)
         if self.workbook.active:
             self.sheet = self.workbook.active
 
-    def get_data(self, start_row: int = 2):
-        read_data = [
-            list(row)
-            for row in self.sheet.iter_rows(values_only=True, min_row=start_row)
-        ]
-        return read_data
+    def read_rows(self, start_row: int) -> Iterable[Iterable]:
+        return self.sheet.iter_rows(values_only=True, min_row=start_row)
+
+    def close(self) -> None:
+        self.workbook.close()
+
+
+class CsvReader(BaseReader):
+    def __init__(
+        self,
+        filepath: str,
+        encoding: str | None = None,
+        delimiter: str | None = None,
+        converters: Converters | None = None,
+    ):
+        super().__init__(converters)
+        # utf-8-sig also strips the BOM Excel puts in front of its CSV exports
+        self.file = open(filepath, newline="", encoding=encoding or "utf-8-sig")
+        if delimiter is None:
+            extension = os.path.splitext(filepath)[1].lower()
+            delimiter = CSV_EXTENSIONS.get(extension) or self.sniff_delimiter()
+        self.delimiter = delimiter
+
+    def sniff_delimiter(self) -> str:
+        sample = self.file.read(64 * 1024)
+        self.file.seek(0)
+        try:
+            return csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+        except csv.Error:
+            return ","
+
+    def read_rows(self, start_row: int) -> Iterable[Iterable]:
+        rows = csv.reader(self.file, delimiter=self.delimiter)
+        return islice(rows, start_row - 1, None)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def is_csv(filepath: str) -> bool:
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension in CSV_EXTENSIONS:
+        return True
+    if extension in (".xlsx", ".xlsm"):
+        return False
+    with open(filepath, "rb") as file:
+        return file.read(len(XLSX_SIGNATURE)) != XLSX_SIGNATURE
+
+
+@in_phase("read")
+def open_reader(
+    filepath: str,
+    encoding: str | None = None,
+    delimiter: str | None = None,
+    converters: Converters | None = None,
+) -> BaseReader:
+    """
+    Open a CSV/TSV or .xlsx file depending on its extension, or on its
+    content when the extension is unknown
+    """
+    if is_csv(filepath):
+        return CsvReader(filepath, encoding, delimiter, converters)
+    return SheetReader(filepath, converters=converters)
@@ -0,0 +1,65 @@
+import csv
+import json
+import sys
+from contextlib import contextmanager
+from enum import Enum
+from typing import IO, Iterable, Iterator
+
+from WMan.profiling import in_phase, timed_iter
+
+
+class OutputFormat(str, Enum):
+    jsonl = "jsonl"
+    json = "json"
+    csv = "csv"
+
+
+@contextmanager
+def open_output(filepath: str | None) -> Iterator[IO[str]]:
+    if filepath is None:
+        yield sys.stdout
+        return
+    with open(filepath, "w", encoding="utf-8", newline="") as file:
+        yield file
+
+
+@in_phase("write")
+def write_rows(
+    rows: Iterable[tuple],
+    columns: list[str],
+    output_format: OutputFormat,
+    filepath: str | None = None,
+) -> int:
+    """
+    Write rows one at a time as JSON Lines, a JSON array or CSV to the given
+    file, or to stdout when there is none, so memory use doesn't grow with
+    the number of rows. Values JSON can't represent, like dates, are written
+    as strings. Returns the number of rows written.
+    """
+    # The rows come straight from a cursor, so fetching them is querying
+    rows = timed_iter("query", rows)
+    row_count = 0
+    with open_output(filepath) as file:
+        if output_format == OutputFormat.csv:
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row)
+                row_count += 1
+        elif output_format == OutputFormat.json:
+            file.write("[")
+            for row in rows:
+                file.write(",\n" if row_count else "\n")
+                file.write(dump_row(columns, row))
+                row_count += 1
+            file.write("\n]\n" if row_count else "]\n")
+        else:
+            for row in rows:
+                file.write(dump_row(columns, row))
+                file.write("\n")
+                row_count += 1
+    return row_count
+
+
+def dump_row(columns: list[str], row: tuple) -> str:
+    return json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str)
@@ -1,14 +1,81 @@
+import warnings
+from copy import copy
+from typing import Iterable
+
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Alignment, NamedStyle, Font
 from openpyxl.utils import get_column_letter
 from openpyxl.workbook.workbook import Workbook
-from openpyxl.worksheet.table import Table, TableStyleInfo
+from openpyxl.worksheet.filters import AutoFilter
+from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
+
+from WMan.profiling import in_phase, timed_iter
+from WMan.sheetutils import DEFAULT_WIDTH_SAMPLE
+
+CURRENCY_FORMAT = "#,##0_-[$ريال-fa-IR]"
+
+
+class ColumnWidthTracker:
+    """
+    Keeps the length of the longest value seen in each column as rows are
+    written, so column widths can be set without walking the sheet again.
+
+    When sample is given only the first sample rows are measured, and
+    max_width caps the width of every column.
+    """
+
+    def __init__(self, sample: int | None = None, max_width: int | None = None):
+        self.sample = sample
+        self.max_width = max_width
+        self.lengths: list[int] = []
+        self.row_count = 0
+
+    def grow(self, column_count: int) -> None:
+        if column_count > len(self.lengths):
+            self.lengths.extend([0] * (column_count - len(self.lengths)))
+
+    def fit(self, index: int, value) -> None:
+        if value is None:
+            return
+        self.grow(index + 1)
+        self.lengths[index] = max(self.lengths[index], len(str(value)))
+
+    def add_row(self, row: list) -> None:
+        if self.sample is not None and self.row_count >= self.sample:
+            return
+        self.row_count += 1
+
+        self.grow(len(row))
+        lengths = self.lengths
+        for index, value in enumerate(row):
+            if value is not None:
+                length = len(str(value))
+                if length > lengths[index]:
+                    lengths[index] = length
+
+    def insert_column(self, index: int, length: int = 0) -> None:
+        self.grow(index)
+        self.lengths.insert(index, length)
+
+    def widths(self) -> list[int]:
+        widths = [length + 2 for length in self.lengths]
+        if self.max_width is not None:
+            widths = [min(width, self.max_width) for width in widths]
+        return widths
+
+    def apply(self, sheet) -> None:
+        for index, width in enumerate(self.widths(), 1):
+            sheet.column_dimensions[get_column_letter(index)].width = width
 
 
 class SheetWriter:
-    def __init__(self):
+    def __init__(
+        self, width_sample: int | None = None, max_width: int | None = None
+    ):
         self.workbook = Workbook()
         if self.workbook.active:
             self.sheet = self.workbook.active
+        self.widths = ColumnWidthTracker(width_sample, max_width)
 
     def add_row_index_column(self, column_index: int = 1):
         self.sheet.insert_cols(column_index)
@@ -18,30 +85,26 @@ class SheetWriter:
             _ = self.sheet.cell(
                 row=row_num + 1, column=column_index, value=str(row_num)
             )
+        row_count = self.sheet.max_row - 1
+        self.widths.insert_column(
+            column_index - 1, max(len("Row index"), len(str(row_count)))
+        )
 
     def add_headers(self, headers: list[str], row_index: int = 1):
         self.sheet.insert_rows(row_index)
 
         for col_index, header in enumerate(headers):
             _ = self.sheet.cell(row_index, col_index + 1, value=header)
+            self.widths.fit(col_index, header)
 
-    def add_data(self, data: list[list[int | str]]) -> None:
-        for row in data:
+    @in_phase("write")
+    def add_data(self, data: Iterable[list[int | str]]) -> None:
+        for row in timed_iter("transform", data):
             self.sheet.append(row)
+            self.widths.add_row(row)
 
     def set_optimal_column_widths(self):
-        for column in self.sheet.columns:
-            max_length = 0
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except TypeError:
-                    pass
-            adjusted_width = max_length + 2
-            self.sheet.column_dimensions[
-                get_column_letter(column[0].column)
-            ].width = adjusted_width
+        self.widths.apply(self.sheet)
 
     def make_table(self, table_name: str, start_row: int = 1):
         center_aligned_text = NamedStyle(
@@ -75,7 +138,7 @@ class SheetWriter:
             min_row=2, min_col=column_index, max_col=column_index
         ):
             for cell in row:
-                cell.number_format = "#,##0_-[$ريال-fa-IR]"
+                cell.number_format = CURRENCY_FORMAT
 
     def add_header(self, header: str):
         header_style = NamedStyle(
@@ -89,6 +152,7 @@ class SheetWriter:
         )
         self.sheet.cell(1, 1, value=header)
         self.sheet.cell(1, 1).style = header_style
+        self.widths.fit(0, header)
 
     def add_subheader(self, left_header: str, right_header: str):
         header_style = NamedStyle(
@@ -101,11 +165,184 @@ class SheetWriter:
         self.sheet.cell(1, self.sheet.max_column, value=right_header)
         self.sheet.cell(1, 1).style = header_style
         self.sheet.cell(1, self.sheet.max_column).style = header_style
+        self.widths.fit(0, left_header)
+        self.widths.fit(self.sheet.max_column - 1, right_header)
 
+    @in_phase("write")
     def save(self, filename: str):
         self.workbook.save(filename)
 
 
+class StreamingSheetWriter:
+    """
+    Write-only counterpart of SheetWriter for large exports. The header,
+    subheader, row index column, table and number formats are planned up
+    front, so every row is written exactly once and never held in memory.
+    The output looks like the one SheetWriter builds for the same layout.
+
+    Column widths have to be known before the first row is written, so they
+    are measured on the first width_sample rows, which are buffered. Passing
+    None measures every row at the cost of buffering the whole export.
+    """
+
+    def __init__(
+        self,
+        headers: list[str],
+        header: str | None = None,
+        subheader: tuple[str, str] | None = None,
+        table_name: str | None = None,
+        currency_columns: Iterable[int] = (),
+        row_index: bool = True,
+        fit_titles: bool = True,
+        width_sample: int | None = DEFAULT_WIDTH_SAMPLE,
+        max_width: int | None = None,
+    ):
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.headers = (["Row index"] if row_index else []) + list(headers)
+        self.header = header
+        self.subheader = subheader
+        self.table_name = table_name
+        self.currency_columns = set(currency_columns)
+        self.row_index = row_index
+        self.fit_titles = fit_titles
+        self.width_sample = width_sample
+        self.widths = ColumnWidthTracker(max_width=max_width)
+
+        self.header_style = NamedStyle(
+            "header_style",
+            alignment=Alignment(horizontal="center", vertical="center"),
+            font=Font(bold=True, size=20),
+        )
+        self.subheader_style = NamedStyle(
+            "sub_header_style",
+            alignment=Alignment(horizontal="center", vertical="center"),
+            font=Font(bold=True, size=10),
+        )
+        self.table_style = NamedStyle(
+            name="center_aligned_text",
+            alignment=Alignment(horizontal="center", vertical="center"),
+        )
+        for style in (self.table_style, self.subheader_style, self.header_style):
+            self.workbook.add_named_style(style)
+
+        # Resolving a named style is slow, so resolve each one once and copy
+        # the resulting style array onto every cell
+        self.styles = {}
+        for style in ("center_aligned_text", "sub_header_style", "header_style"):
+            cell = WriteOnlyCell(self.sheet)
+            cell.style = style
+            self.styles[style, False] = copy(cell._style)
+            cell.number_format = CURRENCY_FORMAT
+            self.styles[style, True] = cell._style
+
+        self.buffer: list[list] = []
+        self.started = False
+        self.row_count = 0
+        self.table_start_row = 1 + (header is not None) + (subheader is not None)
+
+    def make_cell(
+        self, value, style: str, column: int | None = None
+    ) -> WriteOnlyCell:
+        cell = WriteOnlyCell(self.sheet, value)
+        cell._style = copy(self.styles[style, column in self.currency_columns])
+        return cell
+
+    def add_row(self, row: list) -> None:
+        self.row_count += 1
+        if self.row_index:
+            row = [str(self.row_count)] + list(row)
+
+        if self.started:
+            self.write_row(row)
+        else:
+            row = list(row)
+            self.buffer.append(row)
+            self.widths.add_row(row)
+            sample = self.width_sample
+            if sample is not None and len(self.buffer) >= sample:
+                self.start()
+
+    @in_phase("write")
+    def add_data(self, data: Iterable[list]) -> None:
+        # Building the rows is charged to the caller, not to writing them
+        for row in timed_iter("transform", data):
+            self.add_row(row)
+
+    def write_row(self, row: list) -> None:
+        self.sheet.append(
+            [
+                self.make_cell(value, "center_aligned_text", column)
+                for column, value in enumerate(row, 1)
+            ]
+        )
+
+    def set_column_widths(self) -> None:
+        for index, header in enumerate(self.headers):
+            self.widths.fit(index, header)
+
+        if self.fit_titles:
+            if self.header is not None:
+                self.widths.fit(0, self.header)
+            if self.subheader is not None:
+                self.widths.fit(0, self.subheader[0])
+                self.widths.fit(len(self.headers) - 1, self.subheader[1])
+
+        self.widths.apply(self.sheet)
+
+    def start(self) -> None:
+        self.set_column_widths()
+        column_count = len(self.headers)
+
+        if self.header is not None:
+            self.sheet.append([self.make_cell(self.header, "header_style")])
+            self.sheet.merged_cells.add(f"A1:{get_column_letter(column_count)}1")
+        if self.subheader is not None:
+            left_header, right_header = self.subheader
+            self.sheet.append(
+                [self.make_cell(left_header, "sub_header_style")]
+                + [None] * (column_count - 2)
+                + [self.make_cell(right_header, "sub_header_style")]
+            )
+
+        self.write_row(self.headers)
+        for row in self.buffer:
+            self.write_row(row)
+        self.buffer = []
+        self.started = True
+
+    def add_table(self) -> None:
+        last_column = get_column_letter(len(self.headers))
+        last_row = self.table_start_row + self.row_count
+        table_range = f"A{self.table_start_row}:{last_column}{last_row}"
+
+        table = Table(displayName=self.table_name, ref=table_range)
+        table.tableStyleInfo = TableStyleInfo(
+            name="TableStyleMedium9",
+            showFirstColumn=False,
+            showLastColumn=False,
+            showRowStripes=False,
+            showColumnStripes=True,
+        )
+        # A write-only sheet can't be read back to name the table columns
+        table.tableColumns = [
+            TableColumn(id=index, name=str(header))
+            for index, header in enumerate(self.headers, 1)
+        ]
+        table.autoFilter = AutoFilter(ref=table_range)
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", "In write-only mode")
+            self.sheet.add_table(table)
+
+    @in_phase("write")
+    def save(self, filename: str) -> None:
+        if not self.started:
+            self.start()
+        if self.table_name:
+            self.add_table()
+        self.workbook.save(filename)
+
+
 if __name__ == "__main__":
     # Generate a large dataset
     num_rows = 1000
@@ -0,0 +1,212 @@
+"""
+Seeded generator of synthetic warehouses for the benchmarks. The same seed
+and sizes always produce the same database and batch files.
+
+    python -m benchmarks.generator warehouse.db --products 10000 --orders 5000
+"""
+import argparse
+import csv
+import datetime
+import os
+import random
+
+from WMan.database import (
+    Customer,
+    Order,
+    OrderProduct,
+    Product,
+    StockMovement,
+    chunked,
+    create_tables,
+    db,
+    rebuild_sales_rollups,
+)
+
+# SQLite takes at most 999 variables per statement, and the widest table
+# has 6 columns
+INSERT_BATCH = 150
+
+BRANDS = 200
+CARTON_SIZES = [1, 6, 12, 24, 48]
+FIRST_ORDER_DATE = datetime.date(2022, 1, 1)
+ORDER_DAYS = 3 * 365
+
+
+class WarehouseSize:
+    def __init__(
+        self,
+        products: int = 10_000,
+        customers: int = 500,
+        orders: int = 5_000,
+        mean_lines: int = 8,
+        batch_rows: int = 1_000,
+    ):
+        self.products = products
+        self.customers = customers
+        self.orders = orders
+        # Order line counts follow a geometric distribution around this mean,
+        # so most orders are small and a few are very large
+        self.mean_lines = mean_lines
+        self.batch_rows = batch_rows
+
+    def as_dict(self) -> dict[str, int]:
+        return dict(vars(self))
+
+
+def product_code(index: int) -> str:
+    return f"P{index:07d}"
+
+
+def product_rows(size: WarehouseSize, rng: random.Random):
+    for index in range(size.products):
+        yield (
+            product_code(index),
+            f"Product description {index}",
+            f"Brand{rng.randrange(BRANDS):03d}",
+            rng.choice(CARTON_SIZES),
+            rng.randrange(1_000, 10_000_000, 1_000),
+            rng.randrange(10_000, 100_000),
+        )
+
+
+def line_count(size: WarehouseSize, rng: random.Random) -> int:
+    count = 1
+    while count < size.products and rng.random() > 1 / size.mean_lines:
+        count += 1
+    return count
+
+
+def order_line_rows(size: WarehouseSize, rng: random.Random):
+    for order_id in range(1, size.orders + 1):
+        for index in rng.sample(range(size.products), line_count(size, rng)):
+            yield (order_id, product_code(index), rng.randrange(1, 50))
+
+
+def fill_warehouse(size: WarehouseSize, seed: int = 0) -> None:
+    """
+    Fill the tables of the open database with a synthetic warehouse. Order
+    totals and sales rollups are computed from the lines and the stock
+    enters the ledger as opening balances, as the managers would keep them.
+    """
+    rng = random.Random(seed)
+    with db.atomic():
+        for batch in chunked(product_rows(size, rng), INSERT_BATCH):
+            Product.insert_many(batch, fields=Product.info_fields()).execute()
+        customers = ((f"Customer {index}",) for index in range(size.customers))
+        for batch in chunked(customers, INSERT_BATCH):
+            Customer.insert_many(batch, fields=[Customer.name]).execute()
+        orders = (
+            (
+                FIRST_ORDER_DATE
+                + datetime.timedelta(days=rng.randrange(ORDER_DAYS)),
+                rng.randrange(1, size.customers + 1),
+            )
+            for _ in range(size.orders)
+        )
+        for batch in chunked(orders, INSERT_BATCH):
+            Order.insert_many(batch, fields=[Order.date, Order.customer]).execute()
+        for batch in chunked(order_line_rows(size, rng), INSERT_BATCH):
+            OrderProduct.insert_many(
+                batch,
+                fields=[OrderProduct.order, OrderProduct.product, OrderProduct.count],
+            ).execute()
+        Order.refresh_totals()
+        rebuild_sales_rollups()
+        StockMovement.record_opening_balances()
+
+
+def create_warehouse(path: str, size: WarehouseSize, seed: int = 0) -> None:
+    db.init(path)
+    with db.connection_context():
+        create_tables()
+        fill_warehouse(size, seed)
+
+
+def batch_files(size: WarehouseSize, seed: int = 0) -> dict[str, list[list]]:
+    """
+    The rows of the batch files, laid out in the columns the CLI reads by
+    default: a row number first, then the code and the other cells.
+    """
+    rng = random.Random(seed + 1)
+    codes = [
+        product_code(index)
+        for index in rng.sample(
+            range(size.products), min(size.batch_rows, size.products)
+        )
+    ]
+    catalogue = [
+        [
+            row_number,
+            code,
+            rng.choice(CARTON_SIZES),
+            f"Updated description {code}",
+            rng.randrange(1_000, 10_000_000, 1_000),
+            None,
+            None,
+            f"Brand{rng.randrange(BRANDS):03d}",
+        ]
+        for row_number, code in enumerate(codes, 1)
+    ]
+    counts = [
+        [row_number, code, rng.randrange(1, 10)]
+        for row_number, code in enumerate(codes, 1)
+    ]
+    return {
+        "catalogue": [
+            ["Row", "Code", "Carton", "Description", "Price", "", "", "Brand"]
+        ]
+        + catalogue,
+        "counts": [["Row", "Code", "Count"]] + counts,
+    }
+
+
+def write_batch_files(directory: str, size: WarehouseSize, seed: int = 0) -> dict:
+    """
+    Write every batch file as .csv and .xlsx into directory, returning
+    their paths keyed by (name, extension).
+    """
+    from openpyxl import Workbook
+
+    paths = {}
+    for name, rows in batch_files(size, seed).items():
+        csv_path = os.path.join(directory, f"{name}.csv")
+        with open(csv_path, "w", newline="", encoding="utf-8") as file:
+            csv.writer(file).writerows(rows)
+        paths[name, "csv"] = csv_path
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        for row in rows:
+            sheet.append(row)
+        xlsx_path = os.path.join(directory, f"{name}.xlsx")
+        workbook.save(xlsx_path)
+        paths[name, "xlsx"] = xlsx_path
+    return paths
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path")
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=5_000)
+    parser.add_argument("--mean-lines", type=int, default=8)
+    parser.add_argument("--batch-rows", type=int, default=1_000)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    size = WarehouseSize(
+        arguments.products,
+        arguments.customers,
+        arguments.orders,
+        arguments.mean_lines,
+        arguments.batch_rows,
+    )
+    create_warehouse(arguments.path, size, arguments.seed)
+    write_batch_files(
+        os.path.dirname(os.path.abspath(arguments.path)), size, arguments.seed
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare reading products through peewee model instances, as the read paths
+used to, with the tuple projections they use now.
+
+    python -m benchmarks.read_paths --rows 500000
+
+Runs against a throwaway database in a temporary directory.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from WMan.database import Product, ProductInfo, chunked, create_tables, db
+
+
+def fill_products(row_count: int) -> None:
+    rng = random.Random(0)
+    rows = (
+        (
+            f"P{index:07d}",
+            f"Product description {index}",
+            f"Brand{rng.randrange(200)}",
+            rng.choice([1, 6, 12, 24]),
+            rng.randrange(1_000, 10_000_000),
+            rng.randrange(1_000),
+        )
+        for index in range(row_count)
+    )
+    with db.atomic():
+        for batch in chunked(rows, 150):
+            Product.insert_many(batch, fields=Product.info_fields()).execute()
+
+
+def from_model_instances() -> list[ProductInfo]:
+    return [
+        ProductInfo(
+            code=product.id,
+            description=product.description,
+            brand=product.brand,
+            count_in_carton=product.count_in_carton,
+            price=product.price,
+            count=product.count,
+        )
+        for product in Product.select()
+    ]
+
+
+def from_tuples() -> list[ProductInfo]:
+    return Product.get_filtered({})
+
+
+def measure(function) -> tuple[float, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return seconds, peak / 2**20
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=500_000)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db.init(os.path.join(directory, "benchmark.db"))
+        db.connect()
+        create_tables()
+        fill_products(arguments.rows)
+
+        for name, function in [
+            ("model instances", from_model_instances),
+            ("tuples", from_tuples),
+        ]:
+            seconds, peak = measure(function)
+            print(
+                f"{name:>16}: {seconds:6.2f} s, "
+                f"{arguments.rows / seconds:9.0f} rows/s, peak {peak:7.1f} MiB"
+            )
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Measure how long the CLI takes to import for a command, from the cumulative
+times reported by `python -X importtime`.
+
+    python -m benchmarks.startup availability add --max-ms 300
+
+Prints the slowest imports and exits with an error when the total is over
+--max-ms, so it can guard against startup regressions in CI.
+"""
+import argparse
+import subprocess
+import sys
+
+# Modules only the output paths need, which quick commands must not import
+HEAVY_MODULES = ["openpyxl", "babel.numbers", "rich.table", "jdatetime"]
+
+
+def import_times(command: list[str]) -> dict[str, int]:
+    """
+    Import the CLI as `python -m WMan <command>` would, without running it,
+    and return the cumulative import time of every module in microseconds.
+    """
+    code = (
+        "import sys; "
+        f"sys.argv = ['wman', *{command!r}]; "
+        "import WMan.__main__"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("command", nargs="*", default=["availability", "add"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=None)
+    arguments = parser.parse_args()
+
+    # The fastest run is the least disturbed by the rest of the machine
+    runs = [import_times(arguments.command) for _ in range(arguments.runs)]
+    times = min(runs, key=lambda times: times["WMan.__main__"])
+    total = times["WMan.__main__"] / 1000
+
+    for module, cumulative in sorted(times.items(), key=lambda item: -item[1])[
+        : arguments.top
+    ]:
+        print(f"{cumulative / 1000:8.1f} ms  {module}")
+    loaded = [module for module in HEAVY_MODULES if module in times]
+    print(f"WMan {' '.join(arguments.command)}: {total:.1f} ms")
+    if loaded:
+        print(f"Imported output-only modules: {', '.join(loaded)}")
+
+    if arguments.max_ms is not None and (total > arguments.max_ms or loaded):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
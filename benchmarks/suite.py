@@ -0,0 +1,348 @@
+"""
+Time the read paths, batch commands and sheet exports of WMan against a
+seeded synthetic warehouse, and write the results to JSON.
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --compare results.json --tolerance 0.2
+
+Every case runs --repeat times and the fastest run is what gets compared.
+Cases that write run on a fresh copy of the generated database each time.
+With --compare, the cases that got slower than the baseline by more than
+the tolerance are reported and the exit status is 1.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+from peewee import fn
+
+from benchmarks.generator import WarehouseSize, create_warehouse, write_batch_files
+from WMan.database import Order, OrderProduct, Product, config, db
+from WMan.OrderManager import OrderIO, OrderManager, OrderProductIndexes
+from WMan.ProductManager import ColumnIndexes, ProductManager
+from WMan.ReportManager import ReportManager, SalesGroup
+from WMan.sheetutils.reader import CsvReader, SheetReader
+
+# The columns benchmarks.generator lays the batch files out in, which are
+# the defaults of the CLI
+CATALOGUE_INDEXES = ColumnIndexes(
+    code_column=1,
+    count_in_carton_column=2,
+    description_column=3,
+    price_column=4,
+    brand_column=7,
+)
+COUNT_INDEXES = ColumnIndexes(code_column=1, count_column=2)
+ORDER_INDEXES = OrderProductIndexes(1, 2)
+
+
+class Case:
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[], object],
+        setup: Callable[[], None] | None = None,
+        writes: bool = False,
+    ):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.writes = writes
+
+
+class Suite:
+    def __init__(self, directory: str, size: WarehouseSize, seed: int):
+        self.directory = directory
+        self.template = os.path.join(directory, "template.db")
+        self.work = os.path.join(directory, "work.db")
+        create_warehouse(self.template, size, seed)
+        self.files = write_batch_files(directory, size, seed)
+        self.output = os.path.join(directory, "output.xlsx")
+
+    def use_database(self, path: str) -> None:
+        if not db.is_closed():
+            db.close()
+        db.init(path)
+        db.connect()
+
+    def fresh_copy(self) -> None:
+        db.close()
+        shutil.copyfile(self.template, self.work)
+        self.use_database(self.work)
+
+    def new_order(self) -> OrderManager:
+        return OrderManager.new("Customer 0", datetime.date.today())
+
+    def largest_order(self) -> OrderManager:
+        (order_id,) = (
+            OrderProduct.select(OrderProduct.order)
+            .group_by(OrderProduct.order)
+            .order_by(fn.COUNT(OrderProduct.product).desc())
+            .limit(1)
+            .tuples()
+            .get()
+        )
+        return OrderManager.from_id(order_id)
+
+    def read_cases(self) -> list[Case]:
+        catalogue = self.files["catalogue", "xlsx"]
+        catalogue_csv = self.files["catalogue", "csv"]
+        year_2023 = {
+            "start_date": datetime.date(2023, 1, 1),
+            "end_date": datetime.date(2023, 12, 31),
+        }
+        return [
+            Case("Product.get_filtered", lambda: Product.get_filtered({})),
+            Case(
+                "Product.get_filtered brand",
+                lambda: Product.get_filtered({"brand": "Brand007"}),
+            ),
+            Case(
+                "Product.search",
+                lambda: Product.search("product description 1", limit=20),
+            ),
+            Case("Order.get_filtered", lambda: Order.get_filtered({})),
+            Case(
+                "Order.get_filtered dates",
+                lambda: Order.get_filtered(
+                    {
+                        "start_date": datetime.date(2023, 1, 1),
+                        "end_date": datetime.date(2023, 3, 31),
+                    }
+                ),
+            ),
+            Case("SheetReader.get_data", lambda: read_all(SheetReader(catalogue))),
+            Case("CsvReader.get_data", lambda: read_all(CsvReader(catalogue_csv))),
+            Case(
+                "ProductManager.save_products",
+                lambda: ProductManager.save_products(
+                    self.output, Product.get_filtered({})
+                ),
+            ),
+            Case(
+                "ProductManager.save_availability",
+                lambda: ProductManager.save_availability(
+                    self.output, Product.get_filtered({})
+                ),
+            ),
+            Case(
+                "OrderIO.save_products",
+                lambda: OrderIO(self.largest_order().get_products()).save_products(
+                    self.output
+                ),
+            ),
+            Case("SheetWriter", self.write_with_sheet_writer),
+        ] + [
+            Case(
+                f"ReportManager.get_sales_rows {group_by.value}",
+                lambda group_by=group_by: list(
+                    ReportManager.get_sales_rows(group_by, year_2023)
+                ),
+            )
+            for group_by in SalesGroup
+        ]
+
+    def write_with_sheet_writer(self) -> None:
+        from WMan.sheetutils.writer import SheetWriter
+
+        writer = SheetWriter()
+        writer.add_data(
+            [product.code, product.description, product.brand, product.price]
+            for product in Product.get_filtered({})
+        )
+        writer.add_headers(["Code", "Description", "Brand", "Price"])
+        writer.add_row_index_column()
+        writer.make_table("Products")
+        writer.set_optimal_column_widths()
+        writer.save(self.output)
+
+    def write_cases(self) -> list[Case]:
+        cases = []
+        for extension in ("xlsx", "csv"):
+            catalogue = self.files["catalogue", extension]
+            counts = self.files["counts", extension]
+            cases += [
+                Case(
+                    f"product add-batch {extension}",
+                    lambda path=catalogue: ProductManager.add_batch(
+                        path, CATALOGUE_INDEXES
+                    ),
+                    self.fresh_copy,
+                    writes=True,
+                ),
+                Case(
+                    f"product update-batch {extension}",
+                    lambda path=catalogue: ProductManager.update_batch(
+                        path, CATALOGUE_INDEXES
+                    ),
+                    self.fresh_copy,
+                    writes=True,
+                ),
+                Case(
+                    f"availability add-batch {extension}",
+                    lambda path=counts: ProductManager.add_count_batch(
+                        path, COUNT_INDEXES
+                    ),
+                    self.fresh_copy,
+                    writes=True,
+                ),
+                Case(
+                    f"availability reduce-batch {extension}",
+                    lambda path=counts: ProductManager.reduce_count_batch(
+                        path, COUNT_INDEXES
+                    ),
+                    self.fresh_copy,
+                    writes=True,
+                ),
+            ]
+            for operation in ("add", "add_count", "reduce_count", "remove"):
+                cases.append(self.order_batch_case(operation, counts, extension))
+        return cases
+
+    def order_batch_case(self, operation: str, path: str, extension: str) -> Case:
+        state = {}
+
+        def setup():
+            self.fresh_copy()
+            state["order"] = order = self.new_order()
+            if operation != "add":
+                order.apply_batch(path, ORDER_INDEXES, "add")
+
+        def run():
+            state["order"].apply_batch(path, ORDER_INDEXES, operation)
+
+        name = f"order {operation.replace('_', '-')}-batch {extension}"
+        return Case(name, run, setup, writes=True)
+
+    def cases(self) -> list[Case]:
+        return self.read_cases() + self.write_cases()
+
+    def measure(self, case: Case, repeat: int) -> list[float]:
+        if not case.writes:
+            self.use_database(self.template)
+        runs = []
+        for _ in range(repeat):
+            if case.setup:
+                case.setup()
+            start = time.perf_counter()
+            case.run()
+            runs.append(time.perf_counter() - start)
+        return runs
+
+
+def read_all(reader) -> list:
+    with reader:
+        return reader.get_data()
+
+
+def git_commit() -> str | None:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Print how every case compares with the baseline and return the names of
+    those that got slower by more than the tolerance.
+    """
+    regressions = []
+    for name, result in results["cases"].items():
+        if name not in baseline["cases"]:
+            continue
+        before = baseline["cases"][name]["min"]
+        ratio = result["min"] / before if before else 1.0
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            f"{name:>40}: {before:8.4f} s -> {result['min']:8.4f} s "
+            f"({ratio:5.2f}x){flag}"
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=5_000)
+    parser.add_argument("--mean-lines", type=int, default=8)
+    parser.add_argument("--batch-rows", type=int, default=1_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", help="Only run the cases containing this text")
+    parser.add_argument("--output", help="Path to write the JSON results to")
+    parser.add_argument("--compare", help="JSON results of a baseline run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    arguments = parser.parse_args()
+
+    size = WarehouseSize(
+        arguments.products,
+        arguments.customers,
+        arguments.orders,
+        arguments.mean_lines,
+        arguments.batch_rows,
+    )
+    results = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "profile": config.profile,
+        "seed": arguments.seed,
+        "size": size.as_dict(),
+        "repeat": arguments.repeat,
+        "cases": {},
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        suite = Suite(directory, size, arguments.seed)
+        for case in suite.cases():
+            if arguments.only and arguments.only not in case.name:
+                continue
+            runs = suite.measure(case, arguments.repeat)
+            results["cases"][case.name] = {
+                "min": min(runs),
+                "median": statistics.median(runs),
+                "runs": runs,
+            }
+            print(f"{case.name:>40}: {min(runs):8.4f} s", flush=True)
+        db.close()
+
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            baseline = json.load(file)
+        print(f"\nCompared with {arguments.compare} ({baseline.get('commit')}):")
+        if baseline.get("size") != results["size"]:
+            print("The baseline was run on a warehouse of a different size")
+        if compare(results, baseline, arguments.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import unittest
+from contextlib import contextmanager
+from typing import Iterator
+
+from WMan.database import create_tables, db
+
+
+@contextmanager
+def count_statements() -> Iterator[list[str]]:
+    """
+    Collect the SQL of every statement executed in the enclosed block,
+    transaction control included.
+    """
+    statements = []
+
+    def record(event):
+        statements.append(event.sql)
+
+    db.query_hooks.append(record)
+    try:
+        yield statements
+    finally:
+        db.query_hooks.remove(record)
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Runs each test against a fresh in-memory database instead of warehouse.db
+    """
+
+    def setUp(self):
+        db.init(":memory:")
+        db.connect()
+        create_tables()
+
+    def tearDown(self):
+        db.close()
+
+    @contextmanager
+    def assertMaxStatements(self, budget: int) -> Iterator[list[str]]:
+        """
+        Fail when the enclosed block executes more than budget statements,
+        listing the ones it did.
+        """
+        with count_statements() as statements:
+            yield statements
+        if len(statements) > budget:
+            self.fail(
+                f"{len(statements)} SQL statements, over the budget of {budget}:\n"
+                + "\n".join(statements)
+            )
@@ -0,0 +1,112 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from WMan.config import (
+    CLIENT_ENV,
+    DATABASE_ENV,
+    PROFILE_ENV,
+    Config,
+    load_config,
+)
+from WMan.database import Product, ProductInfo, create_tables, db, read_snapshot
+
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.config_path = os.path.join(self.directory.name, "config.ini")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_config(self, content: str):
+        with open(self.config_path, "w") as file:
+            file.write(content)
+
+    @patch.dict(os.environ, {}, clear=True)
+    def test_defaults(self):
+        config = load_config(self.config_path)
+
+        self.assertEqual(config.database_path, "warehouse.db")
+        self.assertEqual(config.profile, "default")
+        self.assertEqual(config.pragmas, {})
+
+    @patch.dict(os.environ, {}, clear=True)
+    def test_config_file(self):
+        self.write_config(
+            "[database]\npath = data/wman.db\nprofile = fast\n"
+            "[pragmas]\ncache_size = -1000\n"
+        )
+
+        config = load_config(self.config_path)
+
+        self.assertEqual(
+            config.database_path, os.path.join(self.directory.name, "data/wman.db")
+        )
+        self.assertEqual(config.pragmas["journal_mode"], "wal")
+        self.assertEqual(config.pragmas["cache_size"], "-1000")
+
+    def test_environment_overrides_file(self):
+        self.write_config("[database]\npath = file.db\nprofile = fast\n")
+
+        with patch.dict(
+            os.environ, {DATABASE_ENV: "/tmp/env.db", PROFILE_ENV: "default"}
+        ):
+            config = load_config(self.config_path)
+
+        self.assertEqual(config.database_path, "/tmp/env.db")
+        self.assertEqual(config.pragmas, {})
+
+    @patch.dict(os.environ, {}, clear=True)
+    def test_server_section(self):
+        self.assertEqual(
+            load_config(self.config_path).socket_path, "warehouse.db.sock"
+        )
+        self.write_config("[server]\nsocket = wman.sock\nclient = yes\n")
+
+        config = load_config(self.config_path)
+
+        self.assertEqual(
+            config.socket_path, os.path.join(self.directory.name, "wman.sock")
+        )
+        self.assertTrue(config.client)
+        with patch.dict(os.environ, {CLIENT_ENV: "no"}):
+            self.assertFalse(load_config(self.config_path).client)
+
+    def test_unknown_profile(self):
+        with self.assertRaises(Exception):
+            Config(profile="turbo")
+
+
+class TestReadSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database_path = os.path.join(self.directory.name, "warehouse.db")
+        db.init(self.database_path, pragmas=Config(profile="fast").pragmas)
+        db.connect()
+        create_tables()
+        Product.add(ProductInfo("P001"))
+
+    def tearDown(self):
+        db.close()
+        db.init(":memory:", pragmas={})
+        self.directory.cleanup()
+
+    def test_writer_is_not_blocked(self):
+        with read_snapshot():
+            self.assertEqual(Product.get_count("P001"), 0)
+
+            writer = sqlite3.connect(self.database_path, timeout=0)
+            writer.execute("UPDATE product SET count = 5 WHERE id = 'P001'")
+            writer.commit()
+            writer.close()
+
+            self.assertEqual(Product.get_count("P001"), 0)
+        self.assertEqual(Product.get_count("P001"), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,708 @@
+import datetime
+import multiprocessing
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from WMan.database import (
+    BatchException,
+    Customer,
+    NotFoundException,
+    Order,
+    OrderProduct,
+    Paging,
+    Product,
+    ProductInfo,
+    StockMovement,
+    StockSnapshot,
+    add_order_total_columns,
+    create_tables,
+    db,
+    LookupCache,
+    enable_lookup_caches,
+    get_or_raise,
+    lookup_caches,
+    rebuild_search_index,
+)
+from test.dbutils import DatabaseTestCase
+
+
+class TestAdjustCountBatch(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        for code, count in [("P001", 10), ("P002", 5), ("P003", 0)]:
+            Product.add(ProductInfo(code=code))
+            Product.add_count(code, count)
+
+    def get_counts(self):
+        return dict(Product.select(Product.id, Product.count).tuples())
+
+    def test_add_sums_duplicates(self):
+        adjusted = Product.adjust_count_batch(
+            [(2, "P001", 1), (3, "P002", 2), (4, "P001", 3)]
+        )
+
+        self.assertEqual(adjusted, 2)
+        self.assertEqual(self.get_counts(), {"P001": 14, "P002": 7, "P003": 0})
+
+    def test_reduce(self):
+        Product.adjust_count_batch([(2, "P001", 4), (3, "P002", 5)], reduce=True)
+
+        self.assertEqual(self.get_counts(), {"P001": 6, "P002": 0, "P003": 0})
+
+    def test_reduce_is_all_or_nothing(self):
+        rows = [
+            (2, "P001", 1),
+            (3, "P002", 3),
+            (4, "MISSING", 1),
+            (5, "P002", 3),
+            (6, "P003", "x"),
+        ]
+
+        with self.assertRaises(BatchException) as context:
+            Product.adjust_count_batch(rows, reduce=True)
+
+        self.assertEqual(self.get_counts(), {"P001": 10, "P002": 5, "P003": 0})
+        errors = context.exception.errors
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(errors[0].startswith("Row 3: There is not enough"))
+        self.assertEqual(errors[1], "Row 4: Product with id MISSING was not found")
+        self.assertTrue(errors[2].startswith("Row 5: There is not enough"))
+        self.assertEqual(errors[3], "Row 6: Invalid count 'x' for product P003")
+
+    def test_many_codes_are_chunked(self):
+        for index in range(2000):
+            Product.add(ProductInfo(code=f"BULK{index}"))
+
+        Product.adjust_count_batch(
+            [(index + 2, f"BULK{index}", index + 1) for index in range(2000)]
+        )
+
+        counts = self.get_counts()
+        self.assertEqual(counts["BULK0"], 1)
+        self.assertEqual(counts["BULK1999"], 2000)
+
+
+class TestUpsertBatch(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        Product.add(ProductInfo("P001", "Product 1", "BrandA", 10, 1000))
+        Product.add(ProductInfo("P002", "Product 2", "BrandB", 20, 2000))
+        Product.add_count("P001", 7)
+
+    def test_insert_update_unchanged(self):
+        result = Product.upsert_batch(
+            [
+                ProductInfo("P001", None, "", None, 1500),
+                ProductInfo("P002", "Product 2", "BrandB"),
+                ProductInfo("P003", "Product 3", "BrandC", 30, 3000),
+                ProductInfo(None, "Blank row"),
+            ]
+        )
+
+        self.assertEqual(
+            (result.inserted, result.updated, result.unchanged), (1, 1, 1)
+        )
+        self.assertEqual(
+            Product.get_product_info("P001"),
+            ProductInfo("P001", "Product 1", "BrandA", 10, 1500, 7),
+        )
+        self.assertEqual(
+            Product.get_product_info("P003"),
+            ProductInfo("P003", "Product 3", "BrandC", 30, 3000, 0),
+        )
+
+    def test_duplicates_are_merged(self):
+        result = Product.upsert_batch(
+            [
+                ProductInfo("P004", "First", "BrandD", 5, 100),
+                ProductInfo("P004", None, "BrandE"),
+            ]
+        )
+
+        self.assertEqual(result.inserted, 1)
+        self.assertEqual(get_or_raise(Product, "P004").brand, "BrandE")
+        self.assertEqual(get_or_raise(Product, "P004").description, "First")
+
+    def test_update_only_reports_missing(self):
+        result = Product.upsert_batch(
+            [ProductInfo("P002", brand="BrandZ"), ProductInfo("P404", brand="X")],
+            insert_missing=False,
+        )
+
+        self.assertEqual((result.inserted, result.updated), (0, 1))
+        self.assertEqual(result.missing, ["P404"])
+        self.assertEqual(Product.select().count(), 2)
+
+    def test_large_catalogue(self):
+        result = Product.upsert_batch(
+            ProductInfo(f"BULK{index}", f"Item {index}", price=index)
+            for index in range(3000)
+        )
+
+        self.assertEqual(result.inserted, 3000)
+        self.assertEqual(get_or_raise(Product, "BULK2999").price, 2999)
+
+
+class OrderTestCase(DatabaseTestCase):
+    """
+    Ali's two-line order, Sara's one-line order and an empty order of Sara's.
+    """
+
+    def setUp(self):
+        super().setUp()
+        Customer.add("Ali")
+        Customer.add("Sara")
+        for code, price in [("A", 100), ("B", 250)]:
+            Product.add(ProductInfo(code, price=price))
+            Product.add_count(code, 100)
+
+        self.first = Order.new("Ali", datetime.date(2024, 1, 1))
+        self.second = Order.new("Sara", datetime.date(2024, 2, 1))
+        self.empty = Order.new("Sara", datetime.date(2024, 3, 1))
+        Order.add_product(self.first.id, "A", 2)
+        Order.add_product(self.first.id, "B", 1)
+        Order.add_product(self.second.id, "B", 4)
+
+
+class TestOrderListing(OrderTestCase):
+    def summarize(self, filters):
+        return [
+            (order.id, order.total_count, order.total_price, order.customer_name)
+            for order in Order.get_filtered(filters)
+        ]
+
+    def test_totals(self):
+        self.assertEqual(
+            self.summarize({}),
+            [
+                (self.first.id, 3, 450, "Ali"),
+                (self.second.id, 4, 1000, "Sara"),
+                (self.empty.id, 0, 0, "Sara"),
+            ],
+        )
+        self.assertEqual(Order.get_order_total_count(self.first.id), 3)
+        self.assertEqual(Order.get_order_total_price(self.first.id), 450)
+
+    def test_filters(self):
+        self.assertEqual(
+            self.summarize({"min_price": 500}), [(self.second.id, 4, 1000, "Sara")]
+        )
+        self.assertEqual(
+            self.summarize({"max_price": 500, "customer": "Sara"}),
+            [(self.empty.id, 0, 0, "Sara")],
+        )
+        self.assertEqual(
+            [info.id for info in Order.get_filtered({"end_date": "2024-02-01"})],
+            [self.first.id, self.second.id],
+        )
+
+    def test_rows(self):
+        self.assertEqual(
+            list(Order.get_filtered_rows({"customer": "Ali"})),
+            [(self.first.id, 3, 450, "Ali", datetime.date(2024, 1, 1))],
+        )
+        self.assertEqual(
+            list(
+                Order.get_order_product_rows(
+                    self.first.id,
+                    Product.id,
+                    OrderProduct.count,
+                    Product.price * OrderProduct.count,
+                )
+            ),
+            [("A", 2, 200), ("B", 1, 250)],
+        )
+        self.assertEqual(
+            list(Product.get_filtered_rows({"min_price": 200}, Product.id)), [("B",)]
+        )
+        self.assertRaises(NotFoundException, Order.get_order_product_rows, 404)
+
+    def test_infos(self):
+        infos = Order.get_order_product_infos(self.first.id)
+        self.assertEqual([(info.code, info.count) for info in infos], [("A", 2), ("B", 1)])
+        self.assertEqual(
+            [info.code for info in Product.get_product_infos(["B", "A", "B"])],
+            ["B", "A", "B"],
+        )
+        self.assertEqual(
+            Product.get_product_info("A"), ProductInfo("A", price=100, count=98)
+        )
+        with self.assertRaises(NotFoundException):
+            Product.get_product_infos(["A", "C"])
+        with self.assertRaises(NotFoundException):
+            Product.get_product_info("C")
+        with self.assertRaises(NotFoundException):
+            Order.get_order_products(404)
+
+    def test_pages(self):
+        page = Order.get_page({}, Paging("total_price", True, 2))
+        self.assertEqual([row[0] for row in page], [self.second.id, self.first.id])
+        page = Order.get_page({}, Paging("total_price", True, 2, page.cursor))
+        self.assertEqual([row[0] for row in page], [self.empty.id])
+        self.assertIsNone(page.cursor)
+
+
+class TestKeysetPagination(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        # Duplicated and missing prices, so pages have to break ties and
+        # step over NULLs
+        for index in range(10):
+            price = None if index % 3 == 0 else 100 * (index % 4)
+            Product.add(ProductInfo(f"P{index}", price=price))
+
+    def collect(self, filters, sort_by, descending, limit):
+        pages = []
+        after = None
+        while True:
+            page = Product.get_page(
+                filters,
+                Paging(sort_by, descending, limit, after),
+                [Product.id],
+            )
+            pages.append([code for (code,) in page])
+            after = page.cursor
+            if after is None:
+                return pages
+
+    def test_pages_follow_sql_order(self):
+        for sort_by, field in [("price", Product.price), ("code", Product.id)]:
+            for descending in (False, True):
+                order = field.desc() if descending else field.asc()
+                expected = [
+                    code
+                    for (code,) in Product.select(Product.id)
+                    .order_by(order, Product.id.desc() if descending else Product.id)
+                    .tuples()
+                ]
+                for limit in (1, 3, 4, 10):
+                    pages = self.collect({}, sort_by, descending, limit)
+                    self.assertTrue(all(len(page) == limit for page in pages[:-1]))
+                    self.assertEqual(sum(pages, []), expected)
+
+    def test_filters_and_cursor_checks(self):
+        self.assertEqual(
+            self.collect({"min_price": 100}, "price", False, 2),
+            [["P1", "P5"], ["P2", "P7"]],
+        )
+
+        page = Product.get_page({}, Paging("price", limit=2))
+        list(page)
+        with self.assertRaises(Exception):
+            Product.get_page({}, Paging("price", True, 2, page.cursor))
+        with self.assertRaises(Exception):
+            Product.get_page({}, Paging("price", after="not a cursor"))
+        with self.assertRaises(Exception):
+            Product.get_page({}, Paging("description"))
+
+
+class TestOrderTotals(OrderTestCase):
+    def get_totals(self):
+        return {
+            info.id: (info.total_count, info.total_price)
+            for info in Order.get_filtered()
+        }
+
+    def assertTotalsMatchLines(self):
+        stored = self.get_totals()
+        Order.refresh_totals()
+        self.assertEqual(stored, self.get_totals())
+
+    def test_line_mutations(self):
+        Order.add_count_product(self.first.id, "A", 3)
+        self.assertEqual(Order.get_order_total_price(self.first.id), 750)
+        Order.reduce_count_product(self.second.id, "B", 1)
+        self.assertEqual(Order.get_order_total_count(self.second.id), 3)
+        Order.remove_product(self.first.id, "B")
+        self.assertEqual(Order.get_order_total_price(self.first.id), 500)
+        self.assertTotalsMatchLines()
+
+    def test_product_changes(self):
+        Product.upsert_batch([ProductInfo("B", price=300)])
+        self.assertEqual(Order.get_order_total_price(self.second.id), 1200)
+
+        Product.remove("B")
+        self.assertEqual(Order.get_order_total_count(self.first.id), 2)
+        self.assertEqual(Order.get_order_total_price(self.first.id), 200)
+        self.assertEqual(Order.get_order_total_price(self.second.id), 0)
+        self.assertTotalsMatchLines()
+
+    def test_add_columns_to_old_schema(self):
+        db.execute_sql('DROP INDEX "order_total_count"')
+        db.execute_sql('DROP INDEX "order_total_price"')
+        db.execute_sql('ALTER TABLE "order" DROP COLUMN "total_count"')
+        db.execute_sql('ALTER TABLE "order" DROP COLUMN "total_price"')
+
+        self.assertTrue(add_order_total_columns())
+        self.assertFalse(add_order_total_columns())
+        Order.refresh_totals()
+        self.assertEqual(Order.get_order_total_price(self.first.id), 450)
+
+
+class TestOrderLines(OrderTestCase):
+    def test_failures_roll_back(self):
+        with self.assertRaises(Exception):
+            Order.add_product(self.empty.id, "A", 1000)
+        with self.assertRaises(NotFoundException):
+            Order.add_product(9999, "A", 1)
+        with self.assertRaises(Exception):
+            Order.add_count_product(self.empty.id, "A", 1)
+        with self.assertRaises(Exception):
+            Order.reduce_count_product(self.first.id, "A", 3)
+
+        self.assertEqual(Product.get_count("A"), 98)
+        self.assertEqual(OrderProduct.get_count(self.first.id, "A"), 2)
+        self.assertEqual(Order.get_order_total_count(self.empty.id), 0)
+
+    def test_reduce_to_zero_removes_line(self):
+        Order.reduce_count_product(self.first.id, "A", 2)
+
+        self.assertEqual(Product.get_count("A"), 100)
+        with self.assertRaises(Exception):
+            OrderProduct.find_by_ids(self.first.id, "A")
+        self.assertEqual(Order.get_order_total_price(self.first.id), 250)
+
+
+class TestOrderBatch(OrderTestCase):
+    def get_lines(self, order_id):
+        return dict(
+            OrderProduct.select(OrderProduct.product, OrderProduct.count)
+            .where(OrderProduct.order == order_id)
+            .tuples()
+        )
+
+    def test_add_merges_duplicates(self):
+        Order.apply_batch(self.empty.id, [(2, "A", 3), (3, "B", 1), (4, "A", 2)], "add")
+
+        self.assertEqual(self.get_lines(self.empty.id), {"A": 5, "B": 1})
+        self.assertEqual(Product.get_count("A"), 93)
+        self.assertEqual(Order.get_order_total_price(self.empty.id), 750)
+
+    def test_count_operations(self):
+        Order.apply_batch(self.first.id, [(2, "A", 3), (3, "B", 2)], "add_count")
+        Order.apply_batch(self.first.id, [(2, "A", 5), (3, "B", 1)], "reduce_count")
+
+        self.assertEqual(self.get_lines(self.first.id), {"B": 2})
+        self.assertEqual(Product.get_count("A"), 100)
+        self.assertEqual(Order.get_order_total_count(self.first.id), 2)
+        self.assertEqual(Order.get_order_total_price(self.first.id), 500)
+
+    def test_remove(self):
+        Order.apply_batch(self.first.id, [(2, "A", None), (3, "B", None)], "remove")
+
+        self.assertEqual(self.get_lines(self.first.id), {})
+        self.assertEqual(Product.get_count("A"), 100)
+        self.assertEqual(Order.get_order_total_price(self.first.id), 0)
+
+    def test_errors_and_dry_run(self):
+        rows = [(2, "A", 60), (3, "A", 60), (4, "C", 1), (5, "B", 1), (6, "B", 0)]
+
+        with self.assertRaises(BatchException) as context:
+            Order.apply_batch(self.first.id, rows, "add", dry_run=True)
+        with self.assertRaises(BatchException):
+            Order.apply_batch(self.first.id, rows, "add")
+
+        self.assertEqual(
+            [error.split(":")[0] for error in context.exception.errors],
+            ["Row 2", "Row 3", "Row 4", "Row 5", "Row 6"],
+        )
+        self.assertEqual(Product.get_count("A"), 98)
+        self.assertEqual(
+            Order.apply_batch(self.empty.id, [(2, "A", 1)], "add", dry_run=True), 1
+        )
+        self.assertEqual(self.get_lines(self.empty.id), {})
+
+
+class TestStockLedger(OrderTestCase):
+    def get_movements(self):
+        return list(
+            StockMovement.select(
+                StockMovement.product,
+                StockMovement.delta,
+                StockMovement.reason,
+                StockMovement.order,
+            )
+            .order_by(StockMovement.id)
+            .tuples()
+        )
+
+    def test_every_change_is_recorded(self):
+        Product.reduce_count("A", 5)
+        Order.remove_product(self.first.id, "B")
+        Order.apply_batch(self.empty.id, [(2, "A", 3), (3, "B", 1)], "add")
+        Product.adjust_count_batch([(2, "A", 4)])
+        Product.remove("B")
+
+        self.assertEqual(
+            self.get_movements(),
+            [
+                ("A", 100, "receipt", None),
+                ("B", 100, "receipt", None),
+                ("A", -2, "order", self.first.id),
+                ("B", -1, "order", self.first.id),
+                ("B", -4, "order", self.second.id),
+                ("A", -5, "adjustment", None),
+                ("B", 1, "order", self.first.id),
+                ("A", -3, "order", self.empty.id),
+                ("B", -1, "order", self.empty.id),
+                ("A", 4, "receipt", None),
+                ("B", -95, "adjustment", None),
+            ],
+        )
+
+    def test_failures_record_nothing(self):
+        recorded = StockMovement.select().count()
+        with self.assertRaises(Exception):
+            Product.reduce_count("A", 1000)
+        with self.assertRaises(NotFoundException):
+            Order.add_product(9999, "A", 1)
+        with self.assertRaises(BatchException):
+            Product.adjust_count_batch([(2, "A", 1), (3, "C", 1)])
+
+        self.assertEqual(StockMovement.select().count(), recorded)
+
+    def test_counts_before(self):
+        StockMovement.update(timestamp=datetime.datetime(2024, 1, 1)).execute()
+        StockSnapshot.take()
+        Product.reduce_count("A", 10)
+        StockMovement.update(timestamp=datetime.datetime(2024, 2, 1)).where(
+            StockMovement.timestamp > datetime.datetime(2024, 1, 1)
+        ).execute()
+        Product.add_count("B", 5)
+
+        def counts_before(*date):
+            moment = datetime.datetime(*date)
+            return {info.code: info.count for info in Product.get_infos_before(moment)}
+
+        self.assertEqual(counts_before(2024, 1, 1), {})
+        self.assertEqual(counts_before(2024, 1, 2), {"A": 98, "B": 95})
+        self.assertEqual(counts_before(2024, 2, 2), {"A": 88, "B": 95})
+        self.assertEqual(
+            counts_before(9999, 1, 1), {"A": Product.get_count("A"), "B": 100}
+        )
+
+    def test_counts_before_stop_at_the_next_snapshot(self):
+        StockMovement.update(timestamp=datetime.datetime(2024, 1, 1)).execute()
+        StockSnapshot.take()
+        Product.reduce_count("A", 10)
+        StockMovement.update(timestamp=datetime.datetime(2024, 2, 1)).where(
+            StockMovement.timestamp > datetime.datetime(2024, 1, 1)
+        ).execute()
+        StockSnapshot.take()
+        Product.add_count("B", 5)
+
+        counts = StockMovement.counts_before(datetime.datetime(2024, 1, 15))
+        sql, params = counts.sql()
+        plan = [row[-1] for row in db.execute_sql(f"EXPLAIN QUERY PLAN {sql}", params)]
+        self.assertIn(
+            "SEARCH t2 USING INTEGER PRIMARY KEY (rowid>? AND rowid<?)", plan
+        )
+        self.assertEqual(dict(counts.tuples()), {"A": 98, "B": 95})
+
+    def test_periodic_snapshots(self):
+        with mock.patch("WMan.database.SNAPSHOT_INTERVAL", 4):
+            Product.add_count("A", 1)
+            Product.adjust_count_batch([(2, "A", 1), (3, "B", 1)])
+
+        self.assertEqual(
+            list(StockSnapshot.select(StockSnapshot.movement).tuples()), [(8,)]
+        )
+        counts = StockMovement.counts_before(datetime.datetime(9999, 1, 1))
+        self.assertEqual(dict(counts.tuples()), {"A": 100, "B": 96})
+        self.assertEqual(StockSnapshot.take(), 8)
+
+    def test_removed_products_keep_their_history(self):
+        Product.add(ProductInfo("C", "Removed later", "BrandC", 6, 40))
+        Product.add_count("C", 3)
+        before_removal = datetime.datetime.now()
+        Product.remove("B")
+        Product.remove("C")
+
+        self.assertEqual(
+            dict(StockMovement.counts_before(before_removal).tuples()),
+            {"A": 98, "B": 95, "C": 3},
+        )
+        infos = Product.get_infos_before(before_removal)
+        self.assertEqual(
+            [(info.code, info.count) for info in infos],
+            [("A", 98), ("B", 95), ("C", 3)],
+        )
+        self.assertEqual(infos[0].price, 100)
+        self.assertEqual((infos[2].description, infos[2].brand), (None, None))
+
+
+class TestProductSearch(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        Product.add(ProductInfo("RICE-10", "Basmati rice 10kg", "Golestan", 1, 900))
+        Product.add(ProductInfo("TEA-1", "Black tea, rice flour", "Ahmad", 12, 50))
+        # "Tea bag" in Persian, with the Persian yeh and keheh
+        tea_bag = "\u0686\u0627\u06cc \u06a9\u06cc\u0633\u0647"
+        Product.add(ProductInfo("P003", tea_bag, "Ahmad", 6, 70))
+        Product.add_count("TEA-1", 4)
+
+    def search(self, text, filters=None):
+        return [product.code for product in Product.search(text, filters)]
+
+    def test_prefixes_of_every_word(self):
+        self.assertEqual(self.search("ric"), ["RICE-10", "TEA-1"])
+        self.assertEqual(self.search("bla ri"), ["TEA-1"])
+        self.assertEqual(self.search("ahm"), ["P003", "TEA-1"])
+        self.assertEqual(self.search("coffee"), [])
+
+    def test_code_ranks_first(self):
+        self.assertEqual(self.search("rice")[0], "RICE-10")
+        self.assertEqual(self.search("tea"), ["TEA-1"])
+
+    def test_filters_and_limit(self):
+        self.assertEqual(self.search("rice", {"max_price": 100}), ["TEA-1"])
+        self.assertEqual(self.search("ahmad", {"min_count": 1}), ["TEA-1"])
+        self.assertEqual(len(Product.search("ahmad", limit=1)), 1)
+
+    def test_arabic_letters_find_persian_ones(self):
+        # Typed with the Arabic yeh and kaf
+        arabic = "\u0686\u0627\u064a \u0643\u064a\u0633"
+        self.assertEqual(self.search(arabic), ["P003"])
+
+    def test_syntax_is_searched_as_text(self):
+        self.assertEqual(self.search('rice-10 "'), ["RICE-10"])
+        self.assertEqual(self.search("tea OR NOT"), [])
+        with self.assertRaises(Exception):
+            Product.search(" * ")
+
+    def test_index_follows_changes(self):
+        Product.update(description="Green tea").where(Product.id == "TEA-1").execute()
+        self.assertEqual(self.search("rice"), ["RICE-10"])
+        self.assertEqual(self.search("green"), ["TEA-1"])
+
+        Product.remove("RICE-10")
+        self.assertEqual(self.search("basmati"), [])
+
+        # Without words, the code can't find the indexed row by MATCH
+        Product.add(ProductInfo("--", "Unnamed", "Ahmad"))
+        Product.add(ProductInfo('"Q"', "Quoted", "Ahmad"))
+        Product.remove("--")
+        Product.remove('"Q"')
+        self.assertEqual(self.search("ahmad"), ["P003", "TEA-1"])
+
+        self.assertEqual(rebuild_search_index(), 2)
+        self.assertEqual(self.search("green"), ["TEA-1"])
+        db.execute_sql(
+            "INSERT INTO productsearch(productsearch) VALUES ('integrity-check')"
+        )
+
+
+class TestLookupCache(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        enable_lookup_caches()
+        self.addCleanup(enable_lookup_caches, False)
+        Product.add(ProductInfo("P001", "Product 1", "BrandA", 10, 1000))
+        Customer.add("Ali")
+
+    def test_hits_only_check_the_version(self):
+        Product.get_product_info("P001")
+        with self.assertMaxStatements(2) as statements:
+            self.assertEqual(Product.get_product_info("P001").brand, "BrandA")
+            self.assertEqual(get_or_raise(Product, "P001").price, 1000)
+        self.assertEqual(statements, ["PRAGMA data_version"] * 2)
+        self.assertEqual(
+            lookup_caches["product"].stats(), {"size": 1, "hits": 2, "misses": 1}
+        )
+
+        self.assertEqual(Customer.get_customer_id("Ali"), 1)
+        self.assertEqual(Customer.get_customer_id("Ali"), 1)
+        self.assertEqual(lookup_caches["customer"].stats()["hits"], 1)
+
+    def test_unknown_keys_are_not_cached(self):
+        for _ in range(2):
+            with self.assertRaises(NotFoundException):
+                Product.get_product_info("P404")
+            with self.assertRaises(Exception):
+                Customer.get_customer_id("Sara")
+        self.assertEqual(lookup_caches["product"].stats()["misses"], 2)
+        Customer.add("Sara")
+        self.assertEqual(Customer.get_customer_id("Sara"), 2)
+
+    def test_own_writes_invalidate(self):
+        Product.get_product_info("P001")
+        Product.add_count("P001", 5)
+        self.assertEqual(Product.get_product_info("P001").count, 5)
+
+        product = get_or_raise(Product, "P001")
+        product.brand = "Changed in memory only"
+        self.assertEqual(Product.get_product_info("P001").brand, "BrandA")
+
+    def test_transactions_bypass_the_cache(self):
+        with self.assertRaises(ZeroDivisionError):
+            with db.atomic():
+                Product.update(brand="BrandB").where(Product.id == "P001").execute()
+                self.assertEqual(Product.get_product_info("P001").brand, "BrandB")
+                1 / 0
+        self.assertEqual(Product.get_product_info("P001").brand, "BrandA")
+        self.assertEqual(lookup_caches["product"].stats()["misses"], 1)
+
+    def test_least_recently_used_are_evicted(self):
+        cache = LookupCache(maxsize=2)
+        cache.enabled = True
+        for key in [1, 2, 1, 3]:
+            cache.get(key, str)
+        self.assertEqual(list(cache.entries), [1, 3])
+        self.assertEqual(cache.stats(), {"size": 2, "hits": 1, "misses": 3})
+
+
+def add_units_concurrently(database_path: str, order_id: int, attempts: int):
+    db.init(database_path)
+    added = 0
+    for _ in range(attempts):
+        try:
+            Order.add_count_product(order_id, "P001", 1)
+            added += 1
+        except Exception:
+            pass
+    db.close()
+    return added
+
+
+class TestConcurrentOrderLines(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database_path = os.path.join(self.directory.name, "warehouse.db")
+        db.init(self.database_path)
+        create_tables()
+        Customer.add("Ali")
+        Product.add(ProductInfo("P001", price=10))
+        Product.add_count("P001", 26)
+        self.order_ids = []
+        for _ in range(4):
+            order = Order.new("Ali", datetime.date(2024, 1, 1))
+            Order.add_product(order.id, "P001", 1)
+            self.order_ids.append(order.id)
+        db.close()
+
+    def tearDown(self):
+        db.init(":memory:")
+        self.directory.cleanup()
+
+    def test_no_overselling(self):
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(4) as pool:
+            added = pool.starmap(
+                add_units_concurrently,
+                [(self.database_path, order_id, 15) for order_id in self.order_ids],
+            )
+
+        db.init(self.database_path)
+        self.assertEqual(sum(added), 22)
+        self.assertEqual(Product.get_count("P001"), 0)
+        self.assertEqual(
+            sum(Order.get_order_total_count(order_id) for order_id in self.order_ids),
+            26,
+        )
+        db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import tempfile
+
+from benchmarks.generator import (
+    WarehouseSize,
+    batch_files,
+    fill_warehouse,
+    write_batch_files,
+)
+from WMan.database import Order, OrderProduct, Product, fn
+from WMan.sheetutils.reader import CsvReader
+from test.dbutils import DatabaseTestCase
+
+
+class TestGenerator(DatabaseTestCase):
+    size = WarehouseSize(products=50, customers=5, orders=20, batch_rows=10)
+
+    def test_fill_warehouse(self):
+        fill_warehouse(self.size, seed=3)
+
+        self.assertEqual(Product.select().count(), 50)
+        self.assertEqual(Order.select().count(), 20)
+        # Every order has lines, and the totals were computed from them
+        line_count = OrderProduct.select(fn.SUM(OrderProduct.count)).scalar()
+        self.assertEqual(Order.select(fn.SUM(Order.total_count)).scalar(), line_count)
+        self.assertEqual(
+            OrderProduct.select(OrderProduct.order).distinct().count(), 20
+        )
+
+    def test_seeded(self):
+        self.assertEqual(batch_files(self.size, 1), batch_files(self.size, 1))
+        self.assertNotEqual(batch_files(self.size, 1), batch_files(self.size, 2))
+
+    def test_batch_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = write_batch_files(directory, self.size)
+            with CsvReader(paths["counts", "csv"]) as reader:
+                rows = reader.get_data()
+        expected = batch_files(self.size)["counts"][1:]
+        self.assertEqual(rows, [[str(cell) for cell in row] for row in expected])
@@ -0,0 +1,150 @@
+import datetime
+import unittest
+
+from WMan.database import (
+    Customer,
+    DailyCustomerSales,
+    DailyProductSales,
+    Order,
+    Product,
+    ProductInfo,
+    StockMovement,
+    db,
+    drop_search_index,
+)
+from WMan.migrations import (
+    LATEST_VERSION,
+    get_schema_version,
+    migrate_database,
+    set_schema_version,
+)
+from test.dbutils import count_statements
+
+OLD_SCHEMA = [
+    'CREATE TABLE "customer" ("id" INTEGER NOT NULL PRIMARY KEY, '
+    '"name" VARCHAR(255) NOT NULL)',
+    'CREATE TABLE "order" ("id" INTEGER NOT NULL PRIMARY KEY, '
+    '"date" DATE NOT NULL, "customer_id" INTEGER NOT NULL)',
+    'CREATE TABLE "product" ("id" VARCHAR(255) NOT NULL PRIMARY KEY, '
+    '"description" VARCHAR(255), "brand" VARCHAR(255), "price" INTEGER, '
+    '"count_in_carton" INTEGER, "count" INTEGER NOT NULL)',
+    'CREATE TABLE "orderproduct" ("count" INTEGER NOT NULL, '
+    '"product_id" VARCHAR(255) NOT NULL, "order_id" INTEGER NOT NULL, '
+    'PRIMARY KEY ("product_id", "order_id"))',
+    "INSERT INTO \"customer\" VALUES (1, 'Ali')",
+    "INSERT INTO \"order\" VALUES (1, '2024-01-01', 1)",
+    "INSERT INTO \"product\" VALUES ('A', NULL, NULL, 100, NULL, 5)",
+    "INSERT INTO \"orderproduct\" VALUES (3, 'A', 1)",
+]
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        db.init(":memory:")
+        db.connect()
+
+    def tearDown(self):
+        db.close()
+
+    def get_index_names(self):
+        return {
+            name
+            for (name,) in db.execute_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"
+            )
+        }
+
+    def get_schema_names(self):
+        return {
+            name
+            for (name,) in db.execute_sql(
+                "SELECT name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"
+            )
+        }
+
+    def test_fresh_database(self):
+        self.assertEqual(migrate_database(), 0)
+        self.assertEqual(get_schema_version(), LATEST_VERSION)
+        self.assertIn("customer_name", self.get_index_names())
+
+    def test_up_to_date_database_costs_one_statement(self):
+        migrate_database()
+        with count_statements() as statements:
+            self.assertEqual(migrate_database(), 0)
+        self.assertEqual(statements, ["PRAGMA user_version"])
+
+    def test_upgrade_matches_fresh_schema(self):
+        migrate_database()
+        fresh = self.get_schema_names()
+        db.close()
+        db.init(":memory:")
+        db.connect()
+        for statement in OLD_SCHEMA:
+            db.execute_sql(statement)
+
+        migrate_database()
+        self.assertEqual(self.get_schema_names(), fresh)
+
+    def test_upgrade_old_database(self):
+        for statement in OLD_SCHEMA:
+            db.execute_sql(statement)
+
+        self.assertEqual(migrate_database(), LATEST_VERSION)
+        self.assertEqual(get_schema_version(), LATEST_VERSION)
+        self.assertEqual(migrate_database(), 0)
+
+        self.assertTrue(
+            {
+                "customer_name",
+                "product_brand_id",
+                "order_date",
+                "order_total_price",
+                "orderproduct_order_id",
+            }
+            <= self.get_index_names()
+        )
+        self.assertNotIn("product_brand", self.get_index_names()
+        )
+        order = Order.get_by_id(1)
+        self.assertEqual((order.total_count, order.total_price), (3, 300))
+        counts = StockMovement.counts_before(datetime.datetime(9999, 1, 1))
+        self.assertEqual(dict(counts.tuples()), {"A": 5})
+        self.assertEqual(
+            list(DailyProductSales.get_rows("product")), [("A", None, None, 3, 300)]
+        )
+        self.assertEqual(
+            list(DailyCustomerSales.get_rows("customer")), [("Ali", 3, 300)]
+        )
+        self.assertEqual([product.code for product in Product.search("a")], ["A"])
+
+    def test_search_index_keyed_by_rowid_is_replaced(self):
+        migrate_database()
+        drop_search_index()
+        db.execute_sql(
+            "CREATE VIRTUAL TABLE productsearch USING fts5("
+            "id, description, brand, content='product', content_rowid='rowid')"
+        )
+        set_schema_version(6)
+        Product.add(ProductInfo("A", "Basmati rice"))
+
+        self.assertEqual(migrate_database(), LATEST_VERSION - 6)
+        self.assertEqual([product.code for product in Product.search("ric")], ["A"])
+        Product.remove("A")
+        self.assertEqual(Product.search("ric"), [])
+
+    def test_duplicate_customers_abort_upgrade(self):
+        for statement in OLD_SCHEMA:
+            db.execute_sql(statement)
+        db.execute_sql("INSERT INTO \"customer\" VALUES (2, 'Ali')")
+
+        with self.assertRaises(Exception):
+            migrate_database()
+
+        self.assertEqual(get_schema_version(), 0)
+        self.assertEqual(Customer.select().count(), 2)
+        columns = [column.name for column in db.get_columns("order")]
+        self.assertNotIn("total_count", columns)
+
+
+if __name__ == "__main__":
+    unittest.main()
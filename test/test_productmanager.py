@@ -1,10 +1,16 @@
-from unittest.mock import patch, Mock, MagicMock
+from unittest.mock import patch, Mock
 import unittest.mock
+import contextlib
+import datetime
+import io
+import os
 import tempfile
 
-from WMan.database import Product, ProductInfo
+from WMan.database import BatchException, Customer, Order, Product, ProductInfo
+from WMan.OrderManager import OrderManager, OrderProductIndexes
 from WMan.ProductManager import ProductManager, ColumnIndexes
 from WMan.sheetutils.reader import SheetReader
+from test.dbutils import DatabaseTestCase, count_statements
 
 
 class TestProductManager(unittest.TestCase):
@@ -113,11 +119,22 @@ class TestProductManager(unittest.TestCase):
         self.assertEqual(new_product_info.price, 69420)
         self.assertEqual(new_product_info.count_in_carton, 420)
 
+    @patch.object(Product, "upsert_batch")
     @patch.object(SheetReader, "__init__")
-    @patch.object(SheetReader, "get_data")
-    def test_batch_apply(self, mock_get_data: Mock, mock_init: Mock):
+    @patch.object(SheetReader, "close")
+    @patch.object(SheetReader, "iter_rows")
+    def test_load_catalogue(
+        self,
+        mock_iter_rows: Mock,
+        mock_close: Mock,
+        mock_init: Mock,
+        mock_upsert_batch: Mock,
+    ):
         mock_init.return_value = None
-        mock_get_data.return_value = self.sample_product_list
+        mock_iter_rows.return_value = iter(self.sample_product_list)
+        mock_upsert_batch.side_effect = lambda products, insert_missing: list(
+            products
+        )
 
         indexes = ColumnIndexes(
             code_column=0,
@@ -127,13 +144,12 @@ class TestProductManager(unittest.TestCase):
             count_in_carton_column=3,
         )
 
-        mock_method = MagicMock()
-
-        ProductManager.batch_apply("dummy.xlsx", indexes, mock_method)
+        products = ProductManager.load_catalogue("dummy.xlsx", indexes, True)
 
-        mock_method.assert_called()
-        mock_method.assert_any_call(self.sample_product_infos[0])
-        mock_method.assert_any_call(self.sample_product_infos[1])
+        mock_upsert_batch.assert_called_once()
+        self.assertEqual(mock_upsert_batch.call_args.kwargs["insert_missing"], True)
+        self.assertEqual(products, self.sample_product_infos)
+        mock_close.assert_called_once()
 
     @patch("rich.print")
     @patch("rich.table.Table.add_row")
@@ -274,5 +290,97 @@ class TestProductManager(unittest.TestCase):
             self.assertEqual(data[2], ["3"] + sample_availability_list[2])
 
 
+class TestProductPages(DatabaseTestCase):
+    def test_iter_pages(self):
+        for index in range(5):
+            Product.add(ProductInfo(f"P{index}", price=100 * (5 - index)))
+
+        pages = ProductManager.iter_pages({}, sort_by="price", page_size=2)
+        self.assertEqual(
+            [[product.code for product in page.items] for page in pages],
+            [["P4", "P3"], ["P2", "P1"], ["P0"]],
+        )
+
+
+class TestShortRows(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        Product.add(ProductInfo("P1", "Product 1", "BrandA", 6, 40))
+        Product.add(ProductInfo("P2", "Product 2", "BrandB", 6, 70))
+        Product.add_count("P1", 10)
+        Product.add_count("P2", 10)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.filename = os.path.join(self.directory.name, "batch.csv")
+        with open(self.filename, "w") as file:
+            file.write("Code,Count\nP1,2\nP2\n")
+
+    def test_count_batch(self):
+        with self.assertRaises(BatchException) as context:
+            ProductManager.add_count_batch(
+                self.filename, ColumnIndexes(code_column=0, count_column=1)
+            )
+        self.assertEqual(
+            context.exception.errors, ["Row 3: Invalid count None for product P2"]
+        )
+        self.assertEqual(Product.get_count("P1"), 10)
+
+    def test_order_batch(self):
+        Customer.add("Ali")
+        order = OrderManager.new("Ali", datetime.date(2024, 1, 1))
+        with self.assertRaises(BatchException) as context:
+            order.apply_batch(self.filename, OrderProductIndexes(0, 1), "add")
+        self.assertEqual(
+            context.exception.errors, ["Row 3: Invalid count None for product P2"]
+        )
+        self.assertEqual(Order.get_order_products(order.get_id()), [])
+
+    def test_catalogue(self):
+        result = ProductManager.update_batch(
+            self.filename, ColumnIndexes(code_column=0, price_column=2)
+        )
+        self.assertEqual((result.updated, result.unchanged), (0, 2))
+
+
+class TestProductUpdate(DatabaseTestCase):
+    def test_only_edited_fields_are_written(self):
+        Product.add(ProductInfo("A", "Product", "BrandA", 6, 40))
+        Product.add_count("A", 5)
+
+        with count_statements() as statements:
+            ProductManager.update(ProductInfo("A", brand="BrandB", price=50))
+        self.assertIn(
+            'UPDATE "product" SET "brand" = ?, "price" = ? '
+            'WHERE ("product"."id" = ?)',
+            statements,
+        )
+        product = Product.get_product_info("A")
+        self.assertEqual(
+            (product.brand, product.price, product.count), ("BrandB", 50, 5)
+        )
+
+
+class TestAvailabilityBefore(DatabaseTestCase):
+    def test_removed_products_are_listed(self):
+        Product.add(ProductInfo("A", "Kept", "BrandA", 6, 40))
+        Product.add(ProductInfo("B", "Removed", "BrandB", 6, 70))
+        Product.add_count("A", 2)
+        Product.add_count("B", 3)
+        before_removal = datetime.datetime.now()
+        Product.remove("B")
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            ProductManager.list_availability_before(before_removal)
+        self.assertIn("IRR 80", output.getvalue())
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "availability.xlsx")
+            ProductManager.list_availability_before(before_removal, filename)
+            with SheetReader(filename) as reader:
+                rows = reader.get_data()
+        self.assertEqual(rows[-1][1:], ["B", None, None, None, None, None, 3])
+
+
 if __name__ == "__main__":
     unittest.main()
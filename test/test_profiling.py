@@ -0,0 +1,59 @@
+import json
+import os
+import tempfile
+import time
+
+from WMan import profiling
+from WMan.database import Product, ProductInfo, db
+from test.dbutils import DatabaseTestCase
+
+
+class TestProfiling(DatabaseTestCase):
+    def tearDown(self):
+        if profiling.current is not None:
+            profiling.finish(report=False)
+        super().tearDown()
+
+    def test_disabled(self):
+        rows = [1, 2]
+        self.assertIs(profiling.timed_iter("read", rows), rows)
+        self.assertEqual(profiling.in_phase("write")(sum)(rows), 3)
+
+    def test_phases_and_statements(self):
+        profile = profiling.start("product add")
+
+        def slow_rows():
+            for row in range(2):
+                time.sleep(0.02)
+                yield row
+
+        for _ in profiling.timed_iter("read", slow_rows()):
+            with profiling.phase("render"):
+                time.sleep(0.01)
+        Product.add(ProductInfo("P1", "Product", "Brand", 1, 100))
+        Product.get_product_info("P1")
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "profile.json")
+            profiling.finish(output, report=False)
+            with open(output) as file:
+                report = json.load(file)
+
+        self.assertIsNone(profiling.current)
+        self.assertNotIn(profile.record_query, db.query_hooks)
+        self.assertEqual(report["command"], "product add")
+        self.assertGreaterEqual(report["sql"]["statements"], 2)
+        self.assertGreaterEqual(report["phases"]["read"], 0.04)
+        self.assertGreaterEqual(report["phases"]["render"], 0.02)
+        self.assertLess(report["phases"]["render"], report["phases"]["read"])
+        self.assertAlmostEqual(
+            sum(report["phases"].values()), report["wall_seconds"], places=3
+        )
+        self.assertIsNone(report["peak_memory_bytes"])
+
+    def test_trace_memory(self):
+        profiling.start("product list", trace_memory=True)
+        data = [str(index) for index in range(10_000)]
+        profile = profiling.finish(report=False)
+        del data
+        self.assertGreater(profile.peak_memory, 100_000)
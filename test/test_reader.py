@@ -1,8 +1,18 @@
 import os
 import sys
+import tempfile
 import unittest
 
-from WMan.sheetutils.reader import SheetReader
+from openpyxl import Workbook
+from openpyxl.styles import Font
+
+from WMan.sheetutils.reader import (
+    CsvReader,
+    SheetReader,
+    open_reader,
+    to_int,
+    to_str,
+)
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
 
@@ -18,6 +28,70 @@ class TestSheetReader(unittest.TestCase):
         self.assertEqual(data[1], [2, "BMW", 200000])
         self.assertEqual(data[2], [3, "Mercedes", 300000])
 
+    def test_inflated_dimensions(self):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(["Code", "Count"])
+        sheet.append(["P001", 1])
+        sheet.append([None, None])
+        sheet.append(["P002", 2])
+        # Styling a far away cell inflates the dimensions reported by the sheet
+        sheet.cell(row=500, column=2).font = Font(bold=True)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, "inflated.xlsx")
+            workbook.save(filepath)
+
+            with SheetReader(filepath) as reader:
+                self.assertEqual(reader.sheet.max_row, 500)
+                data = reader.get_data()
+                chunks = list(reader.iter_chunks(chunk_size=2))
+
+        self.assertEqual(data, [["P001", 1], [None, None], ["P002", 2]])
+        self.assertEqual(chunks, [[["P001", 1], [None, None]], [["P002", 2]]])
+
+
+class TestCsvReader(unittest.TestCase):
+    def write_file(self, directory: str, name: str, content: str, encoding="utf-8"):
+        filepath = os.path.join(directory, name)
+        with open(filepath, "w", encoding=encoding, newline="") as file:
+            file.write(content)
+        return filepath
+
+    def test_typed_conversion(self):
+        converters = {1: to_str, 2: to_int}
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = self.write_file(
+                directory,
+                "cars.csv",
+                'Row,Code,Count\n1,007,"1,200"\n2,B12,۱۲\n3,C1,x\n,,\n',
+            )
+            with open_reader(filepath, converters=converters) as reader:
+                self.assertIsInstance(reader, CsvReader)
+                data = reader.get_data()
+
+        self.assertEqual(
+            data, [["1", "007", 1200], ["2", "B12", 12], ["3", "C1", "x"]]
+        )
+
+    def test_delimiter_and_encoding(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tsv_path = self.write_file(directory, "a.tsv", "Code\tCount\nP1\t2\n")
+            sniffed_path = self.write_file(
+                directory, "export", "Code;Brand\nP1;ایران\n", encoding="utf-16"
+            )
+
+            with open_reader(tsv_path) as reader:
+                self.assertEqual(reader.get_data(), [["P1", "2"]])
+            with open_reader(sniffed_path, encoding="utf-16") as reader:
+                self.assertEqual(reader.delimiter, ";")
+                self.assertEqual(reader.get_data(), [["P1", "ایران"]])
+
+    def test_xlsx_detection(self):
+        current_path = os.path.dirname(__file__)
+        with open_reader(current_path + "/assets/reader_cars.xlsx") as reader:
+            self.assertIsInstance(reader, SheetReader)
+
 
 if __name__ == '__main__':
     unittest.main()
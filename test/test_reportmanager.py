@@ -0,0 +1,169 @@
+import datetime
+import json
+import os
+import tempfile
+
+from openpyxl import load_workbook
+
+from WMan.database import (
+    Customer,
+    Order,
+    Product,
+    ProductInfo,
+    rebuild_sales_rollups,
+)
+from WMan.ReportManager import ReportManager, SalesGroup, statement_filename
+from WMan.sheetutils.stream import OutputFormat
+from test.dbutils import DatabaseTestCase
+
+
+class TestStatements(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        for code, price in [("A", 100), ("B", 250)]:
+            Product.add(ProductInfo(code, f"Product {code}", "Brand", 1, price))
+            Product.add_count(code, 100)
+
+        Customer.add("Ali")
+        Customer.add("Sara/Q")
+        january = Order.new("Ali", datetime.date(2024, 1, 5))
+        february = Order.new("Ali", datetime.date(2024, 2, 5))
+        other = Order.new("Sara/Q", datetime.date(2024, 1, 20))
+        Order.new("Sara/Q", datetime.date(2024, 1, 21))
+        Order.add_product(january.id, "B", 1)
+        Order.add_product(january.id, "A", 2)
+        Order.add_product(february.id, "A", 3)
+        Order.add_product(other.id, "B", 4)
+        self.january, self.february, self.other = january, february, other
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def summarize(self, filters):
+        return [
+            (
+                os.path.basename(statement.path),
+                statement.order_ids,
+                [(product.code, product.count) for product in statement.products],
+            )
+            for statement in ReportManager.get_statements(
+                self.directory.name, filters
+            )
+        ]
+
+    def test_partitioned_by_customer(self):
+        self.assertEqual(
+            self.summarize({}),
+            [
+                (
+                    "1-Ali.xlsx",
+                    [self.january.id, self.february.id],
+                    [("A", 2), ("B", 1), ("A", 3)],
+                ),
+                ("2-Sara_Q.xlsx", [self.other.id], [("B", 4)]),
+            ],
+        )
+        self.assertEqual(
+            self.summarize({"end_date": datetime.date(2024, 1, 31)}),
+            [
+                ("1-Ali.xlsx", [self.january.id], [("A", 2), ("B", 1)]),
+                ("2-Sara_Q.xlsx", [self.other.id], [("B", 4)]),
+            ],
+        )
+
+    def test_write_statements(self):
+        summary = ReportManager.write_statements(
+            self.directory.name,
+            {"customer": "Ali"},
+            workers=1,
+            period="2024",
+        )
+        self.assertEqual(
+            (summary.statements, summary.orders, summary.lines), (1, 2, 3)
+        )
+
+        sheet = load_workbook(os.path.join(self.directory.name, "1-Ali.xlsx")).active
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(rows[0][0], "Statement")
+        self.assertEqual((rows[1][0], rows[1][-1]), ("Buyer: Ali", "2024"))
+        self.assertEqual(rows[3], ("1", "A", "Product A", "Brand", 2, 100, 200))
+        self.assertEqual(len(rows), 6)
+
+    def test_statement_filename(self):
+        self.assertEqual(statement_filename(7, ' A "B" / C '), "7-A_B_C.xlsx")
+
+
+class TestSales(TestStatements):
+    def sales(self, group_by, filters={}):
+        return list(ReportManager.get_sales_rows(group_by, filters))
+
+    def all_sales(self):
+        return {group_by: self.sales(group_by) for group_by in SalesGroup}
+
+    def test_groupings(self):
+        self.assertEqual(
+            self.all_sales(),
+            {
+                SalesGroup.product: [
+                    ("A", "Product A", "Brand", 5, 500),
+                    ("B", "Product B", "Brand", 5, 1250),
+                ],
+                SalesGroup.brand: [("Brand", 10, 1750)],
+                SalesGroup.customer: [("Ali", 6, 750), ("Sara/Q", 4, 1000)],
+                SalesGroup.day: [
+                    (datetime.date(2024, 1, 5), 3, 450),
+                    (datetime.date(2024, 1, 20), 4, 1000),
+                    (datetime.date(2024, 2, 5), 3, 300),
+                ],
+                SalesGroup.month: [("2024-01", 7, 1450), ("2024-02", 3, 300)],
+            },
+        )
+        january = {"end_date": datetime.date(2024, 1, 31)}
+        self.assertEqual(
+            self.sales(SalesGroup.product, january),
+            [
+                ("A", "Product A", "Brand", 2, 200),
+                ("B", "Product B", "Brand", 5, 1250),
+            ],
+        )
+        february = {"start_date": datetime.date(2024, 2, 1)}
+        self.assertEqual(self.sales(SalesGroup.customer, february), [("Ali", 3, 300)])
+
+    def test_rollups_follow_changes(self):
+        Order.add_count_product(self.february.id, "A", 2)
+        Order.reduce_count_product(self.january.id, "B", 1)
+        Order.remove_product(self.other.id, "B")
+        Order.apply_batch(self.other.id, [(2, "A", 4), (3, "B", 1)], "add")
+        Order.apply_batch(self.january.id, [(2, "A", 1)], "reduce_count")
+        Product.update(price=300).where(Product.id == "B").execute()
+        Order.refresh_totals(["B"])
+        Product.remove("A")
+
+        incremental = self.all_sales()
+        rebuild_sales_rollups()
+        self.assertEqual(incremental, self.all_sales())
+        self.assertEqual(incremental[SalesGroup.customer], [("Sara/Q", 1, 300)])
+
+    def test_json_output(self):
+        path = os.path.join(self.directory.name, "sales.json")
+        ReportManager.report_sales(
+            SalesGroup.month, output=path, output_format=OutputFormat.json
+        )
+        with open(path, encoding="utf-8") as file:
+            self.assertEqual(
+                json.load(file),
+                [
+                    {"month": "2024-01", "count": 7, "revenue": 1450},
+                    {"month": "2024-02", "count": 3, "revenue": 300},
+                ],
+            )
+
+    def test_xlsx_output(self):
+        path = os.path.join(self.directory.name, "sales.xlsx")
+        ReportManager.report_sales(SalesGroup.customer, {}, "2024", output=path)
+
+        rows = list(load_workbook(path).active.iter_rows(values_only=True))
+        self.assertEqual(rows[0][0], "Sales by customer")
+        self.assertEqual(rows[3:], [("1", "Ali", 6, 750), ("2", "Sara/Q", 4, 1000)])
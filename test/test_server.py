@@ -0,0 +1,138 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from WMan.client import Client, RemoteException
+from WMan.database import (
+    Customer,
+    Product,
+    ProductInfo,
+    create_tables,
+    db,
+    enable_lookup_caches,
+)
+from WMan.server import Server
+
+
+class TestServer(unittest.TestCase):
+    """
+    Runs a server on a temporary database file, since the server's database
+    thread opens its own SQLite connection
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        db.init(os.path.join(self.directory.name, "warehouse.db"))
+        db.connect()
+        create_tables()
+        Product.add(ProductInfo("P1", "Product", "Brand", 1, 100))
+        Customer.add("Ali")
+
+        self.socket_path = os.path.join(self.directory.name, "wman.sock")
+        self.server = Server(self.socket_path)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.client = Client(self.socket_path, timeout=5)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        db.close()
+        self.directory.cleanup()
+
+    def test_operations(self):
+        self.client.call("availability.add", code="P1", count=5)
+        order_id = self.client.call(
+            "order.create", customer_name="Ali", date="2024-01-05"
+        )
+        self.client.call("order.add", order_id=order_id, code="P1", count=2)
+
+        self.assertEqual(self.client.call("product.info", code="P1")["count"], 3)
+        self.assertEqual(
+            self.client.call("order.list")["items"],
+            [
+                {
+                    "id": order_id,
+                    "total_count": 2,
+                    "total_price": 200,
+                    "customer_name": "Ali",
+                    "date": "2024-01-05",
+                }
+            ],
+        )
+        page = self.client.call("product.list", sort_by="price", limit=1)
+        self.assertEqual([item["code"] for item in page["items"]], ["P1"])
+
+    def test_errors(self):
+        with self.assertRaises(RemoteException) as context:
+            self.client.call("availability.add", code="NOPE", count=1)
+        self.assertEqual(context.exception.error_type, "NotFoundException")
+
+        with self.assertRaises(RemoteException):
+            self.client.call("product.drop_table")
+        # The connection stays usable after a failed request
+        self.assertEqual(self.client.call("customer.list"), [{"id": 1, "name": "Ali"}])
+
+    def test_concurrent_writes(self):
+        def add_counts():
+            with Client(self.socket_path, timeout=5) as client:
+                for _ in range(50):
+                    client.call("availability.add", code="P1", count=1)
+
+        threads = [threading.Thread(target=add_counts) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.client.call("product.info", code="P1")["count"], 200)
+
+    def test_clients_share_one_connection(self):
+        def server_connection():
+            return self.server.database_thread.submit(db.connection).result()
+
+        connection = server_connection()
+        for _ in range(3):
+            with Client(self.socket_path, timeout=5) as client:
+                client.call("availability.add", code="P1", count=1)
+        self.assertIs(server_connection(), connection)
+        self.assertEqual(self.client.call("product.info", code="P1")["count"], 3)
+
+    def test_cached_lookups(self):
+        enable_lookup_caches()
+        self.addCleanup(enable_lookup_caches, False)
+        self.assertEqual(self.client.call("product.info", code="P1")["count"], 0)
+        self.assertEqual(self.client.call("product.info", code="P1")["count"], 0)
+        stats = self.client.call("cache.stats")
+        self.assertEqual(stats["product"], {"size": 1, "hits": 1, "misses": 1})
+
+        # Written on the test's own connection, which the server only learns
+        # about from data_version
+        Product.add_count("P1", 4)
+        self.assertEqual(self.client.call("product.info", code="P1")["count"], 4)
+
+        self.client.call("order.create", customer_name="Ali")
+        self.client.call("order.create", customer_name="Ali")
+        stats = self.client.call("cache.stats")
+        self.assertEqual(stats["customer"], {"size": 1, "hits": 1, "misses": 1})
+
+    def test_lookups_cached_across_clients(self):
+        enable_lookup_caches()
+        self.addCleanup(enable_lookup_caches, False)
+        for _ in range(2):
+            with Client(self.socket_path, timeout=5) as client:
+                client.call("product.info", code="P1")
+        for _ in range(2):
+            with Client(self.socket_path, timeout=5) as client:
+                client.call("order.create", customer_name="Ali")
+        stats = self.client.call("cache.stats")
+        self.assertEqual(stats["product"], {"size": 1, "hits": 1, "misses": 1})
+        self.assertEqual(stats["customer"], {"size": 1, "hits": 1, "misses": 1})
+
+    def test_refuses_second_server(self):
+        with self.assertRaises(Exception):
+            Server(self.socket_path)
+        self.assertTrue(os.path.exists(self.socket_path))
@@ -0,0 +1,51 @@
+import subprocess
+import sys
+import unittest
+
+from benchmarks.startup import HEAVY_MODULES
+
+
+def imported_modules(command: list[str]) -> set[str]:
+    code = (
+        "import sys; "
+        f"sys.argv = ['wman', *{command!r}]; "
+        "import WMan.__main__; "
+        "print('\\n'.join(sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return set(result.stdout.split())
+
+
+class TestStartup(unittest.TestCase):
+    def test_quick_commands_skip_output_modules(self):
+        for command in [
+            ["availability", "add"],
+            ["product", "add"],
+            ["order", "add"],
+            ["customer", "create"],
+        ]:
+            with self.subTest(command=command):
+                modules = imported_modules(command)
+                self.assertIn(f"WMan.CLI.{command[0]}", modules)
+                for module in HEAVY_MODULES + ["playhouse.migrate"]:
+                    self.assertNotIn(module, modules)
+
+    def test_only_requested_sub_app_imported(self):
+        for command in [
+            ["availability", "add"],
+            ["--profile", "availability", "add"],
+            ["--cprofile-output", "out.prof", "availability", "add"],
+            ["--profile-output=out.json", "--profile-memory", "availability", "add"],
+        ]:
+            with self.subTest(command=command):
+                modules = imported_modules(command)
+                self.assertIn("WMan.CLI.availability", modules)
+                for name in ["product", "order", "customer", "report", "maintenance"]:
+                    self.assertNotIn(f"WMan.CLI.{name}", modules)
+
+    def test_help_lists_every_sub_app(self):
+        modules = imported_modules(["--help"])
+        for name in ["product", "availability", "order", "customer", "report"]:
+            self.assertIn(f"WMan.CLI.{name}", modules)
@@ -0,0 +1,438 @@
+import contextlib
+import csv
+import datetime
+import io
+import os
+import tempfile
+
+from WMan.CustomerManager import CustomerManager
+from WMan.database import (
+    Customer,
+    MovementReason,
+    Order,
+    OrderProduct,
+    OrderProductInfo,
+    Paging,
+    Product,
+    ProductInfo,
+    StockMovement,
+    StockSnapshot,
+    create_tables,
+    db,
+    rebuild_sales_rollups,
+)
+from WMan.OrderManager import OrderIO, OrderManager, OrderProductIndexes, OrdersIO
+from WMan.ProductManager import (
+    AVAILABILITY_COLUMNS,
+    AVAILABILITY_FIELDS,
+    ColumnIndexes,
+    ProductManager,
+)
+from WMan.ReportManager import ReportManager, SalesGroup
+from WMan.sheetutils.stream import OutputFormat
+from test.dbutils import DatabaseTestCase, count_statements
+
+# Every operation is run on warehouses of these sizes, and must stay within
+# the same budget on all of them
+SIZES = (3, 40)
+
+CATALOGUE_INDEXES = ColumnIndexes(
+    code_column=1,
+    count_in_carton_column=2,
+    description_column=3,
+    price_column=4,
+    brand_column=5,
+)
+COUNT_INDEXES = ColumnIndexes(code_column=1, count_column=2)
+ORDER_INDEXES = OrderProductIndexes(1, 2)
+
+
+class Warehouse:
+    """
+    size products, all of them in one large order of Ali's, and size
+    single-line orders of Sara's, plus an empty order. The stock enters the
+    ledger as opening balances.
+    """
+
+    def __init__(self, directory: str, size: int):
+        self.directory = directory
+        self.codes = [f"P{index:03d}" for index in range(size)]
+        Product.insert_many(
+            [
+                (code, f"Product {code}", "AB"[index % 2], 6, 100 + index, 1000)
+                for index, code in enumerate(self.codes)
+            ],
+            fields=Product.info_fields(),
+        ).execute()
+        ali = Customer.add("Ali")
+        sara = Customer.add("Sara")
+        self.order_id = Order.create(customer=ali, date=datetime.date(2024, 1, 1)).id
+        self.empty_order_id = Order.create(customer=ali).id
+        Order.insert_many(
+            [(sara.id, datetime.date(2024, 2, 1))] * size,
+            fields=[Order.customer, Order.date],
+        ).execute()
+        lines = [(self.order_id, code, 2) for code in self.codes]
+        sara_orders = range(self.empty_order_id + 1, self.empty_order_id + size + 1)
+        lines += [(order_id, code, 1) for order_id, code in zip(sara_orders, self.codes)]
+        OrderProduct.insert_many(
+            lines, fields=[OrderProduct.order, OrderProduct.product, OrderProduct.count]
+        ).execute()
+        Order.refresh_totals()
+        rebuild_sales_rollups()
+        StockMovement.record_opening_balances()
+
+        self.catalogue = self.write(
+            "catalogue.csv",
+            [
+                [number, code, 12, f"New {code}", 500, "C"]
+                for number, code in enumerate(self.codes, 1)
+            ],
+        )
+        self.counts = self.write(
+            "counts.csv",
+            [[number, code, 1] for number, code in enumerate(self.codes, 1)],
+        )
+        self.output = os.path.join(directory, "output")
+
+    def write(self, name: str, rows: list[list]) -> str:
+        path = os.path.join(self.directory, name)
+        with open(path, "w", newline="") as file:
+            csv.writer(file).writerows([["Row", "Code", "A", "B", "C", "D"]] + rows)
+        return path
+
+    def order(self) -> OrderManager:
+        return OrderManager.from_id(self.order_id)
+
+
+class StatementBudgetTestCase(DatabaseTestCase):
+    def assertBudget(self, budget: int, operation) -> None:
+        """
+        Run the operation on a fresh warehouse of every size in SIZES and
+        check it stays within budget statements on each.
+        """
+        for size in SIZES:
+            with self.subTest(size=size):
+                db.close()
+                db.init(":memory:")
+                db.connect()
+                create_tables()
+                with tempfile.TemporaryDirectory() as directory:
+                    warehouse = Warehouse(directory, size)
+                    output = io.StringIO()
+                    with contextlib.redirect_stdout(output):
+                        with self.assertMaxStatements(budget):
+                            operation(warehouse)
+
+
+class TestProductManagerBudgets(StatementBudgetTestCase):
+    def test_single_products(self):
+        self.assertBudget(
+            1, lambda w: ProductManager.add(ProductInfo("NEW", "New", "C", 1, 10))
+        )
+        self.assertBudget(7, lambda w: ProductManager.remove(w.codes[0]))
+        self.assertBudget(
+            4, lambda w: ProductManager.update(ProductInfo(w.codes[0], price=999))
+        )
+        self.assertBudget(
+            2, lambda w: ProductManager.add_count(ProductInfo(w.codes[0], count=1))
+        )
+        self.assertBudget(
+            2, lambda w: ProductManager.reduce_count(ProductInfo(w.codes[0], count=1))
+        )
+
+    def test_batches(self):
+        self.assertBudget(
+            4, lambda w: ProductManager.add_batch(w.catalogue, CATALOGUE_INDEXES)
+        )
+        self.assertBudget(
+            4, lambda w: ProductManager.update_batch(w.catalogue, CATALOGUE_INDEXES)
+        )
+        self.assertBudget(
+            3, lambda w: ProductManager.add_count_batch(w.counts, COUNT_INDEXES)
+        )
+        self.assertBudget(
+            3, lambda w: ProductManager.reduce_count_batch(w.counts, COUNT_INDEXES)
+        )
+        for insert_missing in (False, True):
+            with self.subTest(insert_missing=insert_missing):
+                self.assertBudget(
+                    4,
+                    lambda w: ProductManager.load_catalogue(
+                        w.catalogue, CATALOGUE_INDEXES, insert_missing
+                    ),
+                )
+        for reduce in (False, True):
+            with self.subTest(reduce=reduce):
+                self.assertBudget(
+                    3,
+                    lambda w: ProductManager.adjust_count_batch(
+                        w.counts, COUNT_INDEXES, reduce
+                    ),
+                )
+
+    def test_listings(self):
+        self.assertBudget(1, lambda w: ProductManager.get_page({}))
+        self.assertBudget(
+            2, lambda w: ProductManager.get_page({}, Paging("price", limit=2))
+        )
+        self.assertBudget(
+            1, lambda w: list(ProductManager.iter_pages({}, page_size=100))
+        )
+        self.assertBudget(1, lambda w: ProductManager.list_products())
+        self.assertBudget(
+            2,
+            lambda w: ProductManager.list_products(
+                w.output, {"brand": "A"}, paging=Paging("brand", limit=10)
+            ),
+        )
+        self.assertBudget(
+            1,
+            lambda w: ProductManager.list_products(output_format=OutputFormat.jsonl),
+        )
+        self.assertBudget(1, lambda w: ProductManager.list_availability())
+        self.assertBudget(1, lambda w: ProductManager.list_availability(w.output))
+        self.assertBudget(
+            1,
+            lambda w: ProductManager.stream_products(
+                {},
+                Paging("count", limit=10),
+                AVAILABILITY_FIELDS,
+                AVAILABILITY_COLUMNS,
+                OutputFormat.csv,
+            ),
+        )
+        self.assertBudget(1, lambda w: ProductManager.get_availability(w.codes))
+        self.assertBudget(
+            2,
+            lambda w: ProductManager.list_availability_before(
+                datetime.datetime(9999, 1, 1), w.output
+            ),
+        )
+        self.assertBudget(1, lambda w: ProductManager.search(w.codes[0], limit=None))
+        self.assertBudget(
+            1, lambda w: ProductManager.search("p", output_format=OutputFormat.csv)
+        )
+
+    def test_output_only(self):
+        products = [ProductInfo("P1", "Product", "A", 1, 100, 2)]
+        self.assertBudget(0, lambda w: ProductManager.print_products(products))
+        self.assertBudget(0, lambda w: ProductManager.print_availability(products))
+        self.assertBudget(
+            0, lambda w: ProductManager.save_products(w.output, products)
+        )
+        self.assertBudget(
+            0, lambda w: ProductManager.save_availability(w.output, products)
+        )
+
+
+class TestOrderManagerBudgets(StatementBudgetTestCase):
+    def test_orders(self):
+        self.assertBudget(
+            2, lambda w: OrderManager.new("Ali", datetime.date(2024, 3, 1))
+        )
+        self.assertBudget(1, lambda w: OrderManager.from_id(w.order_id))
+        self.assertBudget(10, lambda w: OrderManager.rebuild_totals())
+
+    def test_lines(self):
+        line = OrderProductInfo("P000", 1)
+        self.assertBudget(
+            7,
+            lambda w: OrderManager.from_id(w.empty_order_id).add_product(line),
+        )
+        self.assertBudget(8, lambda w: w.order().remove_product(line))
+        self.assertBudget(7, lambda w: w.order().add_count(line))
+        self.assertBudget(8, lambda w: w.order().reduce_count(line))
+
+    def test_batches(self):
+        for operation in ("add", "remove", "add_count", "reduce_count"):
+            with self.subTest(operation=operation):
+                order_id = "empty_order_id" if operation == "add" else "order_id"
+                self.assertBudget(
+                    11,
+                    lambda w: OrderManager.from_id(getattr(w, order_id)).apply_batch(
+                        w.counts, ORDER_INDEXES, operation
+                    ),
+                )
+
+    def test_listings(self):
+        self.assertBudget(3, lambda w: w.order().get_products())
+        self.assertBudget(1, lambda w: OrderManager.get_orders({"customer": "Sara"}))
+        self.assertBudget(1, lambda w: OrderManager.get_page({}))
+        self.assertBudget(
+            1, lambda w: OrderManager.get_page({}, Paging("total_price", limit=5))
+        )
+        self.assertBudget(1, lambda w: list(OrderManager.iter_pages(page_size=100)))
+        self.assertBudget(
+            1, lambda w: OrderManager.write_orders(OutputFormat.jsonl)
+        )
+        self.assertBudget(
+            3, lambda w: w.order().write_products(OutputFormat.csv)
+        )
+        self.assertBudget(
+            1, lambda w: OrdersIO(OrderManager.get_page({}).items).print_orders()
+        )
+        self.assertBudget(
+            3, lambda w: OrderIO(w.order().get_products()).print_products()
+        )
+        self.assertBudget(
+            3, lambda w: OrderIO(w.order().get_products()).save_products(w.output)
+        )
+
+
+class TestCustomerManagerBudgets(StatementBudgetTestCase):
+    def test_customers(self):
+        self.assertBudget(2, lambda w: CustomerManager.create("Reza"))
+        self.assertBudget(1, lambda w: CustomerManager.list({}))
+        self.assertBudget(1, lambda w: CustomerManager.list({}, OutputFormat.csv))
+
+
+class TestReportManagerBudgets(StatementBudgetTestCase):
+    def test_sales(self):
+        filters = {"start_date": datetime.date(2024, 1, 1)}
+        for group_by in SalesGroup:
+            with self.subTest(group_by=group_by):
+                self.assertBudget(
+                    1, lambda w: ReportManager.report_sales(group_by, filters)
+                )
+        self.assertBudget(
+            1,
+            lambda w: ReportManager.report_sales(
+                SalesGroup.product, output=w.output
+            ),
+        )
+        self.assertBudget(
+            1,
+            lambda w: ReportManager.report_sales(
+                SalesGroup.month, output_format=OutputFormat.json
+            ),
+        )
+
+
+class TestModelBudgets(StatementBudgetTestCase):
+    def test_product(self):
+        self.assertBudget(2, lambda w: Product.add_count(w.codes[0], 1))
+        self.assertBudget(2, lambda w: Product.reduce_count(w.codes[0], 1))
+        self.assertBudget(
+            3,
+            lambda w: Product.adjust_count_batch(
+                [(number, code, 1) for number, code in enumerate(w.codes)]
+            ),
+        )
+        self.assertBudget(
+            2,
+            lambda w: Product.apply_count_deltas(
+                {code: 1 for code in w.codes}, MovementReason.receipt
+            ),
+        )
+        self.assertBudget(
+            4,
+            lambda w: Product.upsert_batch(
+                ProductInfo(code, price=1) for code in w.codes + ["NEW"]
+            ),
+        )
+        self.assertBudget(1, lambda w: Product.add(ProductInfo("NEW")))
+        self.assertBudget(7, lambda w: Product.remove(w.codes[0]))
+        self.assertBudget(1, lambda w: Product.get_count(w.codes[0]))
+        self.assertBudget(1, lambda w: Product.get_filtered({"min_price": 101}))
+        self.assertBudget(1, lambda w: Product.get_product_infos(w.codes))
+        self.assertBudget(
+            1, lambda w: list(Product.get_filtered_rows({}, *Product.info_fields()))
+        )
+        self.assertBudget(
+            2, lambda w: list(Product.get_page({}, Paging("brand", limit=100)))
+        )
+        self.assertBudget(1, lambda w: Product.get_product_info(w.codes[0]))
+
+    def test_stock_ledger(self):
+        self.assertBudget(
+            1,
+            lambda w: StockMovement.record(
+                {code: 1 for code in w.codes}, MovementReason.receipt
+            ),
+        )
+        self.assertBudget(
+            2,
+            lambda w: list(
+                StockMovement.counts_before(datetime.datetime(9999, 1, 1))
+            ),
+        )
+        self.assertBudget(
+            2, lambda w: Product.get_infos_before(datetime.datetime(9999, 1, 1))
+        )
+        self.assertBudget(
+            6, lambda w: (Product.add_count(w.codes[0], 1), StockSnapshot.take())
+        )
+
+    def test_customer(self):
+        self.assertBudget(2, lambda w: Customer.add("Reza"))
+        self.assertBudget(1, lambda w: Customer.does_customer_exist("Ali"))
+        self.assertBudget(1, lambda w: Customer.get_customer_id("Ali"))
+        self.assertBudget(1, lambda w: list(Customer.get_filtered({})))
+        self.assertBudget(1, lambda w: list(Customer.get_filtered_rows({})))
+
+    def test_order(self):
+        self.assertBudget(2, lambda w: Order.new("Sara", datetime.date(2024, 3, 1)))
+        self.assertBudget(
+            6, lambda w: Order.add_product(w.empty_order_id, w.codes[0], 1)
+        )
+        self.assertBudget(
+            7, lambda w: Order.remove_product(w.order_id, w.codes[0])
+        )
+        self.assertBudget(
+            6, lambda w: Order.add_count_product(w.order_id, w.codes[0], 1)
+        )
+        self.assertBudget(
+            7, lambda w: Order.reduce_count_product(w.order_id, w.codes[0], 1)
+        )
+        self.assertBudget(
+            9,
+            lambda w: Order.apply_batch(
+                w.order_id,
+                [(number, code, 1) for number, code in enumerate(w.codes)],
+                "add_count",
+            ),
+        )
+        self.assertBudget(
+            3, lambda w: Order.add_to_totals(w.order_id, w.codes[0], 1)
+        )
+        self.assertBudget(1, lambda w: Order.refresh_totals())
+        self.assertBudget(2, lambda w: Order.refresh_totals(w.codes))
+        self.assertBudget(1, lambda w: Order.get_filtered({"min_price": 1}))
+        self.assertBudget(1, lambda w: list(Order.get_filtered_rows({})))
+        self.assertBudget(
+            1, lambda w: list(Order.get_page({}, Paging("date", limit=100)))
+        )
+        self.assertBudget(1, lambda w: Order.get_order_products(w.order_id))
+        self.assertBudget(2, lambda w: Order.get_order_product_infos(w.order_id))
+        self.assertBudget(
+            2, lambda w: list(Order.get_order_product_rows(w.order_id, Product.id))
+        )
+        self.assertBudget(1, lambda w: list(Order.get_line_rows({})))
+        self.assertBudget(1, lambda w: Order.get_order_total_count(w.order_id))
+        self.assertBudget(1, lambda w: Order.get_order_total_price(w.order_id))
+
+    def test_order_product(self):
+        self.assertBudget(
+            1, lambda w: OrderProduct.find_by_ids(w.order_id, w.codes[0])
+        )
+        self.assertBudget(1, lambda w: OrderProduct.get_count(w.order_id, w.codes[0]))
+        self.assertBudget(
+            1, lambda w: OrderProduct.delete_lines(w.order_id, w.codes)
+        )
+
+
+class TestCountStatements(DatabaseTestCase):
+    def test_counts_every_statement(self):
+        Product.add(ProductInfo("P1"))
+        with count_statements() as statements:
+            Product.get_count("P1")
+            Product.add_count("P1", 1)
+        self.assertEqual(len(statements), 3)
+        self.assertTrue(statements[0].startswith("SELECT"))
+
+    def test_over_budget_fails(self):
+        Product.add(ProductInfo("P1"))
+        with self.assertRaises(AssertionError):
+            with self.assertMaxStatements(0):
+                Product.get_count("P1")
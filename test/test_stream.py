@@ -0,0 +1,60 @@
+import contextlib
+import datetime
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from WMan.sheetutils.stream import OutputFormat, write_rows
+
+COLUMNS = ["code", "description", "date"]
+ROWS = [
+    ("P1", 'Say "hi", ok', datetime.date(2024, 1, 1)),
+    ("P2", "کالا", None),
+]
+
+
+class TestWriteRows(unittest.TestCase):
+    def test_jsonl_to_stdout(self):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            row_count = write_rows(iter(ROWS), COLUMNS, OutputFormat.jsonl)
+
+        self.assertEqual(row_count, 2)
+        self.assertEqual(
+            [json.loads(line) for line in stdout.getvalue().splitlines()],
+            [
+                {"code": "P1", "description": 'Say "hi", ok', "date": "2024-01-01"},
+                {"code": "P2", "description": "کالا", "date": None},
+            ],
+        )
+
+    def test_json_array(self):
+        expected = [
+            {"code": "P1", "description": 'Say "hi", ok', "date": "2024-01-01"},
+            {"code": "P2", "description": "کالا", "date": None},
+        ]
+        for rows, expected in [(ROWS, expected), ([], [])]:
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                row_count = write_rows(iter(rows), COLUMNS, OutputFormat.json)
+
+            self.assertEqual(row_count, len(expected))
+            self.assertEqual(json.loads(stdout.getvalue()), expected)
+
+    def test_csv_to_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, "rows.csv")
+            write_rows(iter(ROWS), COLUMNS, OutputFormat.csv, filepath)
+            with open(filepath, encoding="utf-8", newline="") as file:
+                content = file.read()
+
+        self.assertEqual(
+            content,
+            'code,description,date\r\nP1,"Say ""hi"", ok",2024-01-01\r\nP2,کالا,\r\n',
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
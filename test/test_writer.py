@@ -0,0 +1,140 @@
+import os
+import tempfile
+import unittest
+
+from openpyxl import load_workbook
+
+from WMan.sheetutils.writer import (
+    ColumnWidthTracker,
+    SheetWriter,
+    StreamingSheetWriter,
+)
+
+DATA = [
+    ["P001", "Product 1", "BrandA", 10, 1000, 16000, 16],
+    ["P0028", "A much longer description", None, 20, 1234567890, 2469135780, 2],
+    ["P3", "Product 3", "BrandC", 100, 10000, 270000, 27],
+]
+HEADERS = ["Code", "Description", "Brand", "CIC", "Price", "Total Price", "Count"]
+
+
+def describe(filepath: str):
+    sheet = load_workbook(filepath).active
+    cells = {
+        cell.coordinate: (cell.value, cell.style, cell.number_format, cell.font.b)
+        for row in sheet.iter_rows()
+        for cell in row
+        if cell.value is not None
+    }
+    tables = [
+        (
+            table.displayName,
+            table.ref,
+            table.tableStyleInfo.name,
+            table.tableStyleInfo.showColumnStripes,
+            [column.name for column in table.tableColumns],
+            table.autoFilter.ref,
+        )
+        for table in sheet.tables.values()
+    ]
+    widths = {
+        letter: dimension.width
+        for letter, dimension in sheet.column_dimensions.items()
+    }
+    return cells, sorted(map(str, sheet.merged_cells.ranges)), tables, widths
+
+
+class TestColumnWidthTracker(unittest.TestCase):
+    def test_sample_and_cap(self):
+        tracker = ColumnWidthTracker(sample=2, max_width=10)
+        tracker.add_row(["P1", None, 100])
+        tracker.add_row(["P0028", "A much longer description"])
+        tracker.add_row(["A code past the sample", "Short", 1])
+        tracker.insert_column(0, len("Row index"))
+
+        self.assertEqual(tracker.widths(), [10, 7, 10, 5])
+
+    def test_sheet_writer_matches_full_scan(self):
+        writer = SheetWriter()
+        writer.add_data(DATA)
+        writer.add_headers(HEADERS)
+        writer.add_row_index_column()
+        writer.add_header("Availability list")
+
+        scanned = [
+            max(len(str(cell.value)) for cell in column if cell.value is not None)
+            + 2
+            for column in writer.sheet.columns
+        ]
+        self.assertEqual(writer.widths.widths(), scanned)
+
+
+class TestStreamingSheetWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.old_path = os.path.join(self.directory.name, "old.xlsx")
+        self.new_path = os.path.join(self.directory.name, "new.xlsx")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_matches_sheet_writer(self):
+        # The sequence ProductManager.save_availability used to run
+        writer = SheetWriter()
+        writer.add_data(DATA)
+        writer.add_headers(HEADERS)
+        writer.add_row_index_column()
+        writer.set_optimal_column_widths()
+        writer.add_subheader("Cool", "Subheader")
+        writer.add_header("Availability list")
+        writer.make_table("Availability", start_row=3)
+        writer.set_column_currency_format(7)
+        writer.set_column_currency_format(6)
+        writer.save(self.old_path)
+
+        streaming_writer = StreamingSheetWriter(
+            HEADERS,
+            header="Availability list",
+            subheader=("Cool", "Subheader"),
+            table_name="Availability",
+            currency_columns=[6, 7],
+            fit_titles=False,
+            width_sample=2,
+        )
+        streaming_writer.add_data(iter(DATA))
+        streaming_writer.save(self.new_path)
+
+        self.assertEqual(describe(self.old_path), describe(self.new_path))
+
+    def test_titles_and_no_rows(self):
+        writer = StreamingSheetWriter(
+            ["Code"], header="A long product list title", table_name="Empty"
+        )
+        writer.save(self.new_path)
+
+        cells, merged, tables, widths = describe(self.new_path)
+        self.assertEqual(cells["A2"][0], "Row index")
+        self.assertEqual(merged, ["A1:B1"])
+        self.assertEqual(tables[0][1], "A2:B2")
+        self.assertEqual(widths["A"], len("A long product list title") + 2)
+
+    def test_width_sample(self):
+        data = DATA + [["A code only the last row has", None, None, 1, 1, 1, 1]]
+        for width_sample, max_width, expected in [
+            (2, None, len("P0028") + 2),
+            (None, None, len("A code only the last row has") + 2),
+            (None, 12, 12),
+        ]:
+            writer = StreamingSheetWriter(
+                HEADERS, width_sample=width_sample, max_width=max_width
+            )
+            writer.add_data(data)
+            writer.save(self.new_path)
+
+            cells, merged, tables, widths = describe(self.new_path)
+            self.assertEqual(widths["B"], expected)
+            self.assertEqual(cells["B5"][0], "A code only the last row has")
+
+
+if __name__ == "__main__":
+    unittest.main()